@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Times the QCTable group-by summaries on testdata scaled up to many synthetic runs, against the same
+# aggregations written as Python loops over the result dicts, as the QC reports do today.
+#
+# Usage: python benchmarks/bench_analytics.py [--runs 300]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scgpm_lims.components.analytics import QCTable
+from scgpm_lims.components.local import LocalDataManager
+from bench_local_index import RUN, scale
+
+
+def loopsummaries(runinfos, laneresults, mapperresults):
+    lane_yield = {}
+    barcodes = {}
+    aligned = {}
+    for run, results in laneresults.items():
+        lanes = dict((str(lane['id']), number) for number, lane in runinfos[run]['run_info']['lanes'].items())
+        for laneresult in results.values():
+            if laneresult['read_number'] != 1 or not laneresult['active']:
+                continue
+            key = (run, lanes[str(laneresult['solexa_lane_id'])])
+            if laneresult['codepoint'] is None:
+                lane_yield[key] = lane_yield.get(key, 0) + laneresult['pass_read_count']
+            else:
+                barcodes.setdefault(key, {})[laneresult['codepoint']] = laneresult['pass_read_count']
+        for mapperresult in mapperresults[run].values():
+            laneresult = results.get(str(mapperresult['dataset_id']))
+            if laneresult is not None and mapperresult['rank'] == 1 and laneresult['read_number'] == 1:
+                key = (run, lanes[str(laneresult['solexa_lane_id'])], laneresult['codepoint'])
+                counts = aligned.setdefault(key, [0, 0])
+                counts[0] += mapperresult['aligned_read_count']
+                counts[1] += laneresult['pass_read_count']
+    shares = dict((key, dict((barcode, count / sum(counts.values())) for barcode, count in counts.items()))
+                  for key, counts in barcodes.items())
+    rates = dict((key, counts[0] / counts[1]) for key, counts in aligned.items())
+    return lane_yield, shares, rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark vectorized QC summaries.')
+    parser.add_argument('--runs', type=int, default=300)
+    args = parser.parse_args()
+
+    local = LocalDataManager()
+    runs = [RUN] + scale(local, args.runs)
+    runinfos = dict((run, local.getruninfo(run)) for run in runs)
+    laneresults = dict((run, local.indexlaneresults(run)) for run in runs)
+    mapperresults = dict((run, local.indexmapperresults(run)) for run in runs)
+    print('runs=%s laneresults=%s mapperresults=%s' % (len(runs), sum(map(len, laneresults.values())), sum(map(len, mapperresults.values()))))
+
+    start = time.perf_counter()
+    loopsummaries(runinfos, laneresults, mapperresults)
+    print('python loops:          %8.1f ms' % (1000 * (time.perf_counter() - start)))
+
+    start = time.perf_counter()
+    table = QCTable(runinfos, laneresults, mapperresults)
+    print('building the QCTable:  %8.1f ms' % (1000 * (time.perf_counter() - start)))
+
+    start = time.perf_counter()
+    table.lane_yield()
+    table.barcode_representation()
+    table.mapping_rates()
+    print('vectorized summaries:  %8.1f ms' % (1000 * (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+# Measures the cost of recording LIMS calls to a cassette (against the stand-in LIMS, with and without
+# recording) and of replaying them: opening the cassette, the raw fingerprint lookup, and a full replayed
+# Connection call.
+#
+# Usage: python benchmarks/bench_cassette.py [--requests 500]
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scgpm_lims.components.cassette import Cassette
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.standin import StandInLims
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+def timecalls(conn, ids):
+    start = time.perf_counter()
+    for id in ids:
+        conn.showlaneresult(id)
+    return (time.perf_counter() - start) / len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark cassette recording and replay.')
+    parser.add_argument('--requests', type=int, default=500)
+    args = parser.parse_args()
+
+    laneresultids = list(LocalDataManager().indexlaneresults(RUN))
+    ids = [laneresultids[i % len(laneresultids)] for i in range(args.requests)]
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'lims.cassette')
+    try:
+        with StandInLims() as lims:
+            with Connection(lims_url=lims.url, lims_token='x') as conn:
+                plain = timecalls(conn, ids)
+            with Connection(lims_url=lims.url, lims_token='x', cassette=path, cassette_mode='record') as conn:
+                recorded = timecalls(conn, ids)
+        print('live call:      %8.1f us' % (1e6 * plain))
+        print('recorded call:  %8.1f us  (%+.1f us)' % (1e6 * recorded, 1e6 * (recorded - plain)))
+
+        start = time.perf_counter()
+        cassette = Cassette(path)
+        print('open:           %8.1f ms for %s entries, %s bytes' % (1000 * (time.perf_counter() - start), len(cassette), os.path.getsize(path)))
+        fingerprints = [cassette.fingerprint('GET', 'http://x/api/v1/solexa_lane_results/%s' % id) for id in ids]
+        start = time.perf_counter()
+        for fingerprint in fingerprints:
+            cassette.lookup(fingerprint)
+        print('lookup:         %8.1f us' % (1e6 * (time.perf_counter() - start) / len(ids)))
+        cassette.close()
+
+        with Connection(cassette=path) as conn:
+            print('replayed call:  %8.1f us' % (1e6 * timecalls(conn, ids)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+# Drives the real Connection (or AsyncConnection) with concurrent load against the stand-in LIMS, running in a
+# separate process so it doesn't compete with the client for the GIL, and reports requests/second and tail
+# latencies, overall and per endpoint. Latency and errors can be injected into the stand-in.
+#
+# Usage: python benchmarks/bench_load.py [--threads 8] [--duration 10] [--latency 0.005] [--jitter 0.01]
+#                                        [--error-rate 0.01] [--async] [--concurrency 64]
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.standin import StandInLims
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+# Relative frequency of each call in the load, roughly what the analysis pipeline and QC reports do.
+MIX = (
+    ('getruninfo', 4),
+    ('showlaneresult', 8),
+    ('getsamplesheet', 2),
+    ('indexpipelineruns', 2),
+    ('indexmapperresults', 1),
+    ('indexlaneresults', 1),
+    )
+
+
+def serve(pipe, latency, jitter, error_rate, seed):
+    lims = StandInLims(latency=latency, jitter=jitter, error_rate=error_rate, seed=seed)
+    pipe.send(lims.url)
+    lims.serve_forever()
+
+
+def calls(laneresultids):
+    # Each call takes a connection and returns an awaitable for AsyncConnection, or the result for Connection.
+    return {
+        'getruninfo': lambda conn: conn.getruninfo(RUN),
+        'showlaneresult': lambda conn: conn.showlaneresult(random.choice(laneresultids)),
+        'getsamplesheet': lambda conn: conn.getsamplesheet(RUN, 2, lane=random.randint(1, 8), filename=None),
+        'indexpipelineruns': lambda conn: conn.indexpipelineruns(RUN),
+        'indexmapperresults': lambda conn: conn.indexmapperresults(RUN),
+        'indexlaneresults': lambda conn: conn.indexlaneresults(RUN),
+        }
+
+
+def schedule(count):
+    names = [name for name, weight in MIX for i in range(weight)]
+    return [random.choice(names) for i in range(count)]
+
+
+def runthreads(conn, table, threads, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        names = schedule(1000)
+        mine = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                table[rng.choice(names)](conn)
+            except Exception:
+                failed += 1
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, range(threads)))
+    return latencies, errors[0]
+
+
+async def runasync(conn, table, concurrency, duration):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(seed):
+        nonlocal errors
+        rng = random.Random(seed)
+        names = schedule(1000)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                await table[rng.choice(names)](conn)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(latencies, errors, elapsed, metrics):
+    latencies.sort()
+    print('calls=%s errors=%s elapsed=%.1fs' % (len(latencies), errors, elapsed))
+    print('throughput: %8.1f calls/s' % (len(latencies) / elapsed))
+    print('latency ms: p50 %.1f  p95 %.1f  p99 %.1f  max %.1f' % tuple(1000 * value for value in (
+        percentile(latencies, 0.5), percentile(latencies, 0.95), percentile(latencies, 0.99), latencies[-1])))
+    print()
+    print('%-28s %6s %7s %9s %8s %8s %8s %8s' % ('endpoint', 'status', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'retries'))
+    for series in metrics:
+        latency = series['latency']
+        print('%-28s %6s %7d %9.1f %8.1f %8.1f %8.1f %8d' % (
+            '%s %s' % (series['method'], series['endpoint']), series['status'], series['count'], series['per_second'],
+            1000 * latency['p50'], 1000 * latency['p95'], 1000 * latency['p99'], series['retries']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the LIMS client against the stand-in LIMS.')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Use AsyncConnection instead of threads.')
+    parser.add_argument('--concurrency', type=int, default=64, help='Concurrent calls with --async.')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    laneresultids = list(LocalDataManager().indexlaneresults(RUN))
+    table = calls(laneresultids)
+
+    ours, theirs = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(theirs, args.latency, args.jitter, args.error_rate, args.seed), daemon=True)
+    server.start()
+    url = ours.recv()
+    options = dict(lims_url=url, lims_token='x', metrics=True, retries=args.retries)
+
+    try:
+        start = time.perf_counter()
+        if args.use_async:
+            from scgpm_lims.components.asyncconnection import AsyncConnection
+            async def run():
+                async with AsyncConnection(pool_limit=args.concurrency, **options) as conn:
+                    return await runasync(conn, table, args.concurrency, args.duration), conn.metrics()
+            (latencies, errors), metrics = asyncio.run(run())
+            print('async concurrency=%s' % args.concurrency)
+        else:
+            with Connection(pool_maxsize=args.threads, **options) as conn:
+                latencies, errors = runthreads(conn, table, args.threads, args.duration)
+                metrics = conn.metrics()
+            print('threads=%s' % args.threads)
+        report(latencies, errors, time.perf_counter() - start, metrics)
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
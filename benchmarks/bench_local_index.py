@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Times LocalDataManager index queries on testdata scaled up to many synthetic runs, against the full-table
+# scans the local store used before it kept secondary indexes.
+#
+# Usage: python benchmarks/bench_local_index.py [--runs 300]
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scgpm_lims.components.local import LocalDataManager
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+def scale(local, runs):
+    # Clones the template run with fresh ids for the run, its lanes, lane results and mapper results.
+    template = local.getruninfo(RUN)
+    laneresults = local.indexlaneresults(RUN)
+    mapperresults = local.indexmapperresults(RUN)
+    pipelineruns = local.indexpipelineruns(RUN)
+    names = []
+    for n in range(1, runs):
+        offset = n * 10**7
+        name = '%s_%s' % (RUN, n)
+        runinfo = copy.deepcopy(template)
+        runinfo['id'] += offset
+        for lane in runinfo['run_info']['lanes'].values():
+            lane['id'] += offset
+        local.addruninfo(name, runinfo)
+        for pipelinerun in pipelineruns.values():
+            local.addpipelinerun(pipelinerun['id'] + offset, dict(pipelinerun, id=pipelinerun['id'] + offset, solexa_run_id=runinfo['id']))
+        for laneresult in laneresults.values():
+            local.addlaneresult(laneresult['id'] + offset, dict(laneresult, id=laneresult['id'] + offset, solexa_lane_id=laneresult['solexa_lane_id'] + offset))
+        for mapperresult in mapperresults.values():
+            local.addmapperresult(mapperresult['id'] + offset, dict(mapperresult, id=mapperresult['id'] + offset, dataset_id=mapperresult['dataset_id'] + offset))
+        names.append(name)
+    return names
+
+
+def scanmapperresults(local, run):
+    # The query as it was implemented before the indexes: scan lane results, then scan mapper results
+    # against a list of lane result ids.
+    laneids = [str(lane['id']) for lane in local.getruninfo(run)['run_info']['lanes'].values()]
+    laneresultids = [id for id, laneresult in local._laneresults.items() if str(laneresult.get('solexa_lane_id')) in laneids]
+    return dict((id, mapperresult) for id, mapperresult in local._mapperresults.items() if str(mapperresult.get('dataset_id')) in laneresultids)
+
+
+def timequeries(query, local, runs):
+    start = time.perf_counter()
+    for run in runs:
+        query(local, run)
+    return (time.perf_counter() - start) / len(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark LocalDataManager index queries.')
+    parser.add_argument('--runs', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=20)
+    args = parser.parse_args()
+
+    local = LocalDataManager()
+    names = scale(local, args.runs)
+    queried = names[::max(1, len(names) // args.queries)][:args.queries]
+    assert scanmapperresults(local, queried[0]) == local.indexmapperresults(queried[0])
+
+    print('runs=%s laneresults=%s mapperresults=%s' % (args.runs, len(local._laneresults), len(local._mapperresults)))
+    print('indexmapperresults, full scan: %10.3f ms/query' % (1000 * timequeries(scanmapperresults, local, queried)))
+    print('indexmapperresults, indexed:   %10.3f ms/query' % (1000 * timequeries(lambda local, run: local.indexmapperresults(run), local, queried)))
+    print('indexlaneresults, indexed:     %10.3f ms/query' % (1000 * timequeries(lambda local, run: local.indexlaneresults(run), local, queried)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Compares the memory held by lane results and mapper results as the plain dicts the API returns against the
+# compact record types in models.py, for a synthetic quarter's worth of objects cloned from the testdata.
+#
+# Usage: python benchmarks/bench_records.py [--copies 200]
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.models import MapperResult, SolexaLaneResult
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+def parse(blobs, recordclass):
+    # Parses each object from its JSON, as it would arrive from the LIMS, so no objects are shared between copies.
+    if recordclass is None:
+        return [json.loads(blob) for blob in blobs]
+    return [recordclass.from_dict(json.loads(blob)) for blob in blobs]
+
+
+def load(blobs, recordclass):
+    # Timed without tracemalloc, which slows allocation down, then measured with it.
+    start = time.perf_counter()
+    parse(blobs, recordclass)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    objects = parse(blobs, recordclass)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the memory of record types against dicts.')
+    parser.add_argument('--copies', type=int, default=200)
+    args = parser.parse_args()
+
+    local = LocalDataManager()
+    for name, objects, recordclass in (
+            ('laneresults', local.indexlaneresults(RUN), SolexaLaneResult),
+            ('mapperresults', local.indexmapperresults(RUN), MapperResult)):
+        blobs = []
+        for n in range(args.copies):
+            for obj in objects.values():
+                blobs.append(json.dumps(dict(obj, id=obj['id'] + n * 10**7, created_at='%s.%s' % (obj['created_at'], n))))
+        dictsize, dicttime = load(blobs, None)
+        recordsize, recordtime = load(blobs, recordclass)
+        print('%s: %s objects' % (name, len(blobs)))
+        print('  dicts:   %8.1f MB  %6.0f bytes/object  %6.2f s' % (dictsize / 1e6, dictsize / len(blobs), dicttime))
+        print('  records: %8.1f MB  %6.0f bytes/object  %6.2f s' % (recordsize / 1e6, recordsize / len(blobs), recordtime))
+
+
+if __name__ == '__main__':
+    main()
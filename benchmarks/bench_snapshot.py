@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Compares the startup time and resident memory of a local_only process reading testdata from the JSON files
+# against reading it from a snapshot file, on testdata scaled up to many synthetic runs. Each measurement runs in
+# a fresh process that opens the store and reads one run's runinfo, lane results and mapper results, like a
+# typical test does.
+#
+# Usage: python benchmarks/bench_snapshot.py [--runs 300]
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scgpm_lims.components.local import LocalDataManager
+from bench_local_index import RUN, scale
+
+PROCESS = """
+import os, resource, sys, time
+start = time.perf_counter()
+sys.path.insert(0, %(root)r)
+from scgpm_lims.components.local import LocalDataManager
+class TempDataManager(LocalDataManager):
+    _testdatadir = %(testdatadir)r
+if %(mode)r != 'none':
+    local = TempDataManager(snapshotfile=%(snapshotfile)r if %(mode)r == 'snapshot' else None)
+    local.getruninfo(%(run)r)
+    local.indexlaneresults(%(run)r)
+    local.indexmapperresults(%(run)r)
+# ru_maxrss survives exec on Linux, so it would include the parent's peak. VmHWM is this process's own peak.
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if os.path.exists('/proc/self/status'):
+    with open('/proc/self/status') as fp:
+        rss = int([line.split()[1] for line in fp if line.startswith('VmHWM:')][0])
+print(time.perf_counter() - start, rss)
+"""
+
+
+def measure(mode, testdatadir, snapshotfile, run, repeat):
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    code = PROCESS % dict(root=root, testdatadir=testdatadir, snapshotfile=snapshotfile, run=run, mode=mode)
+    results = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code]).decode().split()
+        results.append((float(output[0]), int(output[1])))
+    # Best of the repeats, to leave out noise from other processes.
+    return min(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON vs snapshot testdata startup.')
+    parser.add_argument('--runs', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    local = LocalDataManager()
+    names = scale(local, args.runs)
+    testdatadir = tempfile.mkdtemp()
+    try:
+        for collection, datafile in (('_runinfo', 'runinfo.json'), ('_samplesheets', 'samplesheets.json'),
+                                     ('_solexaruns', 'solexaruns.json'), ('_solexaflowcells', 'solexaflowcells.json'),
+                                     ('_pipelineruns', 'pipelineruns.json'), ('_laneresults', 'laneresults.json'),
+                                     ('_mapperresults', 'mapperresults.json')):
+            with open(os.path.join(testdatadir, datafile), 'w') as fp:
+                fp.write(json.dumps(dict(getattr(local, collection)), sort_keys=True, indent=4, separators=(',', ': ')))
+        snapshotfile = os.path.join(testdatadir, 'testdata.snapshot')
+        local.writesnapshot(snapshotfile)
+
+        jsonsize = sum(os.path.getsize(os.path.join(testdatadir, name)) for name in os.listdir(testdatadir) if name.endswith('.json'))
+        print('runs=%s laneresults=%s mapperresults=%s' % (args.runs, len(local._laneresults), len(local._mapperresults)))
+        print('json files: %.1f MB, snapshot: %.1f MB' % (jsonsize / 1e6, os.path.getsize(snapshotfile) / 1e6))
+
+        run = names[len(names) // 2]
+        basetime, baserss = measure('none', testdatadir, snapshotfile, run, args.repeat)
+        for mode in ('json', 'snapshot'):
+            elapsed, rss = measure(mode, testdatadir, snapshotfile, run, args.repeat)
+            print('%-8s startup: %8.1f ms   max rss: %8.1f MB (+%.1f MB over an empty process)' %
+                  (mode, 1000 * (elapsed - basetime), rss / 1024, (rss - baserss) / 1024))
+    finally:
+        shutil.rmtree(testdatadir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Compares requests/second for getruninfo against a local stand-in LIMS, once the way RemoteDataManager
+# used to do it (a new module-level requests.get, and so a new TCP connection, per call) and once through
+# the pooled keep-alive HttpTransport.
+#
+# Usage: python benchmarks/bench_transport.py [--requests 500] [--threads 1]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scgpm_lims.components.remote import RemoteDataManager
+from scgpm_lims.components.standin import StandInLims
+from scgpm_lims.components.transport import HttpTransport
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+def timecalls(call, count, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for i in range(count):
+            call()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda i: call(), range(count)))
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pooled vs unpooled LIMS transport.')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    server = StandInLims().start()
+    lims_url = server.url
+
+    unpooled = RemoteDataManager(apiversion='v1', lims_url=lims_url, lims_token='x')
+    def unpooledcall():
+        response = requests.get(unpooled.urlprefix + 'run_info', params={'token': unpooled.token, 'run': RUN})
+        unpooled._checkstatus(response)
+        return response.json()
+
+    transport = HttpTransport(pool_maxsize=max(10, args.threads))
+    pooled = RemoteDataManager(apiversion='v1', lims_url=lims_url, lims_token='x', transport=transport)
+    def pooledcall():
+        return pooled.getruninfo(RUN)
+
+    before = timecalls(unpooledcall, args.requests, args.threads)
+    after = timecalls(pooledcall, args.requests, args.threads)
+    pooled.close()
+    server.stop()
+
+    print('requests=%s threads=%s' % (args.requests, args.threads))
+    print('before (new connection per call): %8.1f requests/s' % before)
+    print('after  (pooled keep-alive):       %8.1f requests/s' % after)
+    print('speedup: %.2fx' % (after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,4 +2,5 @@
 Client API for UHTS LIMS of the Sequencing Center.
 """
 from scgpm_lims.components.connection import *
+from scgpm_lims.components.asyncconnection import *
 from scgpm_lims.components.models import *
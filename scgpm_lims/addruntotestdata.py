@@ -9,5 +9,5 @@ parser.add_argument('--lims_url')
 parser.add_argument('--lims_token')
 args = parser.parse_args()
 
-conn = Connection(lims_url=args.lims_url, lims_token=args.lims_token, testdata_update_mode=True, verbose=True)
-conn.getallrunobjects(run=args.run_name)
+with Connection(lims_url=args.lims_url, lims_token=args.lims_token, testdata_update_mode=True, verbose=True) as conn:
+    conn.getallrunobjects(run=args.run_name)
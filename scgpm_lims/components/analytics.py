@@ -0,0 +1,239 @@
+import importlib.util
+
+# numpy is imported on first use, like aiohttp in asyncremote, so that it stays an optional dependency.
+np = None
+
+
+def _numpy():
+    global np
+    if np is None:
+        if importlib.util.find_spec('numpy') is None:
+            raise Exception('scgpm_lims.components.analytics requires the numpy package. Install it with "pip install scgpm_lims[analytics]".')
+        import numpy
+        np = numpy
+    return np
+
+
+class QCTable:
+
+    # The lane results and mapper results of one or many runs, held as columnar numpy arrays, with group-by
+    # summaries for QC reports. Build it with QCTable.fromconnection(conn, runs), which fetches everything it
+    # needs concurrently, or from runinfo, lane result and mapper result dicts that were already fetched.
+    #
+    # laneresults and mapperresults are dicts of equal-length column arrays, one row per object. Runs and barcodes
+    # are stored as int codes into self.runs and self.barcodes; barcode code 0 is None, which the LIMS uses for
+    # the lane's total over all barcodes. Null counters are NaN. Each mapper result row has the row of its lane
+    # result in mapperresults['laneresult'], or -1 if its lane result isn't in the table.
+    #
+    # Each summary returns a dict of column arrays (pass it to pandas.DataFrame for a table). By default they
+    # use only active results from the latest pipeline run of each lane, and read 1, so that paired reads
+    # aren't counted twice.
+
+    MAPPERCOUNTERS = ('aligned_read_count', 'uniquely_aligned_read_count', 'non_uniquely_aligned_read_count',
+                      'pf_aligned_read_count', 'pf_uniquely_aligned_read_count', 'pf_non_uniquely_aligned_read_count')
+
+    def __init__(self, runinfos, laneresults, mapperresults):
+        """
+        Args : runinfos - dict of run name to runinfo.
+               laneresults - dict of run name to that run's lane results, as returned by Connection.indexlaneresults.
+               mapperresults - dict of run name to that run's mapper results, as returned by Connection.indexmapperresults.
+        """
+        np = _numpy()
+        self.runs = list(runinfos)
+        self.barcodes = [None]
+        barcodecodes = {None: 0}
+
+        rows = []
+        rowbyid = {}
+        for runcode, run in enumerate(self.runs):
+            lanes = dict((str(lane.get('id')), int(number)) for number, lane in runinfos[run]['run_info']['lanes'].items())
+            for id, laneresult in laneresults.get(run, {}).items():
+                barcode = laneresult.get('codepoint')
+                if barcode not in barcodecodes:
+                    barcodecodes[barcode] = len(self.barcodes)
+                    self.barcodes.append(barcode)
+                rowbyid[str(id)] = len(rows)
+                rows.append((runcode, lanes.get(str(laneresult.get('solexa_lane_id')), -1), barcodecodes[barcode],
+                             laneresult.get('read_number') or 0, laneresult.get('solexa_pipeline_run_id') or 0,
+                             bool(laneresult.get('active')), laneresult.get('pass_read_count'),
+                             laneresult.get('total_read_count')))
+        columns = list(zip(*rows)) or [()] * 8
+        self.laneresults = {
+            'run': np.array(columns[0], dtype=np.int64),
+            'lane': np.array(columns[1], dtype=np.int64),
+            'barcode': np.array(columns[2], dtype=np.int64),
+            'read_number': np.array(columns[3], dtype=np.int64),
+            'pipeline_run': np.array(columns[4], dtype=np.int64),
+            'active': np.array(columns[5], dtype=bool),
+            'pass_read_count': self._floats(columns[6]),
+            'total_read_count': self._floats(columns[7]),
+            }
+
+        rows = []
+        for run in self.runs:
+            for mapperresult in mapperresults.get(run, {}).values():
+                rows.append((rowbyid.get(str(mapperresult.get('dataset_id')), -1), mapperresult.get('rank') or 0,
+                             bool(mapperresult.get('active'))) + tuple(mapperresult.get(name) for name in self.MAPPERCOUNTERS))
+        columns = list(zip(*rows)) or [()] * (3 + len(self.MAPPERCOUNTERS))
+        self.mapperresults = {
+            'laneresult': np.array(columns[0], dtype=np.int64),
+            'rank': np.array(columns[1], dtype=np.int64),
+            'active': np.array(columns[2], dtype=bool),
+            }
+        for i, name in enumerate(self.MAPPERCOUNTERS):
+            self.mapperresults[name] = self._floats(columns[3 + i])
+
+    @classmethod
+    def fromconnection(cls, conn, runs, max_workers=None):
+        """
+        Fetches the runinfo, lane results and mapper results of the runs through a Connection and tabulates them.
+        Raises the first error if any run could not be fetched.
+        """
+        fetched = []
+        for results in (conn.getruninfo_many(runs, max_workers=max_workers),
+                        conn.indexlaneresults_many(runs, max_workers=max_workers),
+                        conn.indexmapperresults_many(runs, max_workers=max_workers)):
+            if results.errors:
+                raise list(results.errors.values())[0]
+            fetched.append(results)
+        return cls(*fetched)
+
+    def lane_yield(self, read_number=1, latest=True):
+        """
+        Per-lane PF yield.
+
+        Returns : Columns run, lane, pass_read_count, total_read_count and pf_fraction, one row per lane.
+        """
+        lr = self.laneresults
+        rows = self._laneresultrows(read_number, latest) & (lr['barcode'] == 0)
+        keys, sums = self._groupsum((lr['run'][rows], lr['lane'][rows]),
+                                    (lr['pass_read_count'][rows], lr['total_read_count'][rows]))
+        return {
+            'run': self._decode(self.runs, keys[0]),
+            'lane': keys[1],
+            'pass_read_count': sums[0],
+            'total_read_count': sums[1],
+            'pf_fraction': self._ratio(sums[0], sums[1]),
+            }
+
+    def barcode_representation(self, read_number=1, latest=True):
+        """
+        Per-barcode share of each lane's PF reads, including the LIMS's 'unmatched' barcode.
+
+        Returns : Columns run, lane, barcode, pass_read_count and fraction, one row per barcode in each lane.
+        """
+        np = _numpy()
+        lr = self.laneresults
+        rows = self._laneresultrows(read_number, latest) & (lr['barcode'] != 0)
+        keys, sums = self._groupsum((lr['run'][rows], lr['lane'][rows], lr['barcode'][rows]), (lr['pass_read_count'][rows],))
+        # Each barcode's share of the total of its lane.
+        lanetotals = np.zeros(0)
+        if len(keys[0]):
+            lanerow = self._groups(keys[:2])[1]
+            lanetotals = np.bincount(lanerow, weights=sums[0])[lanerow]
+        return {
+            'run': self._decode(self.runs, keys[0]),
+            'lane': keys[1],
+            'barcode': self._decode(self.barcodes, keys[2]),
+            'pass_read_count': sums[0],
+            'fraction': self._ratio(sums[0], lanetotals),
+            }
+
+    def mapping_rates(self, read_number=1, latest=True, rank=1, by_barcode=True):
+        """
+        Mapping rate and non-unique fraction, from the mapper results of the given rank (1 is the primary reference).
+
+        Returns : Columns run, lane, barcode (if by_barcode), pass_read_count, aligned_read_count, mapping_rate
+                  (aligned over PF reads) and non_unique_fraction (non-uniquely aligned over aligned), one row per
+                  lane or per barcode in each lane. Lanes with no mapper results are left out.
+        """
+        np = _numpy()
+        lr = self.laneresults
+        mr = self.mapperresults
+        laneresultrows = self._laneresultrows(read_number, latest)
+        rows = mr['active'] & (mr['rank'] == rank) & (mr['laneresult'] >= 0)
+        rows[rows] = laneresultrows[mr['laneresult'][rows]]
+        if not by_barcode and rows.any():
+            # A lane's total (barcode None) is only used for lanes that weren't mapped per barcode, so that
+            # multiplexed lanes aren't counted twice.
+            parents = mr['laneresult'][rows]
+            lanes, lanerow = self._groups((lr['run'][parents], lr['lane'][parents]))
+            barcoded = np.zeros(len(lanes[0]), dtype=bool)
+            barcoded[lanerow[lr['barcode'][parents] != 0]] = True
+            rows[rows] = ~(barcoded[lanerow] & (lr['barcode'][parents] == 0))
+        parents = mr['laneresult'][rows]
+        keycolumns = [lr['run'][parents], lr['lane'][parents]]
+        if by_barcode:
+            keycolumns.append(lr['barcode'][parents])
+        keys, sums = self._groupsum(keycolumns, (lr['pass_read_count'][parents], mr['aligned_read_count'][rows],
+                                                  mr['non_uniquely_aligned_read_count'][rows]))
+        result = {
+            'run': self._decode(self.runs, keys[0]),
+            'lane': keys[1],
+            }
+        if by_barcode:
+            result['barcode'] = self._decode(self.barcodes, keys[2])
+        result.update({
+            'pass_read_count': sums[0],
+            'aligned_read_count': sums[1],
+            'mapping_rate': self._ratio(sums[1], sums[0]),
+            'non_unique_fraction': self._ratio(sums[2], sums[1]),
+            })
+        return result
+
+    def _laneresultrows(self, read_number, latest):
+        # Boolean mask of the active lane results of read_number (any read if None), from the latest pipeline run
+        # of their lane if latest is set.
+        np = _numpy()
+        lr = self.laneresults
+        rows = lr['active'].copy()
+        if read_number is not None:
+            rows &= lr['read_number'] == read_number
+        if latest and rows.any():
+            lanes, lanerow = self._groups((lr['run'], lr['lane']))
+            newest = np.full(len(lanes[0]), np.iinfo(np.int64).min)
+            np.maximum.at(newest, lanerow[rows], lr['pipeline_run'][rows])
+            rows &= lr['pipeline_run'] == newest[lanerow]
+        return rows
+
+    def _groupsum(self, keycolumns, valuecolumns):
+        # Sums each value column over the groups of rows with equal keys, treating NaN as 0. Returns the key
+        # columns of the groups, in sorted order, and the sums.
+        np = _numpy()
+        if not len(keycolumns[0]):
+            return [np.zeros(0, dtype=np.int64) for column in keycolumns], [np.zeros(0) for column in valuecolumns]
+        keys, inverse = self._groups(keycolumns)
+        sums = [np.bincount(inverse, weights=np.nan_to_num(column), minlength=len(keys[0])) for column in valuecolumns]
+        return keys, sums
+
+    def _groups(self, keycolumns):
+        # Returns the key columns of the distinct groups of rows, in sorted order, and the group of each row. The
+        # keys are packed into one int64 per row first, since np.unique sorts that far faster than the rows of a
+        # 2-d array.
+        np = _numpy()
+        code = np.zeros(len(keycolumns[0]), dtype=np.int64)
+        ranges = []
+        for column in keycolumns:
+            low = int(column.min()) if len(column) else 0
+            size = int(column.max()) - low + 1 if len(column) else 1
+            code = code * size + (column - low)
+            ranges.append((low, size))
+        groups, inverse = np.unique(code, return_inverse=True)
+        keys = []
+        for low, size in reversed(ranges):
+            groups, digit = np.divmod(groups, size)
+            keys.append(digit + low)
+        return keys[::-1], inverse.reshape(-1)
+
+    def _floats(self, values):
+        np = _numpy()
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+    def _decode(self, labels, codes):
+        np = _numpy()
+        return np.array(labels, dtype=object)[codes] if len(codes) else np.zeros(0, dtype=object)
+
+    def _ratio(self, numerator, denominator):
+        np = _numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(denominator > 0, numerator / denominator, np.nan)
@@ -0,0 +1,502 @@
+import asyncio
+import collections
+
+import scgpm_lims.components.asyncremote as asyncremote
+import scgpm_lims.components.local as local
+from scgpm_lims.components.connection import BaseConnection, BatchResults
+from scgpm_lims.components.models import MapperResult, SolexaLaneResult
+from scgpm_lims.components.paging import AsyncPageIterator
+from scgpm_lims.components.samplesheet import rendersamplesheet
+from scgpm_lims.components.tracing import traced
+
+class AsyncConnection(BaseConnection):
+
+    def __init__(self, lims_url=None, lims_token=None, apiversion='v1', verbose=False, override_owner=None, local_only=False, testdata_update_mode=False, verify_cert=False,
+                 pool_limit=100, pool_limit_per_host=0, local_db=None, flush_every=100, local_snapshot=None, page_size=None,
+                 timeout=(10, 120), retries=3, retry_writes=False, breaker_threshold=5, breaker_reset_time=30,
+                 metrics=False, tracer=None, trace_file=None, render_samplesheets=False):
+
+        # The AsyncConnection class is the asyncio counterpart of Connection. It has the same read/write methods,
+        # but each one is a coroutine. All calls made through one AsyncConnection share a single aiohttp session,
+        # so thousands of LIMS calls can be in flight on one event loop. Both share BaseConnection, so the
+        # arguments they have in common mean the same (see Connection).
+        #
+        # pool_limit is the maximum number of simultaneous connections to the LIMS, and pool_limit_per_host
+        # the maximum to any one host (0 for no per-host limit). Further calls queue for a free connection.
+        # They take the place of Connection's pool_connections, pool_maxsize and pool_block.
+        #
+        # Connection's cache, http_cache_dir and cassette options (and their cache_*, http_cache_* and
+        # cassette_mode settings) aren't available: they're built on the requests transport, which
+        # AsyncRemoteDataManager doesn't use. Use a Connection where they're needed.
+        #
+        # With local_only=True the test data is served through the same coroutines, so no network is needed.
+        #
+        # Use it as "async with AsyncConnection(...) as conn:", or await conn.close() when done.
+
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        BaseConnection.__init__(self, lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verbose=verbose,
+                                override_owner=override_owner, local_only=local_only, testdata_update_mode=testdata_update_mode,
+                                verify_cert=verify_cert, local_db=local_db, flush_every=flush_every, local_snapshot=local_snapshot,
+                                page_size=page_size, timeout=timeout, retries=retries, retry_writes=retry_writes,
+                                breaker_threshold=breaker_threshold, breaker_reset_time=breaker_reset_time, metrics=metrics,
+                                tracer=tracer, trace_file=trace_file, render_samplesheets=render_samplesheets)
+
+    def _makeremoteserver(self, lims_url, lims_token, apiversion, verify):
+        return asyncremote.AsyncRemoteDataManager(lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verify=verify,
+                                                  pool_limit=self.pool_limit, pool_limit_per_host=self.pool_limit_per_host,
+                                                  timeout=self.timeout, retry=self._retrypolicy(), breaker=self._circuitbreaker(),
+                                                  metrics=self._metrics, tracer=self.tracer)
+
+    def _makelocalserver(self):
+        return local.AsyncLocalDataManager(self._makelocalstore())
+
+    @traced('flowcell_id')
+    async def get_runname_from_flowcell_id(self, flowcell_id):
+        runname = await self.server.get_runname_from_flowcell_id(flowcell_id)
+        if not runname:
+            raise Exception('run name for flow cell %s could not be found.' % flowcell_id)
+        return runname
+
+    @traced()
+    async def get_runnames_from_flowcell_ids(self, flowcell_ids, max_workers=None):
+        # Coroutine version of Connection.get_runnames_from_flowcell_ids. Returns BatchResults keyed by flow cell ID.
+        return await self._runmany(self.get_runname_from_flowcell_id, flowcell_ids, max_workers)
+
+    async def iter_runnames_from_flowcell_ids(self, flowcell_ids, max_workers=None):
+        """
+        Async generator version of Connection.iter_runnames_from_flowcell_ids, for "async for". flowcell_ids is
+        consumed lazily; at most max_workers (default pool_limit) lookups are in flight at once, and results
+        are yielded in input order.
+
+        Yields : (flowcell_id, run_name, error) tuples, as the Connection version.
+        """
+        if max_workers is None:
+            max_workers = self.pool_limit
+        semaphore = asyncio.Semaphore(max_workers)
+        async def lookup(flowcell_id):
+            async with semaphore:
+                return await self.get_runname_from_flowcell_id(flowcell_id)
+        # As in Connection.iter_runnames_from_flowcell_ids, memory is bounded by the window, not the input.
+        window = max_workers * 4
+        tasks = {}    # flowcell_id -> [task, occurrences in pending]
+        pending = collections.deque()
+        try:
+            for flowcell_id in flowcell_ids:
+                if flowcell_id in tasks:
+                    tasks[flowcell_id][1] += 1
+                else:
+                    tasks[flowcell_id] = [asyncio.ensure_future(lookup(flowcell_id)), 1]
+                pending.append(flowcell_id)
+                while len(pending) > window:
+                    yield await self._taskresult(pending.popleft(), tasks)
+            while pending:
+                yield await self._taskresult(pending.popleft(), tasks)
+        finally:
+            for task, count in tasks.values():
+                task.cancel()
+
+    async def _taskresult(self, key, tasks):
+        entry = tasks[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del tasks[key]
+        try:
+            return key, await entry[0], None
+        except Exception as e:
+            return key, None, e
+
+    @traced()
+    async def getrunstoanalyze(self):
+        runs = await self.server.getrunstoanalyze()
+        return runs
+
+    @traced('run', 'bcl2fastq_version', 'lane')
+    async def getsamplesheet(self, run, bcl2fastq_version, lane=None, filename='samplesheet.csv', runinfo=None):
+        """
+        Coroutine version of Connection.getsamplesheet.
+        """
+        bcl2fastq_version = self._startsamplesheet(run, bcl2fastq_version, lane, filename)
+
+        if self.render_samplesheets:
+            if runinfo is None:
+                runinfo = await self.getruninfo(run)
+            samplesheet = rendersamplesheet(runinfo, bcl2fastq_version, lane=lane)
+        else:
+            samplesheet = await self.server.getsamplesheet(run=run, lane=lane, bcl2fastq_version=bcl2fastq_version)
+        return self._finishsamplesheet(run, samplesheet, lane, filename)
+
+    @traced('run', 'bcl2fastq_version')
+    async def getlanesamplesheets(self, run, bcl2fastq_version):
+        # Coroutine version of Connection.getlanesamplesheets.
+        return self._splitsamplesheet(run, await self.getsamplesheet(run, bcl2fastq_version, filename=None))
+
+    @traced('run')
+    async def getruninfo(self, run=None):
+        self.logf("Getting run info for run %s", run)
+        dirty_runinfo = await self.server.getruninfo(run=run)
+        return self._finishruninfo(run, dirty_runinfo)
+
+    @traced('dna_library_id')
+    async def getdnalibraryinfo(self, dna_library_id):
+        self.logf("Getting info for DNA library: %d", dna_library_id)
+        dna_library_info = await self.server.get_dna_library_info(dna_library_id)
+
+        if not dna_library_info:
+            raise Exception('DNA library info for DNA library ID %d could not be found.' % dna_library_id)
+
+        return dna_library_info
+
+    @traced('run', 'lane')
+    async def get_library(self, run, lane):
+        self.logf("Getting library info for run %s and lane %s.", run, lane)
+        library = await self.server.get_library(run=run,lane=lane)
+
+        if not library:
+            raise Exception("library for run {run} and lane {lane} could not be found.".format(run=run,lane=lane))
+
+        self.log(library, pretty=True)
+        return library
+
+    async def getlanenumfromsample(self, run, sample):
+        return self._lanenumfromsample(await self.getruninfo(run=run), run, sample)
+
+    @traced('run')
+    async def createpipelinerun(self, run, paramdict=None):
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        self.logf("Creating pipeline run object for run=%s, paramdict=%s", run, paramdict)
+        pipelinerun = await self.server.createpipelinerun(run=run,paramdict=paramdict)
+        if not pipelinerun:
+            raise Exception('Failed to create pipelinerun for run=%s paramdict=%s' % (run, paramdict))
+
+        self.log(pipelinerun, pretty=True)
+        return pipelinerun
+
+    @traced('run', 'lane')
+    async def deletelaneresults(self, run, lane):
+        self.log("Resetting old results")
+        if self.autosaveserver:
+            self._delete_not_supported_error()
+
+        await self.server.deletelaneresults(run, lane)
+
+    @traced('run', 'lane')
+    async def createlaneresult(self, paramdict, run, lane):
+        self.logf("Creating lane result for run=%s, lane=%s, paramsdict=%s", run, lane, paramdict)
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        laneresult = await self.server.createlaneresult(paramdict, run=run, lane=lane)
+
+        if not laneresult:
+            raise Exception('Failed to create laneresult for run=%s lane=%s paramdict=%s' % (run, lane, paramdict))
+
+        self.log(laneresult, pretty=True)
+        return laneresult
+
+    @traced()
+    async def createmapperresult(self, paramdict):
+        self.logf("Creating mapper result with paramsdict=%s", paramdict)
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        mapperresult = await self.server.createmapperresult(paramdict)
+
+        if not mapperresult:
+            raise Exception('Failed to create mapperresult for paramdict=%s' % paramdict)
+
+        self.log(mapperresult, pretty=True)
+        return mapperresult
+
+    @traced()
+    async def createlaneresults_bulk(self, laneresults, max_workers=None):
+        """
+        Coroutine version of Connection.createlaneresults_bulk. max_workers bounds the creates in flight at once,
+        and defaults to pool_limit.
+        """
+        if self.autosaveserver:
+            self._write_not_supported_error()
+        calls = [(key, self.createlaneresult(paramdict, run, lane)) for key, (run, lane, paramdict) in self._bulkitems(laneresults)]
+        return await self._gatherbatch(calls, max_workers)
+
+    @traced()
+    async def createmapperresults_bulk(self, mapperresults, laneresults=None, max_workers=None):
+        """
+        Coroutine version of Connection.createmapperresults_bulk.
+        """
+        if self.autosaveserver:
+            self._write_not_supported_error()
+        params, errors = self._mapperresultparams(mapperresults, laneresults)
+        calls = [(key, self.createmapperresult(paramdict)) for key, paramdict in params]
+        return await self._gatherbatch(calls, max_workers, errors=errors)
+
+    async def _gatherbatch(self, calls, max_workers, errors=None):
+        # calls is a list of (key, coroutine). At most max_workers of the coroutines run at once.
+        semaphore = asyncio.Semaphore(max_workers or self.pool_limit)
+        async def limited(coroutine):
+            async with semaphore:
+                return await coroutine
+        results = BatchResults()
+        results.errors.update(errors or {})
+        outcomes = await asyncio.gather(*[limited(coroutine) for key, coroutine in calls], return_exceptions=True)
+        for (key, coroutine), outcome in zip(calls, outcomes):
+            if isinstance(outcome, Exception):
+                results.errors[key] = outcome
+            else:
+                results[key] = outcome
+        return results
+
+    @traced('id')
+    async def showsolexarun(self, id):
+        self.logf("Getting solexarun id %s", id)
+        solexarun = await self.server.showsolexarun(id)
+        return self._finishshow('solexarun', id, solexarun)
+
+    @traced('id')
+    async def showsolexaflowcell(self, id):
+        self.logf("Getting solexaflowcell id %s", id)
+        solexaflowcell = await self.server.showsolexaflowcell(id)
+        return self._finishshow('solexaflowcell', id, solexaflowcell)
+
+    @traced('id')
+    async def showpipelinerun(self, id):
+        self.logf("Showing pipeline run with id=%s", id)
+        pipelinerun = await self.server.showpipelinerun(id)
+        return self._finishshow('pipelinerun', id, pipelinerun)
+
+    @traced('id')
+    async def showlaneresult(self, id):
+        self.logf("Showing laneresult with id=%s", id)
+        laneresult = await self.server.showlaneresult(id)
+        return self._finishshow('laneresult', id, laneresult)
+
+    @traced('id')
+    async def showmapperresult(self, id):
+        self.logf("Showing mapper result with id=%s", id)
+        mapperresult = await self.server.showmapperresult(id)
+        return self._finishshow('mapperresult', id, mapperresult)
+
+    @traced('run', 'page_size')
+    async def indexsolexaruns(self, run, records=False, page_size=None):
+        self.logf("Indexing solexa run(s) where run=%s", run)
+        solexaruns = await self._index('solexaruns', self.server.indexsolexaruns, run, page_size)
+        return self._finishindex('solexaruns', solexaruns, records)
+
+    @traced('run', 'page_size')
+    async def indexpipelineruns(self, run, records=False, page_size=None):
+        self.logf("Indexing pipeline runs where run=%s", run)
+        pipelineruns = await self._index('pipelineruns', self.server.indexpipelineruns, run, page_size)
+        return self._finishindex('pipelineruns', pipelineruns, records)
+
+    @traced('run', 'lane', 'barcode', 'readnumber', 'page_size')
+    async def indexlaneresults(self, run, lane=None, barcode=None, readnumber=None, records=False, page_size=None):
+        self.logf("Indexing lane results where run=%s, lane=%s, barcode=%s", run, lane, barcode)
+        laneresults = await self._index('laneresults', self.server.indexlaneresults, run, page_size,
+                                        lane=lane, barcode=barcode, readnumber=readnumber)
+        return self._finishindex('laneresults', laneresults, records)
+
+    @traced('run', 'page_size')
+    async def indexmapperresults(self, run, records=False, page_size=None):
+        self.logf("Indexing mapper results where run=%s", run)
+        mapperresults = await self._index('mapperresults', self.server.indexmapperresults, run, page_size)
+        return self._finishindex('mapperresults', mapperresults, records)
+
+    def iterpages(self, kind, run, page_size=None, prefetch=True, lane=None, barcode=None, readnumber=None):
+        # Like Connection.iterpages, but returns a paging.AsyncPageIterator: use with "async for".
+        filters = self._pagefilters(kind, lane, barcode, readnumber)
+        return AsyncPageIterator(lambda page, size: self._getpage(kind, page, size, run, filters),
+                                 page_size or self.page_size or self.DEFAULT_PAGE_SIZE, prefetch=prefetch, ids=dict.keys)
+
+    @traced('kind', 'page', 'page_size', 'run')
+    async def _getpage(self, kind, page, page_size, run, filters):
+        self.logf("Fetching page %s of %s where run=%s", page, kind, run)
+        results = self._listtodict(await self.server.getpage(kind, page, page_size, run, **filters))
+        self._autosave('add' + kind, results)
+        return results
+
+    async def _index(self, kind, index, run, page_size, **filters):
+        page_size = page_size or self.page_size
+        if not page_size:
+            return await index(run, **filters)
+        async def getpage(page, size):
+            return self._listtodict(await self.server.getpage(kind, page, size, run, **filters))
+        results = {}
+        async with AsyncPageIterator(getpage, page_size, ids=dict.keys) as pages:
+            async for page in pages:
+                results.update(page)
+        return results
+
+    def iterlaneresults(self, run, lane=None, barcode=None, readnumber=None, filter=None, records=False):
+        # Async generator variant of Connection.iterlaneresults: use with "async for".
+        self.logf("Iterating lane results where run=%s, lane=%s, barcode=%s", run, lane, barcode)
+        laneresults = self.server.iterlaneresults(run, lane=lane, barcode=barcode, readnumber=readnumber, filter=filter)
+        return self._iterresults(laneresults, 'addlaneresult', SolexaLaneResult if records else None)
+
+    def itermapperresults(self, run, filter=None, records=False):
+        self.logf("Iterating mapper results where run=%s", run)
+        mapperresults = self.server.itermapperresults(run, filter=filter)
+        return self._iterresults(mapperresults, 'addmapperresult', MapperResult if records else None)
+
+    async def _iterresults(self, results, addmethod, recordclass):
+        async for result in results:
+            yield self._iterresult(result, addmethod, recordclass)
+
+    @traced('run_id')
+    async def updatesolexarun(self, run_id, paramdict):
+        self.logf("Updating Solexa Run id=%s with paramdict=%s", run_id, paramdict)
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        run = await self.server.updatesolexarun(run_id, paramdict)
+        if not run:
+            raise Exception("Failed to update Solexa Run id=%s paramdict=%s" % (run_id, paramdict))
+
+        self.log(run, pretty=True)
+        return run
+
+    @traced('id')
+    async def updatesolexaflowcell(self, id, paramdict):
+        self.logf("Updating Solexa Flow Cell id=%s with paramdict=%s", id, paramdict)
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        flowcell = await self.server.updatesolexaflowcell(id, paramdict)
+        if not flowcell:
+            raise Exception("Failed to update Solexa Flow Cell id=%s paramdict=%s" % (id, paramdict))
+
+        self.log(flowcell, pretty=True)
+        return flowcell
+
+    @traced('id')
+    async def updatepipelinerun(self, id, paramdict):
+        self.logf("Updating pipeline run id=%s with paramdict=%s", id, paramdict)
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        pipelinerun = await self.server.updatepipelinerun(id, paramdict)
+        if not pipelinerun:
+            raise Exception("Failed to update pipelinerun id=%s paramdict=%s" % (id, paramdict))
+
+        self.log(pipelinerun, pretty=True)
+        return pipelinerun
+
+    @traced('id')
+    async def updatelaneresult(self, id, paramdict):
+        self.logf("Updating lane result id=%s with paramdict=%s", id, paramdict)
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        laneresult = await self.server.updatelaneresult(id, paramdict)
+        if not laneresult:
+            raise Exception("Failed to update laneresult id=%s paramdict=%s" % (id, paramdict))
+
+        self.log(laneresult, pretty=True)
+        return laneresult
+
+    @traced('id')
+    async def updatemapperresult(self, id, paramdict):
+        self.logf("Updating mapper result id=%s with paramdict=%s", id, paramdict)
+        if self.autosaveserver:
+            self._write_not_supported_error()
+
+        mapperresult = await self.server.updatemapperresult(id, paramdict)
+        if not mapperresult:
+            raise Exception("Failed to update mapperresult id=%s paramdict=%s" % (id, paramdict))
+
+        self.log(mapperresult, pretty=True)
+        return mapperresult
+
+    @traced('run', 'bcl2fastq_version')
+    async def getallrunobjects(self, run, bcl2fastq_version=1):
+        # Coroutine version of Connection.getallrunobjects. Returns a RunBundle.
+        solexaruns = asyncio.ensure_future(self.indexsolexaruns(run))
+        if not self.render_samplesheets:
+            samplesheet = asyncio.ensure_future(self.getsamplesheet(run, bcl2fastq_version, filename=None))
+        pipelineruns = asyncio.ensure_future(self.indexpipelineruns(run))
+        laneresults = asyncio.ensure_future(self.indexlaneresults(run))
+        mapperresults = asyncio.ensure_future(self.indexmapperresults(run))
+        runinfo = await self.getruninfo(run)
+        if self.render_samplesheets:
+            samplesheet = asyncio.ensure_future(self.getsamplesheet(run, bcl2fastq_version, filename=None, runinfo=runinfo))
+
+        solexaflowcell = await self.showsolexaflowcell(runinfo['run_info']['flow_cell_id'])
+        independent = await asyncio.gather(solexaruns, samplesheet, pipelineruns, laneresults, mapperresults)
+
+        # The per-lane samplesheets are split out of the all-lanes one; lanes without rows in it are fetched.
+        split = self._splitsamplesheet(run, independent[1])
+        lanes = list(runinfo['run_info']['lanes'].keys())
+        missing = [lane for lane in lanes if lane not in split]
+        fetched = await asyncio.gather(*[self.getsamplesheet(run, bcl2fastq_version, filename=None, lane=lane, runinfo=runinfo) for lane in missing])
+        lanesamplesheets = dict(zip(missing, fetched))
+        lanesamplesheets.update((lane, split[lane]) for lane in lanes if lane in split)
+
+        return self._runbundle(run, runinfo, independent[0], solexaflowcell, independent[1], lanesamplesheets,
+                               independent[2], independent[3], independent[4])
+
+    @traced()
+    async def getruninfo_many(self, runs, max_workers=None):
+        """
+        Coroutine version of Connection.getruninfo_many. The calls run concurrently on the event loop, at most
+        max_workers (default pool_limit) at once.
+
+        Returns : BatchResults keyed by run name. Runs that failed are in its errors dict.
+        """
+        return await self._runmany(self.getruninfo, runs, max_workers)
+
+    @traced()
+    async def indexpipelineruns_many(self, runs, max_workers=None):
+        return await self._runmany(self.indexpipelineruns, runs, max_workers)
+
+    @traced('lane', 'barcode', 'readnumber')
+    async def indexlaneresults_many(self, runs, max_workers=None, lane=None, barcode=None, readnumber=None):
+        return await self._runmany(self.indexlaneresults, runs, max_workers, lane=lane, barcode=barcode, readnumber=readnumber)
+
+    @traced()
+    async def indexmapperresults_many(self, runs, max_workers=None):
+        return await self._runmany(self.indexmapperresults, runs, max_workers)
+
+    async def _runmany(self, method, runs, max_workers, **kwargs):
+        # Duplicate runs are only fetched once, as in Connection._runmany.
+        return await self._gatherbatch([(run, method(run, **kwargs)) for run in dict.fromkeys(runs)], max_workers)
+
+    @traced('library_name')
+    async def get_runinfo_by_library_name(self, library_name):
+        runinfo = await self.server.get_runinfo_by_library_name(library_name)
+        return runinfo
+
+    @traced()
+    async def get_person_attributes_by_email(self, email):
+        person_info = await self.server.get_person_attributes_by_email(email=email)
+        return person_info
+
+    @traced('personid')
+    async def update_person(self, personid, attributeDict={}):
+        json_response = await self.server.update_person(personid=personid,attributeDict=attributeDict)
+        return json_response
+
+    @traced('run_name')
+    async def runHasFinishedPipelineRun(self, run_name):
+        return self._hasfinishedpipelinerun(await self.indexpipelineruns(run=run_name))
+
+    @traced()
+    async def testconnection(self):
+        # Raises exception if no 200 response
+        await self.server.testconnection()
+        return True
+
+    async def close(self):
+        # Writes any pending testdata, then closes the shared aiohttp session and the local database. The testdata
+        # is written on the default executor, so that writing it doesn't stall the event loop.
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
+        await self.server.close()
+        if self.autosaveserver is not None:
+            self.autosaveserver.close()
+        self._closetracesink()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
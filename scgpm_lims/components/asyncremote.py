@@ -0,0 +1,353 @@
+import asyncio
+import importlib.util
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+
+from scgpm_lims.components.jsonstream import JsonArrayParser
+from scgpm_lims.components.resilience import CircuitBreaker, RemoteCounters, RetryPolicy
+from scgpm_lims.components.tracing import Tracer
+
+# aiohttp is imported when the first session is opened rather than here, since scgpm_lims imports this module
+# and importing aiohttp would slow down the startup of every process using the package.
+aiohttp = None
+
+
+class AsyncRemoteDataManager:
+
+    # Asyncio mirror of RemoteDataManager. Every method is a coroutine, and all of them share one
+    # aiohttp.ClientSession, so many LIMS calls can be in flight on one event loop without a thread per call.
+    #
+    # pool_limit is the total number of simultaneous connections and pool_limit_per_host the limit for any
+    # single host (0 means no per-host limit). Calls beyond the limit wait for a free connection.
+    #
+    # timeout, retry and breaker work as they do for HttpTransport: (connect, read) timeouts in seconds, a
+    # resilience.RetryPolicy and a resilience.CircuitBreaker. counters counts what they did. metrics is an
+    # optional metrics.Metrics to record every call in, and tracer an optional tracing.Tracer to report them to
+    # as 'http' spans, as HttpTransport does.
+
+    localorremote = 'remote'
+
+    # Size of the pieces a streamed response body is read and parsed in by the iter* methods.
+    stream_chunk_size = 64 * 1024
+
+    INDEXENDPOINTS = {
+        'solexaruns': 'solexa_runs',
+        'pipelineruns': 'solexa_pipeline_runs',
+        'laneresults': 'solexa_lane_results',
+        'mapperresults': 'mapper_results',
+        }
+
+    def __init__(self, apiversion=None, lims_url=None, lims_token=None, verify=False, pool_limit=100, pool_limit_per_host=0,
+                 timeout=(10, 120), retry=None, breaker=None, metrics=None, tracer=None):
+        if importlib.util.find_spec('aiohttp') is None:
+            raise Exception('AsyncRemoteDataManager requires the aiohttp package. Install it with "pip install scgpm_lims[async]".')
+        if not apiversion:
+            raise Exception('apiversion is required')
+        self.apiversion = apiversion
+
+        if (not lims_url) or not (lims_token):
+            raise Exception("lims_url and lims_token are required. Current settings are lims_url=%s, lims_token=%s" % (lims_url, lims_token))
+        self.token = lims_token
+        self.urlprefix = self._geturlprefix(rooturl=lims_url,apiversion=apiversion)
+        self.verify = verify
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.timeout = timeout
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.counters = RemoteCounters()
+        self.metrics = metrics
+        self.tracer = tracer if tracer is not None else Tracer()
+
+        # The session has to be created inside the running event loop, so it's opened on first use.
+        self.session = None
+
+    async def get_runname_from_flowcell_id(self, flowcell_id):
+        result = await self._request('GET', 'solexa_flow_cells/get_run_name', params={'name': flowcell_id})
+        return result["run_name"]
+
+    async def getrunstoanalyze(self):
+        return await self._request('GET', 'runs_to_analyze')
+
+    async def getsamplesheet(self, bcl2fastq_version, run, lane=None):
+        params = {
+            'run': run,
+            'bcl2fastq_version': bcl2fastq_version
+            }
+        if lane is not None:
+            params['lane'] = str(lane)
+        return await self._request('GET', 'samplesheets', params=params, text=True)
+
+    async def getruninfo(self, run):
+        return await self._request('GET', 'run_info', params={'run': run})
+
+    async def get_dna_library_info(self, dna_library_id):
+        return await self._request('GET', 'dna_libraries/' + str(dna_library_id))
+
+    async def get_library(self, run, lane):
+        return await self._request('GET', 'run_info/get_library', params={'run': run, 'lane': lane})
+
+    async def get_runinfo_by_library_name(self, library_name):
+        return await self._request('GET', 'run_info_by_library_name', params={'starts_with': library_name})
+
+    async def get_person_attributes_by_email(self, email):
+        return await self._request('GET', 'get_person_by_email', params={'email': email})
+
+    async def update_person(self, personid, attributeDict={}):
+        return await self._request('PATCH', 'people/' + str(personid), params=attributeDict)
+
+    async def getrunid(self, run):
+        runinfo = await self.getruninfo(run)
+        try:
+            id = runinfo.get('id')
+        except:
+            return None
+        return id
+
+    async def getlaneid(self, run, lane):
+        runinfo = await self.getruninfo(run)
+        try:
+            id = runinfo.get('run_info').get('lanes').get(str(lane)).get('id')
+        except:
+            return None
+        return id
+
+    async def showsolexarun(self, id):
+        return await self._request('GET', 'solexa_runs/%s' % id)
+
+    async def showsolexaflowcell(self, id):
+        return await self._request('GET', 'solexa_flow_cells/%s' % id)
+
+    async def showpipelinerun(self, id):
+        return await self._request('GET', 'solexa_pipeline_runs/%s' % id)
+
+    async def showlaneresult(self, id):
+        return await self._request('GET', 'solexa_lane_results/%s' % id)
+
+    async def showmapperresult(self, id):
+        return await self._request('GET', 'mapper_results/%s' % id)
+
+    async def indexsolexaruns(self, run):
+        return self._listtodict(await self._request('GET', 'solexa_runs', params={'run': run}))
+
+    async def indexpipelineruns(self, run):
+        return self._listtodict(await self._request('GET', 'solexa_pipeline_runs', params={'run': run}))
+
+    async def indexlaneresults(self, run, lane=None, barcode=None, readnumber=None):
+        params = self._laneresultparams(run, lane, barcode, readnumber)
+        return self._listtodict(await self._request('GET', 'solexa_lane_results', params=params))
+
+    def iterlaneresults(self, run, lane=None, barcode=None, readnumber=None, filter=None):
+        # Async generator counterpart of RemoteDataManager.iterlaneresults.
+        return self._iterresults('solexa_lane_results', self._laneresultparams(run, lane, barcode, readnumber), filter)
+
+    async def indexmapperresults(self, run):
+        return self._listtodict(await self._request('GET', 'mapper_results', params={'run': run}))
+
+    def itermapperresults(self, run, filter=None):
+        return self._iterresults('mapper_results', {'run': run}, filter)
+
+    async def getpage(self, kind, page, page_size, run, **filters):
+        # See RemoteDataManager.getpage.
+        if kind == 'laneresults':
+            params = self._laneresultparams(run, filters.get('lane'), filters.get('barcode'), filters.get('readnumber'))
+        else:
+            params = {'run': run}
+        params.update({'page': page, 'per_page': page_size})
+        return await self._request('GET', self.INDEXENDPOINTS[kind], params=params)
+
+    async def createpipelinerun(self, run, paramdict=None):
+        return await self._request('POST', 'solexa_pipeline_runs', params={'run': run}, paramdict=paramdict)
+
+    async def createlaneresult(self, paramdict, run=None, lane=None):
+        params = {}
+        if run is not None:
+            params.update({'run': run})
+            if lane is not None:
+                params.update({'lane': lane})
+        return await self._request('POST', 'solexa_lane_results', params=params, paramdict=paramdict)
+
+    async def createmapperresult(self, paramdict):
+        return await self._request('POST', 'mapper_results', paramdict=paramdict)
+
+    async def updatesolexarun(self, id, paramdict):
+        return await self._request('PATCH', 'solexa_runs/%s' % id, paramdict=paramdict)
+
+    async def updatesolexaflowcell(self, id, paramdict):
+        return await self._request('PATCH', 'solexa_flow_cells/%s' % id, paramdict=paramdict)
+
+    async def updatepipelinerun(self, id, paramdict):
+        return await self._request('PATCH', 'solexa_pipeline_runs/%s' % id, paramdict=paramdict)
+
+    async def updatelaneresult(self, id, paramdict):
+        return await self._request('PATCH', 'solexa_lane_results/%s' % id, paramdict=paramdict)
+
+    async def updatemapperresult(self, id, paramdict):
+        return await self._request('PATCH', 'mapper_results/%s' % id, paramdict=paramdict)
+
+    async def deletelaneresults(self, run, lane):
+        await self._request('POST', 'delete_lane_results', params={'run': run, 'lane': lane}, text=True)
+
+    async def testconnection(self):
+        await self._request('GET', 'ok', text=True)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _getsession(self):
+        global aiohttp
+        if aiohttp is None:
+            import aiohttp
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_limit, limit_per_host=self.pool_limit_per_host, ssl=None if self.verify else False)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def _request(self, method, endpoint, params=None, paramdict=None, text=False):
+        # aiohttp only accepts strings in the query string, unlike requests which converts them.
+        query = {'token': self.token}
+        if params:
+            for key, value in params.items():
+                query[key] = value if isinstance(value, str) else str(value)
+
+        data = None
+        headers = None
+        if paramdict is not None:
+            data = json.dumps(paramdict)
+            headers = {'content-type': 'application/json'}
+
+        url = self.urlprefix + endpoint
+        with self.tracer.span('http', method=method, path=urlsplit(url).path, request_bytes=len(data) if data else 0) as span:
+            start = time.perf_counter() if self.metrics is not None else None
+            retries = []
+            try:
+                response = await self._send(method, url, retries=retries, params=query, data=data, headers=headers)
+                async with response:
+                    body = await response.text()
+            except Exception as e:
+                if start is not None:
+                    self.metrics.record(url, method, e, time.perf_counter() - start, retries=len(retries))
+                span.set(retries=len(retries))
+                raise
+            size = len(body.encode('utf-8')) if start is not None or self.tracer.sinks else None
+            if start is not None:
+                self.metrics.record(url, method, response.status, time.perf_counter() - start, size=size, retries=len(retries))
+            span.set(status=response.status, response_bytes=size, retries=len(retries))
+        self._checkstatus(response, body, data)
+        if text:
+            return body
+        return json.loads(body)
+
+    def _laneresultparams(self, run, lane, barcode, readnumber):
+        params = {'run': run}
+        if lane is not None:
+            params.update({'lane': lane})
+            if barcode is not None:
+                params.update({'barcode': barcode})
+                if readnumber is not None:
+                    params.update({'read_number': readnumber})
+        return params
+
+    async def _iterresults(self, endpoint, params, filter):
+        query = {'token': self.token}
+        for key, value in params.items():
+            query[key] = value if isinstance(value, str) else str(value)
+        url = self.urlprefix + endpoint
+        # Streamed calls are measured up to the response headers, and their size is taken from Content-Length.
+        # The span is closed before the first result is yielded, since the caller may resume the generator from
+        # another context.
+        with self.tracer.span('http', method='GET', path=urlsplit(url).path, request_bytes=0) as span:
+            start = time.perf_counter() if self.metrics is not None else None
+            retries = []
+            try:
+                response = await self._send('GET', url, retries=retries, params=query)
+            except Exception as e:
+                if start is not None:
+                    self.metrics.record(url, 'GET', e, time.perf_counter() - start, retries=len(retries))
+                span.set(retries=len(retries))
+                raise
+            if start is not None:
+                self.metrics.record(url, 'GET', response.status, time.perf_counter() - start, size=response.content_length, retries=len(retries))
+            span.set(status=response.status, response_bytes=response.content_length, retries=len(retries))
+        async with response:
+            if not response.ok:
+                self._checkstatus(response, await response.text(), None)
+            parser = JsonArrayParser()
+            async for chunk in response.content.iter_chunked(self.stream_chunk_size):
+                for result in parser.feed(chunk):
+                    if filter is None or filter(result):
+                        yield result
+            for result in parser.close():
+                if filter is None or filter(result):
+                    yield result
+
+    def stats(self):
+        # Same as HttpTransport.stats.
+        stats = self.counters.snapshot()
+        stats.update({'breaker_state': self.breaker.state, 'breaker_opens': self.breaker.opens, 'breaker_rejected': self.breaker.rejected})
+        return stats
+
+    async def _send(self, method, url, retries=None, **kwargs):
+        # Mirrors HttpTransport._send. Returns the response unread; the caller reads and releases it.
+        session = self._getsession()
+        timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        attempts = self.retry.attempts(method)
+        attempt = 1
+        while True:
+            self.breaker.check()
+            self.counters.increment('requests')
+            retry_after = None
+            try:
+                response = await session.request(method, url, timeout=timeout, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                self.breaker.failure()
+                self.counters.increment('timeouts' if isinstance(e, asyncio.TimeoutError) else 'connection_errors')
+                if attempt >= attempts:
+                    self.counters.increment('failures')
+                    raise
+            except (Exception, asyncio.CancelledError):
+                # As in HttpTransport._send. A cancelled trial request also has to give up the half-open slot.
+                self.breaker.failure()
+                self.counters.increment('failures')
+                raise
+            else:
+                if response.status >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                if response.status not in self.retry.statuses:
+                    return response
+                if attempt >= attempts:
+                    self.counters.increment('failures')
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                response.release()
+            self.counters.increment('retries')
+            if retries is not None:
+                retries.append(attempt)
+            await asyncio.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+    def _listtodict(self, resultslist):
+        resultsdict = {}
+        for result in resultslist:
+            resultsdict[str(result.get('id'))] = result
+        return resultsdict
+
+    def _geturlprefix(self, rooturl, apiversion):
+        url = os.path.join(rooturl,"api",apiversion) + "/"
+        return url
+
+    def _checkstatus(self, response, text, body):
+        # Same diagnostics as RemoteDataManager._checkstatus, since aiohttp's exception doesn't carry the response text.
+        if not response.ok:
+            sys.stderr.write("HTTPError! {status} ({reason}). Final URL location of Response: {url}. Response text: {text}\n\n".format(status=response.status,reason=response.reason, url=response.url,text=text))
+            sys.stderr.write("Body sent in the request:\n")
+            if body:
+                sys.stderr.write(body)
+            response.raise_for_status()
@@ -0,0 +1,34 @@
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def atomicopen(path, binary=False, mode=None):
+    """
+    Function : Opens a temporary file in the directory of path for writing, and renames it over path when the
+               with block ends, so that readers, including other processes, see either the previous file or the
+               new one in full, never a partial one. If the block raises, the temporary file is removed and
+               path is left as it was.
+    Args     : binary - open the file in binary mode.
+               mode - permissions of the new file. By default those of the file it replaces, or 0o644 for a new
+                      file (mkstemp alone would make it readable only by its owner).
+    Yields   : The open temporary file.
+    """
+    fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w') as fp:
+            yield fp
+        if mode is None:
+            mode = os.stat(path).st_mode if os.path.exists(path) else 0o644
+        os.chmod(tmppath, mode)
+        os.replace(tmppath, path)
+    except BaseException:
+        os.remove(tmppath)
+        raise
+
+
+def atomicwrite(path, data, mode=None):
+    # Writes data, a str or bytes, to path with atomicopen.
+    with atomicopen(path, binary=isinstance(data, bytes), mode=mode) as fp:
+        fp.write(data)
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+
+class ObjectCache:
+
+    # In-process read-through cache used by Connection for LIMS objects.
+    #
+    # Entries are keyed by an object kind (e.g. 'runinfo', 'laneresults') and a tuple of the query arguments.
+    # maxsize bounds the total number of entries; the least recently used entry is evicted first.
+    # ttl is the default time to live in seconds, and ttls can override it per kind, e.g. {'runinfo': 30}.
+    # A ttl of None means entries of that kind never expire, and 0 means that kind is never cached.
+    #
+    # Values are deep-copied going in and coming out, so callers that modify a returned object
+    # (like Connection._processruninfo does) can't corrupt the cached copy.
+
+    def __init__(self, maxsize=1024, ttl=300, ttls=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = ttls or {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, key):
+        """
+        Returns : (True, value) if a live entry exists, otherwise (False, None).
+        """
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > time.time():
+                    self._entries.move_to_end((kind, key))
+                    self.hits += 1
+                    return True, copy.deepcopy(value)
+                del self._entries[(kind, key)]
+            self.misses += 1
+            return False, None
+
+    def set(self, kind, key, value):
+        ttl = self.ttls.get(kind, self.ttl)
+        if ttl == 0 or self.maxsize <= 0:
+            return
+        expires = None if ttl is None else time.time() + ttl
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[(kind, key)] = (expires, value)
+            self._entries.move_to_end((kind, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, kind, *prefix):
+        """
+        Drops the entries of the given kind whose key starts with prefix, or all entries of that kind if no
+        prefix is given. For example invalidate('laneresults', run) drops every lane result query on that run.
+        """
+        n = len(prefix)
+        with self._lock:
+            for entrykind, key in list(self._entries.keys()):
+                if entrykind == kind and key[:n] == prefix:
+                    del self._entries[(entrykind, key)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                }
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MAGIC = b'SCGPMCASSETTE1\n'
+
+
+class Cassette:
+
+    # Append-only store of raw LIMS responses keyed by request fingerprint, for recording calls against the
+    # real LIMS once and replaying them later without a network.
+    #
+    # The file starts with MAGIC, then holds one entry per request: a JSON header line (fingerprint, method,
+    # path, parameters, status, headers and body length), the body bytes, and a newline. Recording appends
+    # each entry with a single write. Opening a cassette reads only the header lines, seeking over the
+    # bodies, and indexes them by fingerprint; bodies are read from a memory map when replayed.
+    #
+    # The fingerprint covers the method, the url path (not the host, so a cassette replays against any
+    # lims_url), the query parameters except the token, and the request body with JSON keys sorted.
+    # The token is never stored.
+    #
+    # A recording interrupted in the middle of a write leaves a partial entry at the end of the file. It's
+    # ignored when the cassette is opened, and cut off before anything more is appended.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._cursors = {}
+        self._map = None
+        self._file = None
+        self._end = None
+        if os.path.exists(path):
+            self._load()
+
+    def fingerprint(self, method, url, params=None, data=None):
+        path = urlsplit(url).path
+        items = sorted((str(key), str(value)) for key, value in (params or {}).items() if key != 'token')
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        if data is not None:
+            try:
+                data = json.dumps(json.loads(data), sort_keys=True)
+            except ValueError:
+                pass
+        return hashlib.sha1(json.dumps([method.upper(), path, items, data]).encode('utf-8')).hexdigest()
+
+    def append(self, fingerprint, method, url, params, response):
+        """
+        Records one response. Only its status, headers and body are kept.
+        """
+        body = response.content
+        header = {
+            'fingerprint': fingerprint,
+            'method': method.upper(),
+            'path': urlsplit(url).path,
+            'params': dict((str(key), str(value)) for key, value in (params or {}).items() if key != 'token'),
+            'status': response.status_code,
+            'reason': response.reason,
+            'encoding': response.encoding,
+            'headers': dict((key, value) for key, value in response.headers.items() if key.lower() != 'set-cookie'),
+            'length': len(body),
+            }
+        entry = json.dumps(header).encode('utf-8') + b'\n' + body + b'\n'
+        with self._lock:
+            if self._file is None:
+                if self._end is not None and os.path.getsize(self.path) > self._end:
+                    os.truncate(self.path, self._end)
+                new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                self._file = open(self.path, 'ab')
+                if new:
+                    self._file.write(MAGIC)
+            self._file.write(entry)
+            self._file.flush()
+
+    def lookup(self, fingerprint):
+        """
+        Returns : (header dict, body bytes) of the recorded response, or None. Requests made more than once are
+                  answered with their recorded responses in order, and then with the last one again.
+        """
+        offsets = self._entries.get(fingerprint)
+        if offsets is None:
+            return None
+        with self._lock:
+            n = self._cursors.get(fingerprint, 0)
+            self._cursors[fingerprint] = min(n + 1, len(offsets) - 1)
+        header, start = offsets[n]
+        return header, self._map[start:start + header['length']]
+
+    def __len__(self):
+        return sum(len(offsets) for offsets in self._entries.values())
+
+    def rewind(self):
+        # Replays every request from its first recorded response again.
+        with self._lock:
+            self._cursors = {}
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+    def _load(self):
+        with open(self.path, 'rb') as fp:
+            magic = fp.read(len(MAGIC))
+            if not magic:
+                return
+            if magic != MAGIC:
+                raise Exception('%s is not a cassette file' % self.path)
+            self._end = fp.tell()
+            while True:
+                line = fp.readline()
+                if not line:
+                    break
+                try:
+                    header = json.loads(line)
+                except ValueError:
+                    # A recording interrupted in the middle of a write; everything before it is intact.
+                    break
+                start = fp.tell()
+                if start + header['length'] + 1 > os.fstat(fp.fileno()).st_size:
+                    break
+                self._entries.setdefault(header['fingerprint'], []).append((header, start))
+                fp.seek(header['length'] + 1, os.SEEK_CUR)
+                self._end = fp.tell()
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class RecordingTransport:
+
+    # Wraps the HttpTransport of a RemoteDataManager and appends every response it gets to a Cassette.
+    # Streamed responses are read in full so they can be recorded.
+
+    def __init__(self, transport, cassette):
+        self.transport = transport
+        self.cassette = cassette
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        response = self.transport.request(method, url, **kwargs)
+        fingerprint = self.cassette.fingerprint(method, url, kwargs.get('params'), kwargs.get('data'))
+        self.cassette.append(fingerprint, method, url, kwargs.get('params'), response)
+        return response
+
+    def stats(self):
+        return self.transport.stats()
+
+    def close(self):
+        self.transport.close()
+        self.cassette.close()
+
+
+class ReplayTransport:
+
+    # Stands in for HttpTransport and answers every request from a Cassette, without any network. A request
+    # that wasn't recorded raises, so a test can't silently depend on the live LIMS.
+
+    def __init__(self, cassette):
+        self.cassette = cassette
+        self.replayed = 0
+        self.missing = 0
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        params = kwargs.get('params')
+        found = self.cassette.lookup(self.cassette.fingerprint(method, url, params, kwargs.get('data')))
+        if found is None:
+            self.missing += 1
+            shown = dict((key, value) for key, value in (params or {}).items() if key != 'token')
+            raise Exception('No response recorded in %s for %s %s %s' % (self.cassette.path, method, urlsplit(url).path, shown))
+        self.replayed += 1
+        header, body = found
+        response = requests.Response()
+        response.status_code = header['status']
+        response.reason = header.get('reason')
+        response.headers = CaseInsensitiveDict(header['headers'])
+        response.encoding = header.get('encoding')
+        response.url = url
+        # Only what error reporting reads; preparing the full request would cost more than the lookup.
+        response.request = requests.PreparedRequest()
+        response.request.method = method
+        response.request.url = url
+        response.request.body = kwargs.get('data')
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def stats(self):
+        return {'replayed': self.replayed, 'missing': self.missing}
+
+    def close(self):
+        self.cassette.close()
@@ -1,45 +1,79 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 import pprint
 import re
+import threading
 
 import scgpm_lims.components.remote as remote
 import scgpm_lims.components.local as local
-
-class Connection:
+from scgpm_lims.components.cache import ObjectCache
+from scgpm_lims.components.cassette import Cassette, RecordingTransport, ReplayTransport
+from scgpm_lims.components.httpcache import DiskResponseCache
+from scgpm_lims.components.metrics import Metrics
+from scgpm_lims.components.models import MapperResult, PipelineRun, RunBundle, SolexaLaneResult, SolexaRun
+from scgpm_lims.components.paging import PageIterator
+from scgpm_lims.components.resilience import CircuitBreaker, RetryPolicy
+from scgpm_lims.components.samplesheet import rendersamplesheet, splitsamplesheet
+from scgpm_lims.components.sqlitelocal import SqliteDataManager
+from scgpm_lims.components.tracing import JsonLinesSink, Tracer, submit, traced
+from scgpm_lims.components.transport import HttpTransport
+
+class BatchResults(dict):
+
+    # Returned by the Connection *_many methods. Keys are the inputs (e.g. run names) that succeeded, valued by
+    # what the single-item method returned for them. Inputs whose call raised are in the errors dict instead,
+    # valued by the exception, so that one failure doesn't abort the rest of the batch.
+
+    def __init__(self):
+        dict.__init__(self)
+        self.errors = {}
+
+    def ok(self):
+        return not self.errors
+
+class BaseConnection:
+
+    # The parts of Connection and AsyncConnection that don't do I/O: the options they share, the choice of local or
+    # remote data manager, checking and post-processing what the data manager returns (owner override, autosave to
+    # testdata, record objects) and logging. Connection calls its data manager on threads, and AsyncConnection
+    # awaits its own, but both go through these helpers for everything else. See Connection for the options.
 
     __version__ = '0.1'
 
-    def __init__(self, lims_url=None, lims_token=None, apiversion='v1', verbose=False, override_owner=None, local_only=False, testdata_update_mode=False, verify_cert=False):
+    # Page size used by iterpages when neither the call nor the Connection sets one.
+    DEFAULT_PAGE_SIZE = 500
 
-        # The Connection class is a tool for connecting to the HTTP API of the UHTS LIMS
-        # for making queries or updating objects in the database.
-
-        # INPUT ARGUMENTS
-        #
-        # lims_url and lims_token are required unless local_only==True.
-        # They can be provided as arguments to the constructor, as env vars LIMS_URL and LIMS_TOKEN, or via manual entry
-        #
-        # verbose=True will cause diagnostic information to be logged (to stdout)
-        #
-        # override_owner='valid.email@address.edu'
-        # When override_owner is set to a valid email address, the owner email address in 'runinfo' will be replaced
-        # with this value. This is useful for testing purposes, so that real data sets can be run, but notification
-        # emails will be set to a designated test email address instead of to Sequencing Center customers.
-        #
-        # local_only=True will prevent any connection to the LIMS, either read or write.
-        # Instead the test database will be used. This is saved as a flat file that can be checked in with source code.
-        #
-        # testdata_update_mode=True will write the results of every query to the local database. This is useful for
-        # saving a copy of data from remote LIMS to the code base to be used later for testing without connecting to the
-        # remote LIMS.
-        #
-        # verify_cert=True will cause an exception to be raised if the LIMS ssl certificate is not from a trusted source.
+    # The record class of each index kind, for records=True.
+    RECORDCLASSES = {
+        'solexaruns': SolexaRun,
+        'pipelineruns': PipelineRun,
+        'laneresults': SolexaLaneResult,
+        'mapperresults': MapperResult,
+        }
 
+    def __init__(self, lims_url=None, lims_token=None, apiversion='v1', verbose=False, override_owner=None, local_only=False, testdata_update_mode=False, verify_cert=False,
+                 local_db=None, flush_every=100, local_snapshot=None, page_size=None, timeout=(10, 120), retries=3, retry_writes=False,
+                 breaker_threshold=5, breaker_reset_time=30, metrics=False, tracer=None, trace_file=None, render_samplesheets=False):
 
         # turn on logs to stdout
         self.verbose = verbose
 
+        self.local_db = local_db
+        self.flush_every = flush_every
+        self.local_snapshot = local_snapshot
+        self.page_size = page_size
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_writes = retry_writes
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_time = breaker_reset_time
+        self._metrics = Metrics() if metrics else None
+        self.render_samplesheets = render_samplesheets
+        self.tracer = tracer if tracer is not None else Tracer()
+        self._tracesink = self.tracer.addsink(JsonLinesSink(trace_file)) if trace_file else None
+
         # If LIMS info not provided to constructor, get it from environment variables
         if not lims_url:
             lims_url = os.getenv('UHTS_LIMS_URL')
@@ -66,20 +100,20 @@ class Connection:
         if local_only:
             # No connection with LIMS. Since this is used for testing mode,
             # we load the test data.
-            self.server = local.LocalDataManager()
+            self.server = self._makelocalserver()
             self.autosaveserver = None
             self.log('Running in local only mode')
 
         elif testdata_update_mode:
             # Remote LIMS is used, but all queries are saved to local testdata.
-            self.server = remote.RemoteDataManager(lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verify=verify_cert)
-            self.autosaveserver = local.LocalDataManager()
+            self.server = self._makeremoteserver(lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verify=verify_cert)
+            self.autosaveserver = self._makelocalstore(flush_every=flush_every)
             self.log('Running in testdata update mode')
 
         else:
             # Normal mode where we work with the LIMS and
             # disable the local cache.
-            self.server = remote.RemoteDataManager(lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verify=verify_cert)
+            self.server = self._makeremoteserver(lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verify=verify_cert)
             self.autosaveserver = None
             self.log('Running in normal mode, reading from and writing to remote LIMS')
 
@@ -92,52 +126,154 @@ class Connection:
         else:
             self.override_owner = self._clean_override_owner(override_owner)
 
+        # The autosave store isn't thread-safe, and the *_many methods call into it from worker threads.
+        self._autosavelock = threading.RLock()
+
         # Initialize pretty printer for writing data structures in the log
         self.pprint = pprint.PrettyPrinter(indent=2, width=1).pprint
 
-    def get_runname_from_flowcell_id(self,flowcell_id):
-        runname = self.server.get_runname_from_flowcell_id(flowcell_id)
-        return runname
-    def getrunstoanalyze(self):
-        runs = self.server.getrunstoanalyze()
-        return runs
+    def _makeremoteserver(self, lims_url, lims_token, apiversion, verify):
+        raise NotImplementedError
 
-    def getsamplesheet(self, run, bcl2fastq_version, lane=None, filename='samplesheet.csv'):
-        """
-        Creates a sample sheet for demultiplexing. The sample sheet can be created for all lanes on the given run, or 
-        just the specified lane. Supports bcl2fastq 1x and 2x. For 2x, the second index (I5) is reverse-complemented
-        with respect to what's stored in UHTS. As stated in the Illumina docs: For Illumina sequencing systems running
-        RTA version 1.18.54 and later, use bcl2fastq2 Conversion Software v2.17.  For Illumina sequencing systems runnings
-        RTA versions earlier than 1.18.54, use bcl2fastq Conversion Software v1.8.4.
+    def _retrypolicy(self):
+        return RetryPolicy(retries=self.retries, retry_writes=self.retry_writes)
 
-        The version of RTA used in the sequencing run can be found in the runParameters.xml file with the run directory.
+    def _circuitbreaker(self):
+        return CircuitBreaker(threshold=self.breaker_threshold, reset_time=self.breaker_reset_time)
 
-        Args     : run - The sequencing run name.
-                   bcl2fastq_version - int. The major version number of the bcl2fastq demultiplexer that will be used to demultiplex the run. This
-                                       argument determines the format of the output sample sheet.
-                   lane - int. The number of the lane sequenced. Presence of this option limits the samplesheet to contain samples only from the specified lane.
-        """
+    def _makelocalserver(self):
+        return self._makelocalstore()
+
+    def _makelocalstore(self, flush_every=None):
+        if self.local_db:
+            return SqliteDataManager(self.local_db)
+        return local.LocalDataManager(flush_every=flush_every, snapshotfile=self.local_snapshot)
+
+    def _splitsamplesheet(self, run, samplesheet):
+        lanesamplesheets = splitsamplesheet(samplesheet)
+        if self.autosaveserver:
+            for lane, lanesamplesheet in lanesamplesheets.items():
+                self._autosave('addsamplesheet', run=run, samplesheet=lanesamplesheet, lane=lane)
+            self.logf("Added samplesheets for run %s lanes %s to testdata.", run, sorted(lanesamplesheets, key=int))
+        return lanesamplesheets
+
+    def _bulkitems(self, items):
+        if hasattr(items, 'items'):
+            return list(items.items())
+        return list(enumerate(items))
+
+    def _listtodict(self, resultslist):
+        return dict((str(result.get('id')), result) for result in resultslist)
+
+    def remotestats(self):
+        # Counters of requests, retries, timeouts, connection errors and failures of the calls to the LIMS, and the
+        # state of the circuit breaker. None in local_only mode.
+        if self.server.localorremote != 'remote':
+            return None
+        return self.server.stats()
+
+    def metrics(self):
+        # Per-endpoint call counts, rates, retries, and latency and size percentiles (see metrics.Metrics.snapshot),
+        # or None if the Connection was made without metrics=True.
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot()
+
+    def writemetrics(self, path):
+        # Writes the metrics in Prometheus text exposition format, e.g. for the node_exporter textfile collector.
+        if self._metrics is None:
+            raise Exception('Metrics are not enabled. Create the Connection with metrics=True.')
+        self._metrics.writeprometheus(path)
+
+    def _write_not_supported_error(self):
+        raise Exception('Write operations are not supported in test_data_update mode. '+
+                        'If you want to create objects in the local cache, run in local_only '+
+                        'mode and call write_to_disk')
+
+    def _delete_not_supported_error(self):
+        raise Exception('Delete operations are not supported in test_data_update mode. '+
+                        'If you want to destroy objects in the local cache, run in local_only '+
+                        'mode and call write_to_disk')
+
+    def _torecords(self, recordclass, objects):
+        # records=True on the index methods returns compact record objects (see models.Record) instead of dicts,
+        # for callers that hold many of them at once.
+        return dict((id, recordclass.from_dict(obj)) for id, obj in objects.items())
+
+    def flush(self):
+        # Writes the testdata recorded in testdata_update_mode that hasn't been written to disk yet.
+        if self.autosaveserver is not None:
+            with self._autosavelock:
+                self.autosaveserver.flush()
+
+    def _closetracesink(self):
+        # Only the sink made for trace_file is ours to close; the tracer may be shared with other Connections.
+        if self._tracesink is not None:
+            self.tracer.removesink(self._tracesink)
+            self._tracesink.close()
+            self._tracesink = None
+
+    def _processruninfo(self, runinfo):
+
+        # Replace emails if override_owner is set
+        if self.override_owner:
+            lanes = runinfo['run_info']['lanes']
+            for lane in lanes.values():
+                for notify in lane.get('notify'):
+                    notify['email'] = self.override_owner
+                    lane['submitter_email'] = self.override_owner
+        return runinfo
+
+    def _clean_override_owner(self, email):
+
+        if re.match(r'^\S+@\S+\.\S+$', email):
+            return email
+        else:
+            raise Exception('override_owner setting "%s" is not a valid email address.' % email)
+
+    def log(self, message, pretty=False):
+        if self.verbose:
+            if pretty:
+                self.pprint(message)
+            else:
+                print(message)
+
+    def logf(self, message, *args):
+        # Like log, but message is %-formatted with args only when verbose, so callers pass the values rather
+        # than a formatted string, and large paramdicts aren't stringified for nothing.
+        if self.verbose:
+            print(message % args)
+
+    def _autosave(self, addmethod, *args, **kwargs):
+        # Records an object read from the LIMS with the named add* method of the testdata store in
+        # testdata_update_mode. Returns whether it was recorded.
+        if not self.autosaveserver:
+            return False
+        with self._autosavelock:
+            getattr(self.autosaveserver, addmethod)(*args, **kwargs)
+        return True
+
+    def _startsamplesheet(self, run, bcl2fastq_version, lane, filename):
+        # Checks the getsamplesheet arguments, and returns bcl2fastq_version as an int.
         bcl2fastqVersions = [1,2]
         bcl2fastq_version = int(bcl2fastq_version)
         if bcl2fastq_version not in bcl2fastqVersions:
             raise ValueError("Invalid bcl2fastq_version '{version}'. Must be one of {valid}.".format(version=bcl2fastq_version,valid=bcl2fastqVersions))
         if lane is None:
-            self.log("Writing samplesheet for run %s, all lanes, to file %s" % (run, filename))
+            self.logf("Writing samplesheet for run %s, all lanes, to file %s", run, filename)
         else:
-            self.log("Writing samplesheet for run %s lane %s to file %s" % (run, lane, filename))
-
-        samplesheet = self.server.getsamplesheet(run=run, lane=lane,bcl2fastq_version=bcl2fastq_version)
+            self.logf("Writing samplesheet for run %s lane %s to file %s", run, lane, filename)
+        return bcl2fastq_version
 
+    def _finishsamplesheet(self, run, samplesheet, lane, filename):
         if not samplesheet:
             raise Exception('samplesheet for run %s could not be found.' % run)
 
-        if self.autosaveserver:
-            self.autosaveserver.addsamplesheet(run=run, samplesheet=samplesheet, lane=lane)
-            self.autosaveserver.writesamplesheetstodisk()
+        if self._autosave('addsamplesheet', run=run, samplesheet=samplesheet, lane=lane):
             if lane is None:
-                self.log("Added samplesheet for run %s all lanes to testdata." % run)
+                self.logf("Added samplesheet for run %s all lanes to testdata.", run)
             else:
-                self.log("Added samplesheet for run %s lane %s to testdata." % (run, lane))
+                self.logf("Added samplesheet for run %s lane %s to testdata.", run, lane)
 
         if filename:
             with open(filename, 'w') as f:
@@ -146,32 +282,360 @@ class Connection:
         self.log(samplesheet)
         return samplesheet
 
-    def getruninfo(self, run=None):
-        self.log("Getting run info for run %s" % run)
-        dirty_runinfo = self.server.getruninfo(run=run)
+    def _finishruninfo(self, run, dirty_runinfo):
         runinfo = self._processruninfo(dirty_runinfo) #update emails if self.override_owner is True
 
         if not runinfo:
             raise Exception('runinfo for run %s could not be found.' % run)
 
-        if self.autosaveserver:
-            self.autosaveserver.addruninfo(run=run, runinfo=runinfo)
-            self.autosaveserver.writeruninfotodisk()
-            self.log("Added runinfo for %s to testdata." % run)
+        if self._autosave('addruninfo', run=run, runinfo=runinfo):
+            self.logf("Added runinfo for %s to testdata.", run)
 
         self.log(runinfo, pretty=True)
         return runinfo
 
+    def _finishshow(self, kind, id, found):
+        # kind is the singular, e.g. 'solexarun', as in the show* and add* method names.
+        if not found:
+            raise Exception('%s with id %s could not be found.' % (kind, id))
+
+        if self._autosave('add' + kind, id, found):
+            self.logf("Added %s id %s to testdata.", kind, id)
+
+        self.log(found, pretty=True)
+        return found
+
+    def _finishindex(self, kind, found, records):
+        # kind is the plural, e.g. 'solexaruns', as in the index* and batch add* method names.
+        if self._autosave('add' + kind, found):
+            self.logf("Added %s %s to testdata", len(found), kind)
+
+        self.log(found, pretty=True)
+        if records:
+            return self._torecords(self.RECORDCLASSES[kind], found)
+        return found
+
+    def _pagefilters(self, kind, lane, barcode, readnumber):
+        # The index filters iterpages passes on for kind; only laneresults can be narrowed.
+        if kind not in remote.RemoteDataManager.INDEXENDPOINTS:
+            raise Exception('Unknown kind %s. Expected one of %s' % (kind, ', '.join(sorted(remote.RemoteDataManager.INDEXENDPOINTS))))
+        if kind == 'laneresults':
+            return {'lane': lane, 'barcode': barcode, 'readnumber': readnumber}
+        return {}
+
+    def _iterresult(self, result, addmethod, recordclass):
+        # What the iter* methods do with each result before yielding it.
+        self._autosave(addmethod, str(result.get('id')), result)
+        if recordclass is not None:
+            result = recordclass.from_dict(result)
+        return result
+
+    def _mapperresultparams(self, mapperresults, laneresults):
+        # The (key, paramdict) of each mapper result createmapperresults_bulk creates, with dataset_id taken from
+        # laneresults when given, and errors for the mapper results whose lane result wasn't created.
+        params = []
+        errors = {}
+        for key, paramdict in self._bulkitems(mapperresults):
+            if laneresults is not None:
+                laneresultkey, paramdict = paramdict
+                if laneresultkey not in laneresults:
+                    errors[key] = Exception('Lane result %s was not created: %s' % (laneresultkey, laneresults.errors.get(laneresultkey, 'no such key')))
+                    continue
+                paramdict = dict(paramdict, dataset_id=laneresults[laneresultkey]['id'])
+            params.append((key, paramdict))
+        return params, errors
+
+    def _runbundle(self, run, runinfo, solexaruns, solexaflowcell, samplesheet, lanesamplesheets, pipelineruns, laneresults, mapperresults):
+        # Puts the objects getallrunobjects fetched into a RunBundle, with lanesamplesheets in runinfo lane order.
+        solexarun = None
+        if solexaruns:
+            solexarun = list(solexaruns.values())[0]
+        return RunBundle(
+            run=run,
+            runinfo=runinfo,
+            solexarun=solexarun,
+            solexaflowcell=solexaflowcell,
+            samplesheet=samplesheet,
+            lanesamplesheets=dict((lane, lanesamplesheets[lane]) for lane in runinfo['run_info']['lanes']),
+            pipelineruns=pipelineruns,
+            laneresults=laneresults,
+            mapperresults=mapperresults,
+            )
+
+    def _lanenumfromsample(self, ri, run, sample):
+        for lane in ri["lanes"]:
+            lane_sample = ri["lanes"][lane]["sample_name"].split("rcvd")[0].strip()
+            if lane_sample == sample:
+                return lane
+        raise Exception("Sample {sample} appears not to have been sequenced on any of the lanes for run {run}.".format(sample=sample,run=run))
+
+    def _hasfinishedpipelinerun(self, uhtsPipelineRuns):
+        for uhtsRun in uhtsPipelineRuns:
+            if uhtsPipelineRuns[uhtsRun]['finished']:
+                return True
+        return False
+
+class Connection(BaseConnection):
+
+    def __init__(self, lims_url=None, lims_token=None, apiversion='v1', verbose=False, override_owner=None, local_only=False, testdata_update_mode=False, verify_cert=False,
+                 pool_connections=10, pool_maxsize=10, pool_block=False, cache=False, cache_size=1024, cache_ttl=300, cache_ttls=None,
+                 http_cache_dir=None, http_cache_size=256 * 1024 * 1024, http_cache_max_age=600, local_db=None, flush_every=100, local_snapshot=None,
+                 page_size=None, timeout=(10, 120), retries=3, retry_writes=False, breaker_threshold=5, breaker_reset_time=30,
+                 metrics=False, cassette=None, cassette_mode='replay', tracer=None, trace_file=None, render_samplesheets=False):
+
+        # The Connection class is a tool for connecting to the HTTP API of the UHTS LIMS
+        # for making queries or updating objects in the database.
+
+        # INPUT ARGUMENTS
+        #
+        # lims_url and lims_token are required unless local_only==True.
+        # They can be provided as arguments to the constructor, as env vars LIMS_URL and LIMS_TOKEN, or via manual entry
+        #
+        # verbose=True will cause diagnostic information to be logged (to stdout)
+        #
+        # override_owner='valid.email@address.edu'
+        # When override_owner is set to a valid email address, the owner email address in 'runinfo' will be replaced
+        # with this value. This is useful for testing purposes, so that real data sets can be run, but notification
+        # emails will be set to a designated test email address instead of to Sequencing Center customers.
+        #
+        # local_only=True will prevent any connection to the LIMS, either read or write.
+        # Instead the test database will be used. This is saved as a flat file that can be checked in with source code.
+        #
+        # testdata_update_mode=True will write the results of every query to the local database. This is useful for
+        # saving a copy of data from remote LIMS to the code base to be used later for testing without connecting to the
+        # remote LIMS. Recorded objects are written to disk in batches: every flush_every changed objects, on
+        # flush(), and on close() or the end of a with block. Objects that were already recorded unchanged cost
+        # nothing, and each file is replaced atomically, so an interrupted recording never leaves a truncated file.
+        #
+        # verify_cert=True will cause an exception to be raised if the LIMS ssl certificate is not from a trusted source.
+        #
+        # pool_connections, pool_maxsize and pool_block configure the pool of keep-alive connections shared by all
+        # requests to the LIMS. pool_connections is the number of hosts to keep pools for, pool_maxsize is the
+        # maximum number of open connections per host, and pool_block=True makes threads wait for a free connection
+        # rather than opening a throwaway one when all pooled connections are busy.
+        #
+        # cache=True keeps the results of read methods (runinfo, samplesheets, show* and index*) in an in-process
+        # cache, so repeated reads of the same object don't go back to the LIMS. cache_size bounds the number of
+        # entries (least recently used are evicted), cache_ttl is the lifetime in seconds, and cache_ttls
+        # overrides it per object kind, e.g. {'runinfo': 30, 'laneresults': 600}. Writes made through this
+        # Connection invalidate the entries they affect. See cachestats() for hit/miss counters.
+        #
+        # http_cache_dir='~/.cache/scgpm_lims' turns on a persistent on-disk cache of GET responses that is shared
+        # between processes, e.g. repeated cron invocations of a script. Entries are keyed by url and parameters
+        # (never the token), revalidated with ETag/Last-Modified when the LIMS provides them, and otherwise kept
+        # for http_cache_max_age seconds. http_cache_size bounds the directory size in bytes. Since writes from
+        # other processes can't invalidate it, only use it where reading slightly old data is acceptable.
+        #
+        # local_db='lims.sqlite' keeps the local database (used by local_only and testdata_update_mode) in an SQLite
+        # file instead of the JSON testdata files, for local mirrors too large to hold in memory. Lookups use indexes
+        # and writes are committed as they happen. See scgpm_lims/testdatatosqlite.py to import the JSON testdata.
+        #
+        # local_snapshot='testdata.snapshot' reads the local database from a memory-mapped snapshot file instead of
+        # the JSON testdata files, so local_only processes start without parsing records they never read. Create
+        # one with scgpm_lims/testdatatosnapshot.py.
+        #
+        # page_size=500 makes indexsolexaruns, indexpipelineruns, indexlaneresults and indexmapperresults fetch
+        # their results from the LIMS in pages of that many objects (the page and per_page parameters), with the
+        # next page requested while the current one is processed, instead of in one large response. Each index
+        # method also takes page_size to override it per call. See iterpages() to process the pages one at a time.
+        #
+        # timeout is the (connect, read) timeout in seconds of each request to the LIMS, so a hung LIMS can't block
+        # a worker forever. Reads that fail with a connection error, a timeout or a 429/5xx status are retried up
+        # to retries times, with exponential backoff and jitter. Writes are only retried with retry_writes=True,
+        # since a write that timed out may have been applied. After breaker_threshold consecutive failures, calls
+        # fail fast with resilience.CircuitOpenError for breaker_reset_time seconds instead of waiting on the LIMS.
+        # See remotestats() for retry/timeout counters.
+        #
+        # metrics=True records the endpoint, method, status, latency, response size and retries of every call to the
+        # LIMS in in-memory histograms. Read them with metrics() (p50/p95/p99 latency per endpoint), or write them in
+        # Prometheus text format with writemetrics(path). When off, calls aren't timed at all.
+        #
+        # cassette='lims.cassette' with cassette_mode='record' appends the raw response of every call to the LIMS to
+        # that file. With cassette_mode='replay' the calls are answered from the file instead, with no network and
+        # no lims_url or lims_token needed, and a call that wasn't recorded raises. This records test fixtures
+        # exactly as the LIMS returned them, including writes, where testdata_update_mode only keeps the objects
+        # read. See cassette.Cassette.
+        #
+        # tracer is a tracing.Tracer that the public methods and every HTTP request to the LIMS are reported to as
+        # nested spans, with their run, lane, id etc., result sizes, request and response bytes, status and duration.
+        # By default the Connection has its own, with no sinks, and then nothing is recorded or formatted at all.
+        # trace_file='trace.jsonl' adds a sink that appends the spans to that file as JSON lines; other sinks can
+        # be attached any time with conn.tracer.addsink().
+        #
+        # render_samplesheets=True makes getsamplesheet build samplesheets from the runinfo (see
+        # samplesheet.rendersamplesheet) instead of requesting each one from the LIMS, so with cache=True, or in
+        # getallrunobjects, samplesheets for every lane cost no extra requests.
+
+
+        # The options that only Connection has are set first, since BaseConnection makes the data manager.
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.http_cache_dir = http_cache_dir
+        self.http_cache_size = http_cache_size
+        self.http_cache_max_age = http_cache_max_age
+        self.cassette = cassette
+        self.cassette_mode = cassette_mode
+
+        if cassette is not None:
+            if cassette_mode not in ('record', 'replay'):
+                raise Exception("cassette_mode must be 'record' or 'replay', not %s" % cassette_mode)
+            if local_only:
+                raise Exception("You cannot use local_only with a cassette")
+            if cassette_mode == 'replay':
+                # Nothing is sent, so any url and token will do.
+                lims_url = lims_url or 'http://cassette'
+                lims_token = lims_token or 'cassette'
+
+        BaseConnection.__init__(self, lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verbose=verbose,
+                                override_owner=override_owner, local_only=local_only, testdata_update_mode=testdata_update_mode,
+                                verify_cert=verify_cert, local_db=local_db, flush_every=flush_every, local_snapshot=local_snapshot,
+                                page_size=page_size, timeout=timeout, retries=retries, retry_writes=retry_writes,
+                                breaker_threshold=breaker_threshold, breaker_reset_time=breaker_reset_time, metrics=metrics,
+                                tracer=tracer, trace_file=trace_file, render_samplesheets=render_samplesheets)
+
+        if cache:
+            self.cache = ObjectCache(maxsize=cache_size, ttl=cache_ttl, ttls=cache_ttls)
+        else:
+            self.cache = None
+
+    def _makeremoteserver(self, lims_url, lims_token, apiversion, verify):
+        # One pool of keep-alive connections is shared by every request made through this Connection.
+        httpcache = None
+        if self.http_cache_dir:
+            httpcache = DiskResponseCache(self.http_cache_dir, max_bytes=self.http_cache_size, max_age=self.http_cache_max_age)
+        if self.cassette is not None and self.cassette_mode == 'replay':
+            transport = ReplayTransport(Cassette(self.cassette))
+        else:
+            transport = HttpTransport(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize, pool_block=self.pool_block, cache=httpcache,
+                                      timeout=self.timeout, retry=self._retrypolicy(), breaker=self._circuitbreaker(), metrics=self._metrics,
+                                      tracer=self.tracer)
+            if self.cassette is not None:
+                transport = RecordingTransport(transport, Cassette(self.cassette))
+        return remote.RemoteDataManager(lims_url=lims_url, lims_token=lims_token, apiversion=apiversion, verify=verify, transport=transport)
+
+    @traced('flowcell_id')
+    def get_runname_from_flowcell_id(self,flowcell_id):
+        runname = self.server.get_runname_from_flowcell_id(flowcell_id)
+        if not runname:
+            raise Exception('run name for flow cell %s could not be found.' % flowcell_id)
+        return runname
+
+    @traced()
+    def get_runnames_from_flowcell_ids(self, flowcell_ids, max_workers=None):
+        """
+        Resolves many flow cell IDs to run names concurrently. Each distinct ID is only looked up once.
+
+        Returns : BatchResults keyed by flow cell ID. IDs that failed to resolve are in its errors dict.
+        """
+        return self._runmany(self.get_runname_from_flowcell_id, flowcell_ids, max_workers)
+
+    def iter_runnames_from_flowcell_ids(self, flowcell_ids, max_workers=None):
+        """
+        Streaming version of get_runnames_from_flowcell_ids for very long inputs. flowcell_ids can be any
+        iterable, e.g. an open file, and is consumed lazily. Lookups run concurrently on max_workers threads
+        (default pool_maxsize), and results are yielded in input order as soon as they, and every result before
+        them, are ready. An ID that repeats while an earlier occurrence is still waiting to be yielded is looked
+        up once, and every occurrence is yielded.
+
+        Yields : (flowcell_id, run_name, error) tuples. error is None on success, otherwise it is the exception
+                 and run_name is None.
+        """
+        if max_workers is None:
+            max_workers = self.pool_maxsize
+        # Bound how far lookups can run ahead of the output, and drop each lookup once its last pending
+        # occurrence is yielded, so memory doesn't grow with the input.
+        window = max_workers * 4
+        futures = {}    # flowcell_id -> [future, occurrences in pending]
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for flowcell_id in flowcell_ids:
+                if flowcell_id in futures:
+                    futures[flowcell_id][1] += 1
+                else:
+                    futures[flowcell_id] = [submit(pool, self.get_runname_from_flowcell_id, flowcell_id), 1]
+                pending.append(flowcell_id)
+                while len(pending) > window:
+                    yield self._futureresult(pending.popleft(), futures)
+            while pending:
+                yield self._futureresult(pending.popleft(), futures)
+
+    def _futureresult(self, key, futures):
+        entry = futures[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del futures[key]
+        try:
+            return key, entry[0].result(), None
+        except Exception as e:
+            return key, None, e
+
+    @traced()
+    def getrunstoanalyze(self):
+        runs = self.server.getrunstoanalyze()
+        return runs
+
+    @traced('run', 'bcl2fastq_version', 'lane')
+    def getsamplesheet(self, run, bcl2fastq_version, lane=None, filename='samplesheet.csv', runinfo=None):
+        """
+        Creates a sample sheet for demultiplexing. The sample sheet can be created for all lanes on the given run, or 
+        just the specified lane. Supports bcl2fastq 1x and 2x. For 2x, the second index (I5) is reverse-complemented
+        with respect to what's stored in UHTS. As stated in the Illumina docs: For Illumina sequencing systems running
+        RTA version 1.18.54 and later, use bcl2fastq2 Conversion Software v2.17.  For Illumina sequencing systems runnings
+        RTA versions earlier than 1.18.54, use bcl2fastq Conversion Software v1.8.4.
+
+        The version of RTA used in the sequencing run can be found in the runParameters.xml file with the run directory.
+
+        Args     : run - The sequencing run name.
+                   bcl2fastq_version - int. The major version number of the bcl2fastq demultiplexer that will be used to demultiplex the run. This
+                                       argument determines the format of the output sample sheet.
+                   lane - int. The number of the lane sequenced. Presence of this option limits the samplesheet to contain samples only from the specified lane.
+                   runinfo - dict. With render_samplesheets=True, the run's runinfo if the caller already has it, so it isn't fetched again.
+        """
+        bcl2fastq_version = self._startsamplesheet(run, bcl2fastq_version, lane, filename)
+
+        if self.render_samplesheets:
+            if runinfo is None:
+                runinfo = self.getruninfo(run)
+            samplesheet = rendersamplesheet(runinfo, bcl2fastq_version, lane=lane)
+        else:
+            samplesheet = self._cached('samplesheet', (run, None if lane is None else str(lane), bcl2fastq_version),
+                                       self.server.getsamplesheet, run=run, lane=lane, bcl2fastq_version=bcl2fastq_version)
+        return self._finishsamplesheet(run, samplesheet, lane, filename)
+
+    @traced('run', 'bcl2fastq_version')
+    def getlanesamplesheets(self, run, bcl2fastq_version):
+        """
+        Gets the samplesheet of every lane of a run from one all-lanes samplesheet, instead of one getsamplesheet
+        call per lane. Each is the same as getsamplesheet returns for that lane. In testdata_update_mode, the
+        all-lanes and each lane's samplesheet are added to the testdata.
+
+        Args     : run - The sequencing run name.
+                   bcl2fastq_version - int. The major version number of bcl2fastq; see getsamplesheet.
+        Returns  : dict of lane number (str, as in the runinfo lanes and RunBundle.lanesamplesheets) to samplesheet,
+                   for the lanes that have rows in the samplesheet.
+        """
+        return self._splitsamplesheet(run, self.getsamplesheet(run, bcl2fastq_version, filename=None))
+
+    @traced('run')
+    def getruninfo(self, run=None):
+        self.logf("Getting run info for run %s", run)
+        dirty_runinfo = self._cached('runinfo', (run,), self.server.getruninfo, run=run)
+        return self._finishruninfo(run, dirty_runinfo)
+
+    @traced('dna_library_id')
     def getdnalibraryinfo(self, dna_library_id):
-        self.log("Getting info for DNA library: %d" % dna_library_id)
+        self.logf("Getting info for DNA library: %d", dna_library_id)
         dna_library_info = self.server.get_dna_library_info(dna_library_id)
 
         if not dna_library_info:
             raise Exception('DNA library info for DNA library ID %d could not be found.' % dna_library_id)
 
         return(dna_library_info)
+
+    @traced('run', 'lane')
     def get_library(self,run,lane):
-        self.log("Getting library info for run {run} and lane {lane}.".format(run=run,lane=lane))
+        self.logf("Getting library info for run %s and lane %s.", run, lane)
 
         library = self.server.get_library(run=run,lane=lane)
 
@@ -183,40 +647,41 @@ class Connection:
         return library 
 
     def getlanenumfromsample(self,run,sample):
-        ri = self.getruninfo(run=run)
-        for lane in ri["lanes"]:
-            lane_sample = ri["lanes"][lane]["sample_name"].split("rcvd")[0].strip()
-            if lane_sample == sample:
-                return lane
-        raise Exception("Sample {sample} appears not to have been sequenced on any of the lanes for run {run}.".format(sample=sample,run=run))
+        return self._lanenumfromsample(self.getruninfo(run=run), run, sample)
 
+    @traced('run')
     def createpipelinerun(self, run, paramdict = None):
         self.log("Resetting any old results before creating pipeline run")
         if self.autosaveserver:
             self._write_not_supported_error()
 
-        self.log("Creating pipeline run object for run=%s, paramdict=%s" % (run, paramdict))
+        self.logf("Creating pipeline run object for run=%s, paramdict=%s", run, paramdict)
         pipelinerun = self.server.createpipelinerun(run=run,paramdict=paramdict)
+        self._invalidate(('runinfo', run), ('pipelineruns', run))
         if not pipelinerun:
             raise Exception('Failed to create pipelinerun for run=%s paramdict=%s' % (run, paramdict))
 
         self.log(pipelinerun, pretty=True)
         return pipelinerun
 
+    @traced('run', 'lane')
     def deletelaneresults(self, run, lane):
         self.log("Resetting old results")
         if self.autosaveserver:
             self._delete_not_supported_error()
 
         self.server.deletelaneresults(run, lane)
+        self._invalidate(('laneresults', run), ('laneresult',), ('mapperresults', run), ('mapperresult',))
 
 
+    @traced('run', 'lane')
     def createlaneresult(self, paramdict, run, lane):
-        self.log("Creating lane result for run=%s, lane=%s, paramsdict=%s" % (run, lane, paramdict))
+        self.logf("Creating lane result for run=%s, lane=%s, paramsdict=%s", run, lane, paramdict)
         if self.autosaveserver:
             self._write_not_supported_error()
 
         laneresult = self.server.createlaneresult(paramdict, run=run, lane=lane)
+        self._invalidate(('laneresults', run))
 
         if not laneresult:
             raise Exception('Failed to create laneresult for run=%s lane=%s paramdict=%s' % (run, lane, paramdict))
@@ -227,12 +692,14 @@ class Connection:
         self.log(laneresult, pretty=True)
         return laneresult
 
+    @traced()
     def createmapperresult(self, paramdict):
-        self.log("Creating mapper result with paramsdict=%s" % paramdict)
+        self.logf("Creating mapper result with paramsdict=%s", paramdict)
         if self.autosaveserver:
             self._write_not_supported_error()
         
         mapperresult = self.server.createmapperresult(paramdict)
+        self._invalidate(('mapperresults',))
 
         if not mapperresult:
             raise Exception('Failed to create mapperresult for paramdict=%s' % paramdict)
@@ -240,150 +707,182 @@ class Connection:
         self.log(mapperresult, pretty=True)
         return mapperresult
 
-    def showsolexarun(self, id):
-        self.log("Getting solexarun id %s" % id)
-        solexarun = self.server.showsolexarun(id)
-
-        if not solexarun:
-            raise Exception('solexarun with id %s could not be found.' % id)
-        
+    @traced()
+    def createlaneresults_bulk(self, laneresults, max_workers=None):
+        """
+        Function : Creates many lane results concurrently, e.g. one per lane, barcode and read at the end of an analysis.
+                   A failed create doesn't stop the others.
+        Args     : laneresults - iterable of (run, lane, paramdict), or a dict of any key to (run, lane, paramdict).
+                   max_workers - number of creates in flight at once; defaults to the pool_maxsize of the Connection.
+        Returns  : BatchResults keyed by the dict keys (or positions in the iterable) of the lane results that were
+                   created, valued by the created lane result. The exceptions of failed creates are in its errors.
+        """
         if self.autosaveserver:
-            self.autosaveserver.addsolexarun(id=id, solexarun=solexarun)
-            self.writesolexarunstodisk()
-            self.log("Added solexarun %s to testdata." % run_name)
-
-        self.log(solexarun, pretty=True)
-        return solexarun
-
-    def showsolexaflowcell(self, id):
-        self.log("Getting solexaflowcell id %s" % id)
-        solexaflowcell = self.server.showsolexaflowcell(id)
-
-        if not solexaflowcell:
-            raise Exception('solexaflowcell with id %s could not be found.' % id)
+            self._write_not_supported_error()
+        calls = [(key, self.createlaneresult, (paramdict, run, lane)) for key, (run, lane, paramdict) in self._bulkitems(laneresults)]
+        return self._runbatch(calls, self._bulkworkers(max_workers))
 
+    @traced()
+    def createmapperresults_bulk(self, mapperresults, laneresults=None, max_workers=None):
+        """
+        Function : Creates many mapper results concurrently. A failed create doesn't stop the others.
+        Args     : mapperresults - iterable of paramdicts, or a dict of any key to a paramdict.
+                   laneresults - optional BatchResults from createlaneresults_bulk. When given, each item of mapperresults
+                                 is instead a (lane result key, paramdict) pair, and dataset_id is set to the id of the lane
+                                 result created under that key. Items whose lane result failed are reported as errors
+                                 without being sent.
+                   max_workers - number of creates in flight at once; defaults to the pool_maxsize of the Connection.
+        Returns  : BatchResults keyed like mapperresults, valued by the created mapper result.
+        """
         if self.autosaveserver:
-            self.autosaveserver.addsolexaflowcell(id=id, solexaflowcell=solexaflowcell)
-            self.autosaveserver.writesolexaflowcellstodisk()
-            self.log("added solexaflowcell id %s to testdata." % id)
-
-        self.log(solexaflowcell, pretty=True)
-        return solexaflowcell
+            self._write_not_supported_error()
+        params, errors = self._mapperresultparams(mapperresults, laneresults)
+        calls = [(key, self.createmapperresult, (paramdict,)) for key, paramdict in params]
+        return self._runbatch(calls, self._bulkworkers(max_workers), errors=errors)
 
-    def showpipelinerun(self, id):
-        self.log("Showing pipeline run with id=%s" % id)
-        pipelinerun = self.server.showpipelinerun(id)
+    def _bulkworkers(self, max_workers):
+        # The local stores aren't safe to write from several threads, and writing to memory gains nothing from it.
+        if self.server.localorremote == 'local':
+            return 1
+        return max_workers
 
-        if not pipelinerun:
-            raise Exception('pipelinerun with id %s could not be found.' % id)
+    @traced('id')
+    def showsolexarun(self, id):
+        self.logf("Getting solexarun id %s", id)
+        solexarun = self._cached('solexarun', (str(id),), self.server.showsolexarun, id)
+        return self._finishshow('solexarun', id, solexarun)
 
-        if self.autosaveserver:
-            self.autosaveserver.addpipelinerun(id=id, pipelinerun=pipelinerun)
-            self.autosaveserver.writepipelinerunstodisk()
-            self.log("Added pipelinerun id %s to testdata." % id)
+    @traced('id')
+    def showsolexaflowcell(self, id):
+        self.logf("Getting solexaflowcell id %s", id)
+        solexaflowcell = self._cached('solexaflowcell', (str(id),), self.server.showsolexaflowcell, id)
+        return self._finishshow('solexaflowcell', id, solexaflowcell)
 
-        self.log(pipelinerun, pretty=True)
-        return pipelinerun
+    @traced('id')
+    def showpipelinerun(self, id):
+        self.logf("Showing pipeline run with id=%s", id)
+        pipelinerun = self._cached('pipelinerun', (str(id),), self.server.showpipelinerun, id)
+        return self._finishshow('pipelinerun', id, pipelinerun)
 
+    @traced('id')
     def showlaneresult(self, id):
-        self.log("Showing laneresult with id=%s" % id)
-        laneresult = self.server.showlaneresult(id)
-
-        if not laneresult:
-            raise Exception('laneresult with id %s could not be found.' % id)
-
-        if self.autosaveserver:
-            self.autosaveserver.addlaneresult(id=id, laneresult=laneresult)
-            self.autosaveserver.writelaneresultstodisk()
-            self.log("Added laneresult id %s to testdata." % id)
-
-        self.log(laneresult, pretty=True)
-        return laneresult
+        self.logf("Showing laneresult with id=%s", id)
+        laneresult = self._cached('laneresult', (str(id),), self.server.showlaneresult, id)
+        return self._finishshow('laneresult', id, laneresult)
 
+    @traced('id')
     def showmapperresult(self, id):
-        self.log("Showing mapper result with id=%s" % id)
-        mapperresult = self.server.showmapperresult(id)
-
-        if not mapperresult:
-            raise Exception('mapperresult with id %s could not be found.' % id)
-
-        if self.autosaveserver:
-            self.autosaveserver.addmapperresult(id=id, mapperresult=mapperresult)
-            self.autosaveserver.writemapperresultstodisk()
-            self.log("Added mapperresult id %s to testdata." % id)
-
-        self.log(mapperresult, pretty=True)
-        return mapperresult
-
-    def indexsolexaruns(self, run):
-        self.log("Indexing solexa run(s) where run=%s" % run)
-        solexaruns = self.server.indexsolexaruns(run)
-
-        if self.autosaveserver:
-            self.autosaveserver.addsolexaruns(solexaruns=solexaruns)
-            self.autosaveserver.writesolexarunstodisk()
-            self.log("Added %s solexa runs to testdata" % len(solexaruns))
-
-        self.log(solexaruns, pretty=True)
-        return solexaruns
-
-    def indexpipelineruns(self, run):
-        self.log("Indexing pipeline runs where run=%s" % run)
-        pipelineruns = self.server.indexpipelineruns(run)
-
-        if self.autosaveserver:
-            self.autosaveserver.addpipelineruns(pipelineruns=pipelineruns)
-            self.autosaveserver.writepipelinerunstodisk()
-            self.log("Added %s pipeline runs to testdata" % len(pipelineruns))
-
-        self.log(pipelineruns, pretty=True)
-        return pipelineruns
-
-    def indexlaneresults(self, run, lane=None, barcode=None, readnumber=None):
-
-        self.log("Indexing lane results where run=%s, lane=%s, barcode=%s" % 
-                 (run, lane, barcode))
-
-        laneresults = self.server.indexlaneresults(run, lane=lane, barcode=barcode, readnumber=readnumber)
-
-        if self.autosaveserver:
-            self.autosaveserver.addlaneresults(laneresults = laneresults)
-            self.autosaveserver.writelaneresultstodisk()
-            self.log("Added %s lane results to testdata" % len(laneresults))
-
-        self.log(laneresults, pretty=True)
-        return laneresults
-
-    def indexmapperresults(self, run):
-        self.log("Indexing mapper results where run=%s" % run)
-        mapperresults = self.server.indexmapperresults(run)
+        self.logf("Showing mapper result with id=%s", id)
+        mapperresult = self._cached('mapperresult', (str(id),), self.server.showmapperresult, id)
+        return self._finishshow('mapperresult', id, mapperresult)
+
+    @traced('run', 'page_size')
+    def indexsolexaruns(self, run, records=False, page_size=None):
+        self.logf("Indexing solexa run(s) where run=%s", run)
+        solexaruns = self._cached('solexaruns', (run,), self._index, 'solexaruns', self.server.indexsolexaruns, run, page_size)
+        return self._finishindex('solexaruns', solexaruns, records)
+
+    @traced('run', 'page_size')
+    def indexpipelineruns(self, run, records=False, page_size=None):
+        self.logf("Indexing pipeline runs where run=%s", run)
+        pipelineruns = self._cached('pipelineruns', (run,), self._index, 'pipelineruns', self.server.indexpipelineruns, run, page_size)
+        return self._finishindex('pipelineruns', pipelineruns, records)
+
+    @traced('run', 'lane', 'barcode', 'readnumber', 'page_size')
+    def indexlaneresults(self, run, lane=None, barcode=None, readnumber=None, records=False, page_size=None):
+
+        self.logf("Indexing lane results where run=%s, lane=%s, barcode=%s", run, lane, barcode)
+
+        laneresults = self._cached('laneresults', (run, lane, barcode, readnumber), self._index, 'laneresults',
+                                   self.server.indexlaneresults, run, page_size, lane=lane, barcode=barcode, readnumber=readnumber)
+        return self._finishindex('laneresults', laneresults, records)
+
+    @traced('run', 'page_size')
+    def indexmapperresults(self, run, records=False, page_size=None):
+        self.logf("Indexing mapper results where run=%s", run)
+        mapperresults = self._cached('mapperresults', (run,), self._index, 'mapperresults', self.server.indexmapperresults, run, page_size)
+        return self._finishindex('mapperresults', mapperresults, records)
+
+    def iterpages(self, kind, run, page_size=None, prefetch=True, lane=None, barcode=None, readnumber=None):
+        """
+        Function : Lazily fetches the solexaruns, pipelineruns, laneresults or mapperresults (the kind) of a run one
+                   page at a time. With prefetch, the next page is requested in the background while the caller
+                   processes the current one. If a page fails, the error is raised and the next call to next()
+                   retries that page, so the pages already processed aren't fetched again.
+        Args     : page_size - objects per page; defaults to the Connection's page_size, or 500.
+                   lane, barcode, readnumber - narrow laneresults like indexlaneresults does.
+        Returns  : paging.PageIterator yielding a dict per page, keyed by object id like the index methods.
+        """
+        filters = self._pagefilters(kind, lane, barcode, readnumber)
+        return PageIterator(lambda page, size: self._getpage(kind, page, size, run, filters),
+                            page_size or self.page_size or self.DEFAULT_PAGE_SIZE, prefetch=prefetch, ids=dict.keys)
+
+    @traced('kind', 'page', 'page_size', 'run')
+    def _getpage(self, kind, page, page_size, run, filters):
+        self.logf("Fetching page %s of %s where run=%s", page, kind, run)
+        results = self._listtodict(self.server.getpage(kind, page, page_size, run, **filters))
+        self._autosave('add' + kind, results)
+        return results
+
+    def _index(self, kind, index, run, page_size, **filters):
+        # Fetches everything in one request, or page by page when paging is on. Autosave is left to the caller,
+        # so pages aren't recorded twice.
+        page_size = page_size or self.page_size
+        if not page_size:
+            return index(run, **filters)
+        results = {}
+        # Closed on the way out, so that a failed page doesn't leave the prefetch thread behind.
+        with PageIterator(lambda page, size: self._listtodict(self.server.getpage(kind, page, size, run, **filters)), page_size, ids=dict.keys) as pages:
+            for page in pages:
+                results.update(page)
+        return results
+
+    def iterlaneresults(self, run, lane=None, barcode=None, readnumber=None, filter=None, records=False):
+        """
+        Function : Streaming variant of indexlaneresults for very large runs. Yields the lane results one at a time
+                   as the LIMS response is parsed, instead of building a dict of all of them.
+        Args     : filter - optional function of a lane result dict; only lane results it returns True for are yielded.
+                   records - yield SolexaLaneResult records instead of dicts.
+        Note     : The object cache is bypassed, since caching would hold the whole run in memory again.
+        """
+        self.logf("Iterating lane results where run=%s, lane=%s, barcode=%s", run, lane, barcode)
+        laneresults = self.server.iterlaneresults(run, lane=lane, barcode=barcode, readnumber=readnumber, filter=filter)
+        return self._iterresults(laneresults, 'addlaneresult', SolexaLaneResult if records else None)
 
-        if self.autosaveserver:
-            self.autosaveserver.addmapperresults(mapperresults=mapperresults)
-            self.autosaveserver.writemapperresultstodisk()
-            self.log("Added %s mapper results to testdata" % len(mapperresults))
+    def itermapperresults(self, run, filter=None, records=False):
+        """
+        Function : Streaming variant of indexmapperresults. See iterlaneresults.
+        """
+        self.logf("Iterating mapper results where run=%s", run)
+        mapperresults = self.server.itermapperresults(run, filter=filter)
+        return self._iterresults(mapperresults, 'addmapperresult', MapperResult if records else None)
 
-        self.log(mapperresults, pretty=True)
-        return mapperresults
+    def _iterresults(self, results, addmethod, recordclass):
+        for result in results:
+            yield self._iterresult(result, addmethod, recordclass)
 
+    @traced('run_id')
     def updatesolexarun(self, run_id, paramdict):
-        self.log("Updating Solexa Run id=%s with paramdict=%s" % (run_id, paramdict))
+        self.logf("Updating Solexa Run id=%s with paramdict=%s", run_id, paramdict)
         if self.autosaveserver:
             self._write_not_supported_error()
         
         run = self.server.updatesolexarun(run_id, paramdict)
+        self._invalidate(('solexarun', str(run_id)), ('solexaruns',), ('runinfo',))
         if not run:
             raise Exception("Failed to update Solexa Run id=%s paramdict=%s" % (run_id, paramdict))
 
         self.log(run, pretty=True)
         return run
 
+    @traced('id')
     def updatesolexaflowcell(self, id, paramdict):
-        self.log("Updating Solexa Flow Cell id=%s with paramdict=%s" % (id, paramdict))
+        self.logf("Updating Solexa Flow Cell id=%s with paramdict=%s", id, paramdict)
         if self.autosaveserver:
             self._write_not_supported_error()
     
         flowcell = self.server.updatesolexaflowcell(id, paramdict)
+        self._invalidate(('solexaflowcell', str(id)), ('runinfo',))
 
         if not flowcell:
             raise Exception("Failed to update Solexa Flow Cell id=%s paramdict=%s" % (id, paramdict))
@@ -391,12 +890,14 @@ class Connection:
         self.log(flowcell, pretty=True)
         return flowcell
 
+    @traced('id')
     def updatepipelinerun(self, id, paramdict):
-        self.log("Updating pipeline run id=%s with paramdict=%s" % (id, paramdict))
+        self.logf("Updating pipeline run id=%s with paramdict=%s", id, paramdict)
         if self.autosaveserver:
             self._write_not_supported_error()
 
         pipelinerun = self.server.updatepipelinerun(id, paramdict)
+        self._invalidate(('pipelinerun', str(id)), ('pipelineruns',), ('runinfo',))
 
         if not pipelinerun:
             raise Exception("Failed to update pipelinerun id=%s paramdict=%s" % (id, paramdict))
@@ -404,12 +905,14 @@ class Connection:
         self.log(pipelinerun, pretty=True)
         return pipelinerun
     
+    @traced('id')
     def updatelaneresult(self, id, paramdict):
-        self.log("Updating lane result id=%s with paramdict=%s" % (id, paramdict))
+        self.logf("Updating lane result id=%s with paramdict=%s", id, paramdict)
         if self.autosaveserver:
             self._write_not_supported_error()
 
         laneresult = self.server.updatelaneresult(id, paramdict)
+        self._invalidate(('laneresult', str(id)), ('laneresults',))
 
         if not laneresult:
             raise Exception("Failed to update laneresult id=%s paramdict=%s" % (id, paramdict))
@@ -417,12 +920,14 @@ class Connection:
         self.log(laneresult, pretty=True)
         return laneresult
 
+    @traced('id')
     def updatemapperresult(self, id, paramdict):
-        self.log("Updating mapper result id=%s with paramdict=%s" % (id, paramdict))
+        self.logf("Updating mapper result id=%s with paramdict=%s", id, paramdict)
         if self.autosaveserver:
             self._write_not_supported_error()
 
         mapperresult = self.server.updatemapperresult(id, paramdict)
+        self._invalidate(('mapperresult', str(id)), ('mapperresults',))
 
         if not mapperresult:
             raise Exception("Failed to update mapperresult id=%s paramdict=%s" % (id, paramdict))
@@ -430,79 +935,167 @@ class Connection:
         self.log(mapperresult, pretty=True)
         return mapperresult
 
-    def getallrunobjects(self, run):
-        runinfo = self.getruninfo(run)
-        run_data = self.indexsolexaruns(run).values()[0]
-        self.showsolexaflowcell(run_data['solexa_flow_cell_id'])
-        self.getsamplesheet(run, filename=None)
-        self.indexsolexaruns(run)
-        for lane in runinfo['run_info']['lanes'].keys():
-            self.getsamplesheet(run, filename=None, lane=lane)
-        self.indexpipelineruns(run)
-        self.indexlaneresults(run)
-        self.indexmapperresults(run)
+    @traced('run', 'bcl2fastq_version')
+    def getallrunobjects(self, run, bcl2fastq_version=1, max_workers=None):
+        """
+        Fetches every LIMS object that belongs to a run, e.g. to snapshot it into testdata with testdata_update_mode.
+        Each object is fetched once. Everything that only needs the run name is fetched concurrently, and the
+        flow cell is fetched as soon as the runinfo that identifies it arrives, so a snapshot takes about as long
+        as the slowest two requests in a row. The per-lane samplesheets are split out of the all-lanes one (see
+        getlanesamplesheets) rather than fetched. With render_samplesheets=True the samplesheets are built from
+        the runinfo instead, without any request.
+
+        Args     : run - The sequencing run name.
+                   bcl2fastq_version - int. Format of the samplesheets to fetch. Defaults to 1, the format of the
+                                       samplesheets stored in testdata.
+                   max_workers - int. Number of concurrent requests. Defaults to pool_maxsize.
+        Returns  : A RunBundle.
+        """
+        if max_workers is None:
+            max_workers = self.pool_maxsize
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            runinfo = submit(pool, self.getruninfo, run)
+            solexaruns = submit(pool, self.indexsolexaruns, run)
+            if not self.render_samplesheets:
+                samplesheet = submit(pool, self.getsamplesheet, run, bcl2fastq_version, filename=None)
+            pipelineruns = submit(pool, self.indexpipelineruns, run)
+            laneresults = submit(pool, self.indexlaneresults, run)
+            mapperresults = submit(pool, self.indexmapperresults, run)
+
+            # Second wave, which depends on runinfo.
+            run_info = runinfo.result()['run_info']
+            solexaflowcell = submit(pool, self.showsolexaflowcell, run_info['flow_cell_id'])
+            if self.render_samplesheets:
+                samplesheet = submit(pool, self.getsamplesheet, run, bcl2fastq_version, filename=None, runinfo=runinfo.result())
+
+            split = self._splitsamplesheet(run, samplesheet.result())
+            lanesamplesheets = {}
+            for lane in run_info['lanes'].keys():
+                if lane in split:
+                    lanesamplesheets[lane] = split[lane]
+                else:
+                    # A lane with no rows in the all-lanes samplesheet; ask the LIMS what it has for it.
+                    lanesamplesheets[lane] = submit(pool, self.getsamplesheet, run, bcl2fastq_version, lane=lane, filename=None, runinfo=runinfo.result())
+
+            return self._runbundle(run, runinfo.result(), solexaruns.result(), solexaflowcell.result(), samplesheet.result(),
+                                   dict((lane, value if isinstance(value, str) else value.result()) for lane, value in lanesamplesheets.items()),
+                                   pipelineruns.result(), laneresults.result(), mapperresults.result())
+
+    @traced()
+    def getruninfo_many(self, runs, max_workers=None):
+        """
+        Calls getruninfo for each of the given runs concurrently, using at most max_workers threads
+        (default pool_maxsize, so that every worker can hold a pooled connection).
 
+        Returns : BatchResults keyed by run name. Runs that failed are in its errors dict.
+        """
+        return self._runmany(self.getruninfo, runs, max_workers)
+
+    @traced()
+    def indexpipelineruns_many(self, runs, max_workers=None):
+        return self._runmany(self.indexpipelineruns, runs, max_workers)
+
+    @traced('lane', 'barcode', 'readnumber')
+    def indexlaneresults_many(self, runs, max_workers=None, lane=None, barcode=None, readnumber=None):
+        return self._runmany(self.indexlaneresults, runs, max_workers, lane=lane, barcode=barcode, readnumber=readnumber)
+
+    @traced()
+    def indexmapperresults_many(self, runs, max_workers=None):
+        return self._runmany(self.indexmapperresults, runs, max_workers)
+
+    def _runmany(self, method, runs, max_workers, **kwargs):
+        # Each worker goes through the single-run method, so owner override and autosave still apply per result.
+        # Duplicate runs are only fetched once.
+        return self._runbatch([(run, method, (run,), kwargs) for run in dict.fromkeys(runs)], max_workers)
+
+    def _runbatch(self, calls, max_workers, errors=None):
+        # calls is a list of (key, function, args) or (key, function, args, kwargs). errors are failures found
+        # before making any calls, reported along with those of the calls.
+        if max_workers is None:
+            max_workers = self.pool_maxsize
+        results = BatchResults()
+        results.errors.update(errors or {})
+        if not calls:
+            return results
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = []
+            for call in calls:
+                key, function, args = call[:3]
+                kwargs = call[3] if len(call) > 3 else {}
+                futures.append((key, submit(pool, function, *args, **kwargs)))
+            for key, future in futures:
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results.errors[key] = e
+        return results
+
+    @traced('library_name')
     def get_runinfo_by_library_name(self,library_name):
         runinfo = self.server.get_runinfo_by_library_name(library_name)
         return runinfo
 
+    @traced()
     def get_person_attributes_by_email(self,email):
         person_info = self.server.get_person_attributes_by_email(email=email)
         return person_info
 
+    @traced('personid')
     def update_person(self,personid,attributeDict={}):
         json_response = self.server.update_person(personid=personid,attributeDict=attributeDict)
+        self._invalidate(('runinfo',))
         return json_response
 
+    @traced('run_name')
     def runHasFinishedPipelineRun(self,run_name):
-        uhtsPipelineRuns = self.indexpipelineruns(run=run_name)
-        finishedUhtsRun = False
-        for uhtsRun in uhtsPipelineRuns:
-            if uhtsPipelineRuns[uhtsRun]['finished']:
-                finishedUhtsRun = True
-                break
-        if finishedUhtsRun:
-            return True
-        else:
-            return False
-
-    def _write_not_supported_error(self):
-        raise Exception('Write operations are not supported in test_data_update mode. '+
-                        'If you want to create objects in the local cache, run in local_only '+
-                        'mode and call write_to_disk')
-
-    def _delete_not_supported_error(self):
-        raise Exception('Delete operations are not supported in test_data_update mode. '+
-                        'If you want to destroy objects in the local cache, run in local_only '+
-                        'mode and call write_to_disk')
-
+        return self._hasfinishedpipelinerun(self.indexpipelineruns(run=run_name))
+
+    def cachestats(self):
+        # Hit/miss counters of the read cache, or None if the cache isn't enabled.
+        if self.cache is None:
+            return None
+        return self.cache.stats()
+
+    def clearcache(self):
+        if self.cache is not None:
+            self.cache.clear()
+
+    def _cached(self, kind, key, fetch, *args, **kwargs):
+        # Read-through: serve from the cache when enabled and fresh, otherwise fetch and remember the result.
+        # Empty results aren't cached, since they normally mean the object doesn't exist yet.
+        if self.cache is None:
+            return fetch(*args, **kwargs)
+        found, value = self.cache.get(kind, key)
+        if found:
+            return value
+        value = fetch(*args, **kwargs)
+        if value:
+            self.cache.set(kind, key, value)
+        return value
+
+    def _invalidate(self, *entries):
+        # Each entry is a (kind, key prefix...) tuple, as accepted by ObjectCache.invalidate.
+        if self.cache is None:
+            return
+        for entry in entries:
+            self.cache.invalidate(*entry)
+
+    @traced()
     def testconnection(self):
         # Raises exception if no 200 response
         self.server.testconnection()
         return True
 
-    def _processruninfo(self, runinfo):
+    def close(self):
+        # Writes any pending testdata, then releases the pooled connections to the LIMS and the local database.
+        self.flush()
+        self.server.close()
+        if self.autosaveserver is not None:
+            self.autosaveserver.close()
+        self._closetracesink()
 
-        # Replace emails if override_owner is set
-        if self.override_owner:
-            lanes = runinfo['run_info']['lanes']
-            for lane in lanes.values():
-                for notify in lane.get('notify'):
-                    notify['email'] = self.override_owner
-                    lane['submitter_email'] = self.override_owner
-        return runinfo
-
-    def _clean_override_owner(self, email):
+    def __enter__(self):
+        return self
 
-        if re.match(r'^\S+@\S+\.\S+$', email):
-            return email
-        else:
-            raise Exception('override_owner setting "%s" is not a valid email address.' % email)
-
-    def log(self, message, pretty=False):
-
-        if self.verbose:
-            if pretty:
-                self.pprint(message)
-            else:
-                print(message)
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from scgpm_lims.components.atomicfile import atomicopen
+
+# Used by the scripts when they are run with --cache-dir and no directory; they don't cache otherwise.
+DEFAULT_HTTP_CACHE_DIR = os.path.join('~', '.cache', 'scgpm_lims')
+
+class DiskResponseCache:
+
+    # Persistent cache of GET responses from the LIMS, shared by every process that points at the same directory.
+    # Used by HttpTransport when a Connection is created with http_cache_dir.
+    #
+    # Entries are keyed by the url and the query parameters, except the token, which is never part of the key
+    # nor stored in the cache. An entry is fresh for the max-age the LIMS sends in Cache-Control, or, if the
+    # LIMS sends no max-age and no ETag/Last-Modified validator, for max_age seconds. Stale entries with a
+    # validator are revalidated with If-None-Match/If-Modified-Since, so an unchanged object costs one 304.
+    #
+    # max_bytes bounds the total size of the cache directory. The least recently used entries are removed first.
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, max_age=600):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def key(self, method, url, params):
+        params = params or {}
+        items = sorted((str(k), str(v)) for k, v in params.items() if k != 'token')
+        return hashlib.sha256(json.dumps([method.upper(), url, items]).encode()).hexdigest()
+
+    def load(self, key):
+        """
+        Returns : The cached entry as a (metadata dict, body bytes) tuple, or None if there isn't one.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fp:
+                meta = json.loads(fp.readline().decode())
+                body = fp.read()
+        except (IOError, OSError, ValueError):
+            return None
+        return meta, body
+
+    def isfresh(self, meta):
+        return meta.get('expires') is not None and meta['expires'] > time.time()
+
+    def validators(self, meta):
+        # Headers for a conditional request, empty if the LIMS gave no ETag or Last-Modified for this entry.
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def store(self, key, response):
+        """
+        Stores a 200 response unless the LIMS marked it no-store. Returns the stored metadata, or None.
+        """
+        cachecontrol = response.headers.get('Cache-Control', '').lower()
+        if 'no-store' in cachecontrol or response.status_code != 200:
+            return None
+        meta = {
+            'url': response.url.split('?')[0],
+            'status': response.status_code,
+            'encoding': response.encoding,
+            'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            }
+        meta['expires'] = self._expires(cachecontrol, meta)
+        self._write(key, meta, response.content)
+        return meta
+
+    def refresh(self, key, meta, response):
+        # Called on a 304. The body is unchanged, but the LIMS may have sent new validators or a new max-age.
+        cachecontrol = response.headers.get('Cache-Control', '').lower()
+        meta['etag'] = response.headers.get('ETag', meta.get('etag'))
+        meta['last_modified'] = response.headers.get('Last-Modified', meta.get('last_modified'))
+        meta['expires'] = self._expires(cachecontrol, meta)
+        cached = self.load(key)
+        if cached is not None:
+            self._write(key, meta, cached[1])
+
+    def toresponse(self, meta, body, request=None):
+        # Rebuilds a requests.Response from a cache entry, so RemoteDataManager can't tell the difference.
+        response = requests.Response()
+        response.status_code = meta['status']
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        response.encoding = meta.get('encoding')
+        response.url = meta['url']
+        response.request = request
+        response._content = body
+        response.from_cache = True
+        return response
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith('.entry'):
+                    os.remove(os.path.join(self.directory, name))
+            self._size = 0
+
+    def _expires(self, cachecontrol, meta):
+        if 'no-cache' in cachecontrol:
+            return None
+        match = re.search(r'max-age=(\d+)', cachecontrol)
+        if match:
+            return time.time() + int(match.group(1))
+        if meta.get('etag') or meta.get('last_modified'):
+            # Always revalidate; a 304 is cheap and can't be stale.
+            return None
+        return time.time() + self.max_age
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.entry')
+
+    def _write(self, key, meta, body):
+        # Written atomically, so other processes never read a half-written entry, and a failed write leaves no
+        # temp file behind. Entries stay readable only by their owner, as the responses may be private.
+        path = self._path(key)
+        oldsize = os.path.getsize(path) if os.path.exists(path) else 0
+        with atomicopen(path, binary=True, mode=0o600) as fp:
+            fp.write(json.dumps(meta).encode() + b'\n')
+            fp.write(body)
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path) - oldsize
+            self._evict()
+
+    def _evict(self):
+        if self._size is None:
+            self._size = sum(os.path.getsize(os.path.join(self.directory, name))
+                             for name in os.listdir(self.directory) if name.endswith('.entry'))
+        if self._size <= self.max_bytes:
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.entry'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        for mtime, size, name in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            self._size -= size
@@ -0,0 +1,97 @@
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+class JsonArrayParser:
+
+    # Incremental parser for a JSON array whose elements are wanted one at a time, e.g. the list of lane results
+    # in a LIMS response. Feed it the body in pieces as they arrive; each call returns the elements completed so
+    # far. Only the element currently being received is buffered, so neither the whole body nor the whole
+    # decoded list is ever held in memory.
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        # What the next token may be: 'start' (the opening bracket), 'first' (an element or the closing bracket),
+        # 'value' (an element, after a comma), 'next' (a comma or the closing bracket) or 'end'.
+        self.expect = 'start'
+
+    def feed(self, chunk):
+        """
+        Args : chunk - the next bytes (or str) piece of the document.
+        Returns : list of the elements completed by this piece.
+        """
+        if isinstance(chunk, bytes):
+            chunk = self.utf8.decode(chunk)
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return self._parse(eof=False)
+
+    def close(self):
+        """
+        Returns : list of any elements left at the end of the document.
+        Raises : ValueError if the document ended before the array was closed.
+        """
+        self.buffer = self.buffer[self.position:] + self.utf8.decode(b'', final=True)
+        self.position = 0
+        elements = self._parse(eof=True)
+        if self.expect != 'end':
+            raise ValueError('Unexpected end of JSON array')
+        return elements
+
+    def _parse(self, eof):
+        elements = []
+        buffer = self.buffer
+        while self.expect != 'end':
+            position = self.position
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            self.position = position
+            if position == len(buffer):
+                break
+            char = buffer[position]
+            if self.expect == 'start':
+                if char != '[':
+                    raise ValueError('Expected a JSON array, found %r' % buffer[position:position + 20])
+                self.expect = 'first'
+                self.position += 1
+            elif self.expect in ('first', 'next') and char == ']':
+                self.expect = 'end'
+                self.position += 1
+            elif self.expect == 'next':
+                if char != ',':
+                    raise ValueError('Expected "," or "]" in JSON array, found %r' % buffer[position:position + 20])
+                self.expect = 'value'
+                self.position += 1
+            else:
+                try:
+                    element, end = self.decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if eof:
+                        raise
+                    break
+                # A number at the end of the buffer may be cut short, so an element only counts once something
+                # follows it.
+                if end == len(buffer) and not eof:
+                    break
+                elements.append(element)
+                self.expect = 'next'
+                self.position = end
+        return elements
+
+
+def iterjsonarray(chunks):
+    """
+    Parses a JSON array incrementally and yields its elements one at a time.
+
+    Args : chunks - iterable of bytes (or str) pieces of the document, e.g. response.iter_content(chunk_size).
+    Raises : ValueError if the document is not a JSON array.
+    """
+    parser = JsonArrayParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
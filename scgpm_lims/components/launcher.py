@@ -0,0 +1,200 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import subprocess
+import threading
+import time
+
+# MiSeq instruments, whose runs only have one lane.
+MISEQS = ('SPENSER', 'HOLMES', 'M04199')
+
+
+class AnalysisLauncher:
+
+    # Starts the analysis pipeline (run_analysis.rb) for each run the LIMS says is ready to analyze, as
+    # scripts/start_analyses.py does. tick() makes one pass; serve() makes one every poll_interval seconds
+    # until stop() is called, and in between reaps finished pipeline processes and starts queued ones.
+    #
+    # conn is a Connection. iscopycomplete(run) says whether the run has been copied off the instrument; runs
+    # that aren't are left for a later pass. The copy checks and LIMS reads for a pass run on check_workers
+    # threads at once.
+    #
+    # max_running caps the number of pipeline processes running at once (None for no cap). Runs beyond it wait
+    # in a queue, oldest first, and a run that is queued or running isn't considered again until its process
+    # exits.
+    #
+    # When a run has no pipeline run yet, one is created and the run waits, outside the queue, until the new
+    # pipeline run is visible in its runinfo, since run_analysis.rb reads it from there. check() rereads the
+    # runinfo of waiting runs, each with exponential backoff from backoff seconds up to max_backoff, and queues
+    # them once it's there, or after pipelinerun_timeout seconds regardless. Nothing waits on this, so runs that
+    # are ready and finished processes are handled meanwhile.
+    #
+    # log is an open text file that the commands, exit statuses and errors are written to, along with the
+    # output of the pipeline processes. popen starts a process, as subprocess.Popen.
+
+    def __init__(self, conn, iscopycomplete, log, max_running=4, check_workers=8, backoff=0.25, max_backoff=5, pipelinerun_timeout=60,
+                 popen=subprocess.Popen):
+        self.conn = conn
+        self.iscopycomplete = iscopycomplete
+        self.log = log
+        self.max_running = max_running
+        self.check_workers = check_workers
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pipelinerun_timeout = pipelinerun_timeout
+        self.popen = popen
+        self.queue = collections.deque()
+        self.children = {}
+        self.waiting = {}
+        self._loglock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def command(self, run, pipelinerunid=None):
+        cmd = "run_analysis.rb start_illumina_run --run {run} --force --verbose".format(run=run)
+        if pipelinerunid:
+            cmd += " --rerun --pipeline-run-id {}".format(pipelinerunid)
+        if any(run.find(instrument) >= 0 for instrument in MISEQS):
+            cmd += " --lanes 1"
+        return cmd
+
+    def tick(self):
+        """
+        Function : Finds the runs ready to analyze, creates a pipeline run for each one that needs it, and queues
+                   and starts their pipeline processes, up to max_running. Runs whose new pipeline run isn't in
+                   their runinfo yet are left waiting for check().
+        Returns  : list of the runs queued by this pass.
+        """
+        self.reap()
+        busy = set(self.children) | set(run for run, cmd in self.queue) | set(self.waiting)
+        runs = [run for run in self.conn.getrunstoanalyze() if run not in busy]
+        queued = []
+        if runs:
+            with ThreadPoolExecutor(max_workers=self.check_workers) as pool:
+                ready = [run for run, complete in zip(runs, pool.map(self._iscopycomplete, runs)) if complete]
+                runinfos = self.conn.getruninfo_many(ready, max_workers=self.check_workers)
+                for run, error in runinfos.errors.items():
+                    self.write("Could not get run info for {run}: {error}".format(run=run, error=error))
+                prepared = list(pool.map(self._prepare, runinfos.keys(), runinfos.values()))
+            now = time.monotonic()
+            for run, (cmd, pipelinerunid) in zip(runinfos.keys(), prepared):
+                if pipelinerunid is not None:
+                    self.waiting[run] = {'id': pipelinerunid, 'cmd': cmd, 'deadline': now + self.pipelinerun_timeout,
+                                         'delay': self.backoff, 'nextcheck': now + self.backoff}
+                elif cmd is not None:
+                    self.queue.append((run, cmd))
+                    queued.append(run)
+        queued.extend(self.check())
+        self.launch()
+        return queued
+
+    def check(self):
+        """
+        Function : Rereads the runinfo of the runs waiting for their new pipeline run whose backoff has passed, and
+                   queues those where it has appeared or that have waited pipelinerun_timeout seconds.
+        Returns  : list of the runs queued.
+        """
+        now = time.monotonic()
+        due = [run for run, waiting in self.waiting.items() if waiting['nextcheck'] <= now]
+        if not due:
+            return []
+        runinfos = self.conn.getruninfo_many(due, max_workers=self.check_workers)
+        queued = []
+        for run in due:
+            waiting = self.waiting[run]
+            if run in runinfos and waiting['id'] in runinfos[run]['run_info']['pipeline_runs']:
+                pass
+            elif now >= waiting['deadline']:
+                self.write("Pipeline run {id} of {run} isn't in its run info after {timeout}s; starting anyway".format(
+                    id=waiting['id'], run=run, timeout=self.pipelinerun_timeout))
+            else:
+                if run in runinfos.errors:
+                    self.write("Could not get run info for {run}: {error}".format(run=run, error=runinfos.errors[run]))
+                waiting['delay'] = min(waiting['delay'] * 2, self.max_backoff)
+                waiting['nextcheck'] = now + waiting['delay']
+                continue
+            del self.waiting[run]
+            self.queue.append((run, waiting['cmd']))
+            queued.append(run)
+        return queued
+
+    def drain(self):
+        # For a single pass, e.g. from cron: checks on the waiting runs, with their backoff, until each one is
+        # queued, then starts the queued runs.
+        while self.waiting and not self._stopping.is_set():
+            self._stopping.wait(max(0, min(waiting['nextcheck'] for waiting in self.waiting.values()) - time.monotonic()))
+            self.check()
+        self.launch()
+
+    def launch(self):
+        # Starts queued runs while there's room under max_running.
+        while self.queue and (self.max_running is None or len(self.children) < self.max_running):
+            run, cmd = self.queue.popleft()
+            self.write(cmd)
+            try:
+                self.children[run] = self.popen(cmd, shell=True, stdout=self.log, stderr=self.log)
+            except OSError as e:
+                self.write("Could not start the analysis of {run}: {error}".format(run=run, error=e))
+
+    def reap(self):
+        # Collects the exit status of finished pipeline processes, so they don't linger as zombies.
+        for run, child in list(self.children.items()):
+            status = child.poll()
+            if status is not None:
+                del self.children[run]
+                self.write("Analysis process for {run} exited with status {status}".format(run=run, status=status))
+
+    def serve(self, poll_interval=30, reap_interval=1):
+        """
+        Function : Polls the LIMS every poll_interval seconds until stop() is called. Every reap_interval seconds in
+                   between, it reaps finished processes, checks on runs waiting for their pipeline run, and starts
+                   queued runs. A failed poll is logged and retried at the next interval. Pipeline processes still
+                   running when it returns are left running.
+        """
+        nextpoll = time.monotonic()
+        while not self._stopping.is_set():
+            if time.monotonic() >= nextpoll:
+                nextpoll = time.monotonic() + poll_interval
+                try:
+                    self.tick()
+                except Exception as e:
+                    self.write("Polling the LIMS failed: {error!r}".format(error=e))
+            else:
+                self.reap()
+                try:
+                    self.check()
+                except Exception as e:
+                    self.write("Checking for new pipeline runs failed: {error!r}".format(error=e))
+                self.launch()
+            self._stopping.wait(max(0, min(reap_interval, nextpoll - time.monotonic())))
+        self.reap()
+
+    def stop(self):
+        self._stopping.set()
+
+    def write(self, message):
+        with self._loglock:
+            self.log.write(str(datetime.now()) + "  " + message + "\n")
+            self.log.flush()
+
+    def _iscopycomplete(self, run):
+        try:
+            return self.iscopycomplete(run)
+        except Exception as e:
+            self.write("Could not check whether {run} is copied: {error}".format(run=run, error=e))
+            return False
+
+    def _prepare(self, run, runinfo):
+        # Returns (command that starts the analysis of run, id of the pipeline run created for it or None). The
+        # command is None if the analysis is already started or can't be.
+        try:
+            pipeline_runs = runinfo['run_info']['pipeline_runs']
+            if pipeline_runs:
+                most_recent_run_id = max(pipeline_runs, key=int)
+                if pipeline_runs[most_recent_run_id]['started']:
+                    return None, None
+                return self.command(run, most_recent_run_id), None
+            pipelinerun = self.conn.createpipelinerun(run=run)
+            return self.command(run), str(pipelinerun['id'])
+        except Exception as e:
+            self.write("Could not prepare the analysis of {run}: {error}".format(run=run, error=e))
+            return None, None
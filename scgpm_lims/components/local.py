@@ -1,11 +1,176 @@
+import copy
 from datetime import datetime
 import json
 import os
 import random
+import threading
 from warnings import warn
 
+from scgpm_lims.components.atomicfile import atomicwrite
+import scgpm_lims.components.snapshot as snapshot
 
-class LocalDataManager:
+# Parsed testdata files shared by all LocalDataManager instances in the process, keyed by full path and valued by
+# ((mtime, size), records, index). A file is only parsed again when its mtime or size changes.
+_sharedcollections = {}
+_sharedlock = threading.Lock()
+
+
+class _LazyCollection:
+
+    # A LocalDataManager collection, or secondary index, that is loaded by the named method on first access.
+    # The loader sets the attribute on the instance, which then shadows this descriptor, so later accesses
+    # are ordinary attribute lookups.
+
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        getattr(instance, self.loader)()
+        return instance.__dict__[self.name]
+
+
+class BaseLocalDataManager:
+
+    # The parts of the local data managers that don't depend on how the records are stored: paging, the iter*
+    # methods, create*, the batch add* methods and id lookups. They go through the show*, index*, add*,
+    # getruninfo and getlaneid methods that each storage engine (LocalDataManager, SqliteDataManager) defines.
+
+    localorremote = 'local'
+
+    def __init__(self):
+        self._paged = None
+
+    def getpage(self, kind, page, page_size, run, **filters):
+        # Emulates the paging of the LIMS index endpoints (see RemoteDataManager.getpage) over the local data, so
+        # paged reads behave the same offline. Pages follow the order of the corresponding index method.
+        # The index is only run for page 1 (or another query) and kept for the following pages, so that paging
+        # through a collection costs one index rather than one per page.
+        key = (kind, run, tuple(sorted(filters.items())))
+        paged = self._paged
+        if page == 1 or paged is None or paged[0] != key:
+            index = {
+                'solexaruns': self.indexsolexaruns,
+                'pipelineruns': self.indexpipelineruns,
+                'laneresults': self.indexlaneresults,
+                'mapperresults': self.indexmapperresults,
+                }[kind]
+            paged = self._paged = (key, list(index(run, **filters).values()))
+        return paged[1][(page - 1) * page_size:page * page_size]
+
+    def iterlaneresults(self, run, lane=None, barcode=None, readnumber=None, filter=None):
+        # Same interface as RemoteDataManager.iterlaneresults. The local data is in memory already, so this just
+        # walks the indexed results.
+        return self._iterfiltered(self.indexlaneresults(run, lane=lane, barcode=barcode, readnumber=readnumber), filter)
+
+    def itermapperresults(self, run=None, filter=None):
+        return self._iterfiltered(self.indexmapperresults(run), filter)
+
+    def _iterfiltered(self, records, filter):
+        for record in records.values():
+            if filter is None or filter(record):
+                yield record
+
+    def createpipelinerun(self, run, paramdict=None):
+        run_id = self.getruninfo(run).get('id')
+        id =self._getrandomid()
+        pipelinerun = {
+            'id': id,
+            'solexa_run_id': run_id,
+            'started': True,
+            'active': True,
+            'finished': None,
+            'start_time':str(datetime.now()),
+            'created_at':str(datetime.now()),
+            'pass_read_count': None,
+            }
+
+        if paramdict:
+            pipelinerun.update(paramdict)
+        
+        self.addpipelinerun(id, pipelinerun)
+        return pipelinerun
+
+    def createlaneresult(self, paramdict, run=None, lane=None):
+        lane_id = self.getlaneid(run, lane)
+        id =self._getrandomid()
+        laneresult = {'id': id,
+                      'solexa_lane_id': lane_id,
+                      'solexa_pipeline_run_id': None,
+                      'created_at': str(datetime.now()),
+                      'active': True,
+                      'codepoint': None,
+                      }
+        laneresult.update(paramdict)
+        self.addlaneresult(id, laneresult)
+        return laneresult
+
+    def createmapperresult(self, paramdict):
+        id =self._getrandomid()
+        mapperresult = { 'id': id,
+                         'created_at': str(datetime.now()),
+                         'active': True
+                         }
+        mapperresult.update(paramdict)
+        self.addmapperresult(id, mapperresult)
+        return mapperresult
+
+    def _getrandomid(self):
+        # High enough min to exclude valid ids in LIMS
+        # Large enough range to make repetition vanishingly improbable
+        return random.randint(10**12, 2 * 10**12)
+
+    def addsolexaruns(self, solexaruns):
+        for id, solexarun in solexaruns.items():
+            self.addsolexarun(id, solexarun)
+
+    def addsolexaflowcells(self, solexaflowcells):
+        for id, solexaflowcell in solexaflowcells.items():
+            self.addsolexaflowcell(id, solexaflowcell)
+
+    def addpipelineruns(self, pipelineruns):
+        for id, pipelinerun in pipelineruns.items():
+            self.addpipelinerun(id, pipelinerun)
+
+    def addlaneresults(self, laneresults):
+        for id, laneresult in laneresults.items():
+            self.addlaneresult(id, laneresult)
+
+    def addmapperresults(self, mapperresults):
+        for id, mapperresult in mapperresults.items():
+            self.addmapperresult(id, mapperresult)
+
+    def getrunid(self, run):
+        try:
+            return str(self.getruninfo(run).get('id'))
+        except:
+            return None
+
+    def _getlaneids(self, run_name):
+        runinfo = self.getruninfo(run_name)
+        try:
+            lanes = runinfo.get('run_info').get('lanes')
+        except:
+            return None
+        laneids = []
+        for lane in lanes.values(): #each value is a dict from the lane
+            laneids.append(str(lane.get('id')))
+        return laneids
+
+    def testconnection(self):
+        # No-op. This mirrors the same method in remote to test a valid http connection.
+        pass
+
+    def close(self):
+        # No-op. This mirrors the same method in remote that releases pooled http connections.
+        pass
+
+
+class LocalDataManager(BaseLocalDataManager):
 
     _runinfofile = 'runinfo.json'
     _samplesheetsfile = 'samplesheets.json'
@@ -17,40 +182,69 @@ class LocalDataManager:
 
     _testdatadir = '../testdata'
 
-    def __init__(self):
-
-        self._runinfo = {}
-        self._samplesheets = {}
-        self._solexaruns = {}
-        self._solexaflowcells = {}
-        self._pipelineruns = {}
-        self._laneresults = {}
-        self._mapperresults = {}
-
-        self._loadall()
+    # Each collection is loaded from its file the first time it's used, so a test that only needs runinfo
+    # never parses laneresults.json. Parsed files are shared between instances (see _loadcollection).
+    _runinfo = _LazyCollection('_loadruninfo')
+    _samplesheets = _LazyCollection('_loadsamplesheets')
+    _solexaruns = _LazyCollection('_loadsolexaruns')
+    _solexaflowcells = _LazyCollection('_loadsolexaflowcells')
+    _pipelineruns = _LazyCollection('_loadpipelineruns')
+    _laneresults = _LazyCollection('_loadlaneresults')
+    _mapperresults = _LazyCollection('_loadmapperresults')
+
+    # Secondary indexes, so that index* queries cost time proportional to the size of the result rather than
+    # the size of the collection. Each maps the str of a foreign key to a dict of the matching records keyed
+    # by record id. They are built when a collection is loaded and kept current by the add* methods, which
+    # all create* and update* methods go through.
+    _pipelinerunsbyrun = _LazyCollection('_loadpipelineruns')          # solexa_run_id -> pipeline runs
+    _laneresultsbylane = _LazyCollection('_loadlaneresults')           # solexa_lane_id -> lane results
+    _mapperresultsbydataset = _LazyCollection('_loadmapperresults')    # dataset_id (a lane result id) -> mapper results
+
+    def __init__(self, flush_every=None, snapshotfile=None):
+        # With snapshotfile, the collections are read from that snapshot file (see writesnapshot) instead of the
+        # JSON files, and flushed changes are written back to it. Records are only parsed when they are read.
+        #
+        # Changes are kept in memory until they are written to disk. Each collection that has changed since it
+        # was last written is marked dirty, and flush() writes the dirty ones. Adding an object that is already
+        # stored unchanged doesn't mark anything, so re-reading the same objects in testdata_update_mode costs
+        # no writes. With flush_every=N, flush() is also called after every N changed objects.
+        BaseLocalDataManager.__init__(self)
+        self.flush_every = flush_every
+        self.snapshotfile = snapshotfile
+        self._dirty = set()
+        self._changes = 0
+
+    def get_runname_from_flowcell_id(self, flowcell_id):
+        for run, runinfo in self._runinfo.items():
+            if runinfo.get('run_info', {}).get('flow_cell') == flowcell_id:
+                return run
+        return None
+
+    # The read methods return copies, like the LIMS returns fresh objects, because the stored records are shared
+    # with other instances and callers such as Connection._processruninfo modify what they get back.
 
     def getruninfo(self, run=None):
-        return self._runinfo.get(run)
+        return copy.deepcopy(self._runinfo.get(run))
 
-    def getsamplesheet(self, run=None, lane=None):
+    def getsamplesheet(self, run=None, lane=None, bcl2fastq_version=None):
+        # Only one samplesheet format is stored per run, so bcl2fastq_version is accepted for compatibility with
+        # the remote API but ignored.
         run = self._samplesheets.get(run)
-        if lane:
-            lane = str(lane)
-            return run.get(lane)
-        else:
-            return run
+        if run is None:
+            return None
+        return run.get(self._samplesheetkey(lane))
 
     def showsolexarun(self, id=None):
-        return self._solexaruns.get(id)
+        return self._copy(self._solexaruns.get(str(id)))
 
     def showsolexaflowcell(self, id=None):
-        return self._solexaflowcells.get(id)
+        return self._copy(self._solexaflowcells.get(str(id)))
 
     def showpipelinerun(self, id=None):
         """
         Args : id - Pipeline Run ID
         """
-        return self._pipelineruns.get(id)
+        return self._copy(self._pipelineruns.get(str(id)))
 
     def showlaneresult(self, id=None):
         """
@@ -58,10 +252,10 @@ class LocalDataManager:
                      Then on the resulting page, find the Analysis Results table. In the Details columns, those 'View' links take you to a page that refers to a lane result.
                      The lane result ID number is present at the end of the URL in the browser.
         """ 
-        return self._laneresults.get(id)
+        return self._copy(self._laneresults.get(str(id)))
 
     def showmapperresult(self, id=None):
-        return self._mapperresults.get(id)
+        return self._copy(self._mapperresults.get(str(id)))
 
     def indexsolexaruns(self, run=None):
         run_id =self.getrunid(run)
@@ -69,7 +263,7 @@ class LocalDataManager:
         if solexa_run is None:
             return {}
         else:
-            return solexa_run
+            return {run_id: dict(solexa_run)}
         
     def indexpipelineruns(self, run=None):
         """
@@ -77,176 +271,155 @@ class LocalDataManager:
         and valued by a dict being with the metadata on the pipeline run.
         """
         run_id =self.getrunid(run)
-        found_pipelineruns = {}
-        for id, pipelinerun in self._pipelineruns.iteritems():
-            if str(pipelinerun.get('solexa_run_id')) == str(run_id):
-                found_pipelineruns[str(pipelinerun.get('id'))] = pipelinerun
-        return found_pipelineruns
+        return self._copyall(self._pipelinerunsbyrun.get(str(run_id), {}))
 
     def indexlaneresults(self, run, lane=None, barcode=None, readnumber=None):
         """
-        Function : Finds all lane results for a given run name. Doesn't yet support filtering for a particular
-                   lane, barcode, and readnumber. Puts retrieved lane results into a dict keyed by the lane result ID
-                   and valued by a dict being the lane results for the particular barcode and readnumber retrieved.
+        Function : Finds all lane results for a given run name. Like the LIMS, it can be narrowed to a lane, then to a
+                   barcode within the lane, then to a read number for the barcode. Puts retrieved lane results into a
+                   dict keyed by the lane result ID and valued by a dict being the lane results for the particular
+                   barcode and readnumber retrieved.
         """
-        laneids = self._getlaneids(run)
+        if lane is None:
+            laneids = self._getlaneids(run) or []
+        else:
+            laneids = [str(self.getlaneid(run, lane))]
+            if barcode is None:
+                readnumber = None
         found_laneresults = {}
-        for id, laneresult in self._laneresults.iteritems():
-            if str(laneresult.get('solexa_lane_id')) in laneids:
-                found_laneresults[str(laneresult.get('id'))] = laneresult
-                #TODO add other filters for lane, barcode, readnumber
-        return found_laneresults
+        for laneid in laneids:
+            for id, laneresult in self._laneresultsbylane.get(laneid, {}).items():
+                if barcode is not None and laneresult.get('codepoint') != barcode:
+                    continue
+                if readnumber is not None and str(laneresult.get('read_number')) != str(readnumber):
+                    continue
+                found_laneresults[id] = laneresult
+        return self._copyall(found_laneresults)
 
     def indexmapperresults(self, run=None):
-        laneresultids = self._getlaneresultids(run)
         found_mapperresults = {}
-        for id, mapperresult in self._mapperresults.iteritems():
-            if str(mapperresult.get('dataset_id')) in laneresultids:
-                found_mapperresults[id] = mapperresult
-        return found_mapperresults
-
-    def createpipelinerun(self, run_id, lane, paramdict=None):
-        id =self._getrandomid()
-        pipelinerun = {
-            'id': id,
-            'solexa_run_id': run_id,
-            'started': True,
-            'active': True,
-            'finished': None,
-            'start_time':str(datetime.now()),
-            'created_at':str(datetime.now()),
-            'pass_read_count': None,
-            }
-
-        if paramdict:
-            pipelinerun.update(paramdict)
-        
-        self.addpipelinerun(id, pipelinerun)
-        return pipelinerun
-
-    def createlaneresult(self, lane_id, paramdict):
-        id =self._getrandomid()
-        laneresult = {'id': id,
-                      'solexa_lane_id': lane_id,
-                      'solexa_pipeline_run_id': None,
-                      'created_at': str(datetime.now()),
-                      'active': True,
-                      'codepoint': None,
-                      }
-        laneresult.update(paramdict)
-        self.addlaneresult(id, laneresult)
-        return laneresult
-
-    def createmapperresult(self, paramdict):
-        id =self._getrandomid()
-        mapperresult = { 'id': id,
-                         'created_at': str(datetime.now()),
-                         'active': True
-                         }
-        mapperresult.update(paramdict)
-        self.addmapperresult(id, mapperresult)
-        return mapperresult
+        for laneresultid in self.indexlaneresults(run):
+            found_mapperresults.update(self._mapperresultsbydataset.get(laneresultid, {}))
+        return self._copyall(found_mapperresults)
 
     def updatesolexarun(self, id, paramdict):
         id=str(id)
-        try:
-            self._solexaruns.get(id).update(paramdict)
-        except:
+        # Updated records are replaced rather than modified in place, so add* can re-index them.
+        old = self._solexaruns.get(id)
+        if old is None:
             return None
-        return self.showsolexarun(id)
+        solexarun = dict(old)
+        solexarun.update(paramdict)
+        self.addsolexarun(id, solexarun)
+        return solexarun
 
     def updatesolexaflowcell(self, id, paramdict):
         id=str(id)
-        try:
-            self._solexaflowcells.get(id).update(paramdict)
-        except:
+        # Updated records are replaced rather than modified in place, so add* can re-index them.
+        old = self._solexaflowcells.get(id)
+        if old is None:
             return None
-        return self.showsolexaflowcell(id)
+        solexaflowcell = dict(old)
+        solexaflowcell.update(paramdict)
+        self.addsolexaflowcell(id, solexaflowcell)
+        return solexaflowcell
 
     def updatepipelinerun(self, id, paramdict):
         id =str(id)
-        try:
-            self._pipelineruns.get(id).update(paramdict)
-        except:
+        # Updated records are replaced rather than modified in place, so add* can re-index them.
+        old = self._pipelineruns.get(id)
+        if old is None:
             return None
-        return self.showpipelinerun(id)
+        pipelinerun = dict(old)
+        pipelinerun.update(paramdict)
+        self.addpipelinerun(id, pipelinerun)
+        return pipelinerun
 
     def updatelaneresult(self, id, paramdict):
         id =str(id)
-        try:
-            self._laneresults.get(id).update(paramdict)
-        except:
+        # Updated records are replaced rather than modified in place, so add* can re-index them.
+        old = self._laneresults.get(id)
+        if old is None:
             return None
-        return self.showlaneresult(id)
+        laneresult = dict(old)
+        laneresult.update(paramdict)
+        self.addlaneresult(id, laneresult)
+        return laneresult
 
     def updatemapperresult(self, id, paramdict):
         id =str(id)
-        try:
-            self._mapperresults.get(id).update(paramdict)
-        except:
+        # Updated records are replaced rather than modified in place, so add* can re-index them.
+        old = self._mapperresults.get(id)
+        if old is None:
             return None
-        return self.showmapperresult(id)
+        mapperresult = dict(old)
+        mapperresult.update(paramdict)
+        self.addmapperresult(id, mapperresult)
+        return mapperresult
 
-    def _getrandomid(self):
-        # High enough min to exclude valid ids in LIMS
-        # Large enough range to make repetition vanishingly improbable
-        return random.randint(1e12,2e12)
+    def _copy(self, record):
+        # Records other than runinfo are flat, so a shallow copy is a full copy.
+        if record is None:
+            return None
+        return dict(record)
+
+    def _copyall(self, records):
+        return dict((id, dict(record)) for id, record in records.items())
 
     def deletelaneresults(self, run, lane):
-        # TODO
-        raise Exception("Todo. This method hasn't been implemented for local connection yet.")
+        # Like the LIMS, this also deletes the mapper results of the lane results.
+        for id in list(self.indexlaneresults(run, lane=lane)):
+            for mapperresultid in list(self._mapperresultsbydataset.get(id, {})):
+                self._removefromindex(self._mapperresultsbydataset, 'dataset_id', mapperresultid, self._mapperresults.pop(mapperresultid))
+                self._changed(self._mapperresultsfile)
+            self._removefromindex(self._laneresultsbylane, 'solexa_lane_id', id, self._laneresults.pop(id))
+            self._changed(self._laneresultsfile)
 
     def addruninfo(self, run, runinfo):
-        self._runinfo[run] = runinfo
+        if self._runinfo.get(run) != runinfo:
+            self._runinfo[run] = runinfo
+            self._changed(self._runinfofile)
 
     def addrun(self, id, run):
         self._runs[str(id)] = run
 
     def addsamplesheet(self, run, samplesheet, lane=None):
         # lane = None means samplesheet for all lanes.
-        run = self._samplesheets.setdefault(run, {}) 
-        run[lane] = samplesheet
+        # The per-run dict is copied rather than modified, since it may be shared with other instances.
+        lane = self._samplesheetkey(lane)
+        samplesheets = dict(self._samplesheets.get(run, {}))
+        if samplesheets.get(lane) != samplesheet:
+            samplesheets[lane] = samplesheet
+            self._samplesheets[run] = samplesheets
+            self._changed(self._samplesheetsfile)
+
+    @staticmethod
+    def _samplesheetkey(lane):
+        # Samplesheets are keyed by the lane as a str, and the all-lanes samplesheet by 'null', as they are on
+        # disk, so that keys of mixed types never end up in one dict and break the sorted JSON dump.
+        return 'null' if lane is None else str(lane)
 
     def addsolexarun(self, id, solexarun):
-        self._solexaruns[str(id)] = solexarun
+        if self._solexaruns.get(str(id)) != solexarun:
+            self._solexaruns[str(id)] = solexarun
+            self._changed(self._solexarunsfile)
 
     def addsolexaflowcell(self, id, solexaflowcell):
-        self._solexaflowcells[str(id)] = solexaflowcell
+        if self._solexaflowcells.get(str(id)) != solexaflowcell:
+            self._solexaflowcells[str(id)] = solexaflowcell
+            self._changed(self._solexaflowcellsfile)
 
     def addpipelinerun(self, id, pipelinerun):
-        self._pipelineruns[str(id)] = pipelinerun
+        if self._addindexed(self._pipelineruns, self._pipelinerunsbyrun, 'solexa_run_id', id, pipelinerun):
+            self._changed(self._pipelinerunsfile)
 
     def addlaneresult(self, id, laneresult):
-        self._laneresults[str(id)] = laneresult
+        if self._addindexed(self._laneresults, self._laneresultsbylane, 'solexa_lane_id', id, laneresult):
+            self._changed(self._laneresultsfile)
 
     def addmapperresult(self, id, mapperresult):
-        self._mapperresults[str(id)] = mapperresult
-
-    def addsolexaruns(self, solexaruns):
-        for id, solexarun in solexaruns.iteritems():
-            self.addsolexarun(id, solexarun)
-
-    def addsolexaflowcells(self, solexaflowcells):
-        for id, solexarun in solexaruns.iteritems():
-            self.addsolexaflowcell(id, solexaflowcell)
-
-    def addpipelineruns(self, pipelineruns):
-        for id, pipelinerun in pipelineruns.iteritems():
-            self.addpipelinerun(id, pipelinerun)
-
-    def addlaneresults(self, laneresults):
-        for id, laneresult in laneresults.iteritems():
-            self.addlaneresult(id, laneresult)
-
-    def addmapperresults(self, mapperresults):
-        for id, mapperresult in mapperresults.iteritems():
-            self.addmapperresult(id, mapperresult)
-
-    def getrunid(self, run):
-        try:
-            return str(self.getruninfo(run).get('id'))
-        except:
-            return None
+        if self._addindexed(self._mapperresults, self._mapperresultsbydataset, 'dataset_id', id, mapperresult):
+            self._changed(self._mapperresultsfile)
 
     def getlaneid(self, run, lane):
         runinfo = self.getruninfo(run)
@@ -257,50 +430,76 @@ class LocalDataManager:
         
         return id
 
-    def _getlaneresultids(self, run):
-        laneresultids = []
-        for laneresult in self.indexlaneresults(run).values():
-            laneresultids.append(str(laneresult.get('id')))
-        return laneresultids
-
-    def _getlaneids(self, run_name):
-        runinfo = self.getruninfo(run_name)
-        try:
-            lanes = runinfo.get('run_info').get('lanes')
-        except:
-            return None
-        laneids = []
-        for lane in lanes.values(): #each value is a dict from the lane
-            laneids.append(str(lane.get('id')))
-        return laneids
+    # The write*todisk methods write one collection now, if it has changed since it was last written.
 
     def writeruninfotodisk(self):
-        self._writetodisk(self._runinfo, self._runinfofile)
+        self._writeifdirty('_runinfo', self._runinfofile)
 
     def writesamplesheetstodisk(self):
-        self._writetodisk(self._samplesheets, self._samplesheetsfile)
+        self._writeifdirty('_samplesheets', self._samplesheetsfile)
 
     def writesolexarunstodisk(self):
-        self._writetodisk(self._solexaruns, self._solexarunsfile)
+        self._writeifdirty('_solexaruns', self._solexarunsfile)
 
     def writesolexaflowcellstodisk(self):
-        self._writetodisk(self._solexaflowcells, self._solexaflowcellsfile)
+        self._writeifdirty('_solexaflowcells', self._solexaflowcellsfile)
 
     def writepipelinerunstodisk(self):
-        self._writetodisk(self._pipelineruns, self._pipelinerunsfile)
+        self._writeifdirty('_pipelineruns', self._pipelinerunsfile)
 
     def writelaneresultstodisk(self):
-        self._writetodisk(self._laneresults, self._laneresultsfile)
+        self._writeifdirty('_laneresults', self._laneresultsfile)
 
     def writemapperresultstodisk(self):
-        self._writetodisk(self._mapperresults, self._mapperresultsfile)
+        self._writeifdirty('_mapperresults', self._mapperresultsfile)
+
+    def flush(self):
+        """
+        Writes every collection that has changed since it was last written.
+        """
+        self.writeruninfotodisk()
+        self.writesamplesheetstodisk()
+        self.writesolexarunstodisk()
+        self.writesolexaflowcellstodisk()
+        self.writepipelinerunstodisk()
+        self.writelaneresultstodisk()
+        self.writemapperresultstodisk()
+        self._changes = 0
+
+    def _changed(self, datafile):
+        self._dirty.add(datafile)
+        self._changes += 1
+        if self.flush_every and self._changes >= self.flush_every:
+            self.flush()
+
+    def writesnapshot(self, path):
+        """
+        Writes every collection to a snapshot file, which LocalDataManager(snapshotfile=path) can open without
+        parsing it. scgpm_lims/testdatatosnapshot.py converts the JSON testdata this way.
+        """
+        snapshot.writesnapshot(path, [
+            (self._runinfofile, self._runinfo, None),
+            (self._samplesheetsfile, self._samplesheets, None),
+            (self._solexarunsfile, self._solexaruns, None),
+            (self._solexaflowcellsfile, self._solexaflowcells, None),
+            (self._pipelinerunsfile, self._pipelineruns, 'solexa_run_id'),
+            (self._laneresultsfile, self._laneresults, 'solexa_lane_id'),
+            (self._mapperresultsfile, self._mapperresults, 'dataset_id'),
+            ])
+
+    def _writeifdirty(self, collection, datafile):
+        # Takes the collection's name, so that collections that were never loaded aren't loaded just to be skipped.
+        if self.snapshotfile and self._dirty:
+            # All collections live in the one snapshot file, so it's rewritten whole.
+            self.writesnapshot(self.snapshotfile)
+            self._dirty.clear()
+        elif datafile in self._dirty:
+            self._writetodisk(getattr(self, collection), datafile)
+            self._dirty.discard(datafile)
 
     def _writetodisk(self, info, datafile):
-        fullfilename = self._fullpath(datafile)
-        if os.path.exists(fullfilename):
-            os.remove(fullfilename)
-        with open(fullfilename,'w') as fp:
-            fp.write(json.dumps(info, sort_keys=True, indent=4, separators=(',', ': ')))
+        # Written atomically, so a crash midway leaves the previous version intact rather than a truncated file.
+        atomicwrite(self._fullpath(datafile), json.dumps(info, sort_keys=True, indent=4, separators=(',', ': ')))
 
     def _loadall(self):
         self._loadruninfo()
@@ -312,25 +511,101 @@ class LocalDataManager:
         self._loadmapperresults()
         
     def _loadruninfo(self):
-        self._runinfo = self._load(self._runinfofile)
+        self._runinfo = self._loadcollection(self._runinfofile)[0]
 
     def _loadsamplesheets(self):
-        self._samplesheets = self._load(self._samplesheetsfile)
+        self._samplesheets = self._loadcollection(self._samplesheetsfile)[0]
 
     def _loadsolexaruns(self):
-        self._solexaruns = self._load(self._solexarunsfile)
+        self._solexaruns = self._loadcollection(self._solexarunsfile)[0]
 
     def _loadsolexaflowcells(self):
-        self._solexaflowcells = self._load(self._solexaflowcellsfile)
+        self._solexaflowcells = self._loadcollection(self._solexaflowcellsfile)[0]
 
     def _loadpipelineruns(self):
-        self._pipelineruns = self._load(self._pipelinerunsfile)
+        self._pipelineruns, self._pipelinerunsbyrun = self._loadcollection(self._pipelinerunsfile, 'solexa_run_id')
 
     def _loadlaneresults(self):
-        self._laneresults = self._load(self._laneresultsfile)
+        self._laneresults, self._laneresultsbylane = self._loadcollection(self._laneresultsfile, 'solexa_lane_id')
 
     def _loadmapperresults(self):
-        self._mapperresults = self._load(self._mapperresultsfile)
+        self._mapperresults, self._mapperresultsbydataset = self._loadcollection(self._mapperresultsfile, 'dataset_id')
+
+    def _loadcollection(self, datafile, field=None):
+        """
+        Returns : (records, index) for a testdata file. index is the secondary index on field, or None if no
+                  field is given. Both come from the process-wide cache of parsed files, which is refreshed if the
+                  file changed on disk. This instance gets its own copy of the two top-level dicts, so its add*
+                  methods don't show up in other instances; the records themselves are shared and must not be
+                  modified in place.
+        """
+        if self.snapshotfile:
+            return self._loadsnapshotcollection(datafile, field)
+        path = self._fullpath(datafile)
+        try:
+            stat = os.stat(path)
+            version = (stat.st_mtime, stat.st_size)
+        except OSError:
+            version = None
+        with _sharedlock:
+            shared = _sharedcollections.get(path)
+            if shared is None or shared[0] != version:
+                records = self._load(datafile)
+                index = None
+                if field is not None:
+                    index = self._buildindex(records, field)
+                shared = (version, records, index)
+                _sharedcollections[path] = shared
+        version, records, index = shared
+        if field is not None and index is None:
+            index = self._buildindex(records, field)
+        if index is not None:
+            index = dict((key, dict(matches)) for key, matches in index.items())
+        return dict(records), index
+
+    def _loadsnapshotcollection(self, datafile, field):
+        # Like _loadcollection, but the records and index are read-only views of the shared snapshot, with this
+        # instance's changes kept in an overlay instead of in copies of the top-level dicts.
+        path = os.path.abspath(self.snapshotfile)
+        stat = os.stat(path)
+        version = (stat.st_mtime, stat.st_size)
+        with _sharedlock:
+            shared = _sharedcollections.get(path)
+            if shared is None or shared[0] != version:
+                shared = (version, snapshot.SnapshotReader(path), None)
+                _sharedcollections[path] = shared
+            reader = shared[1]
+            records = reader.records(datafile)
+            index = reader.index(datafile) if field is not None else None
+        if field is not None and (index is None or records.field != field):
+            index = self._buildindex(records, field)
+        return snapshot.Overlay(records), index if index is None else snapshot.Overlay(index, materialize=True)
+
+    def _buildindex(self, records, field):
+        index = {}
+        for id, record in records.items():
+            index.setdefault(str(record.get(field)), {})[str(id)] = record
+        return index
+
+    def _addindexed(self, records, index, field, id, record):
+        # Returns False if the same record was already stored.
+        id = str(id)
+        old = records.get(id)
+        if old is not None:
+            if old == record:
+                return False
+            self._removefromindex(index, field, id, old)
+        records[id] = record
+        index.setdefault(str(record.get(field)), {})[id] = record
+        return True
+
+    def _removefromindex(self, index, field, id, record):
+        key = str(record.get(field))
+        matches = index.get(key)
+        if matches is not None:
+            matches.pop(str(id), None)
+            if not matches:
+                del index[key]
 
     def _fullpath(self, infile):
         return os.path.join(os.path.dirname(os.path.abspath(__file__)), self._testdatadir, infile)
@@ -344,6 +619,33 @@ class LocalDataManager:
             data = {}
         return data
 
-    def testconnection(self):
-        # No-op. This mirrors the same method in remote to test a valid http connection.
-        pass
+
+class AsyncLocalDataManager:
+
+    # Exposes every method of a local data manager (LocalDataManager or SqliteDataManager) as a coroutine, so that AsyncConnection can run in local_only
+    # mode behind the same awaitable API as AsyncRemoteDataManager, without touching the network.
+
+    localorremote = 'local'
+
+    def __init__(self, manager=None):
+        if manager is None:
+            manager = LocalDataManager()
+        self.manager = manager
+
+    def __getattr__(self, name):
+        attr = getattr(self.manager, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return attr(*args, **kwargs)
+        return call
+
+    async def iterlaneresults(self, *args, **kwargs):
+        # The iter* methods are async generators, like on AsyncRemoteDataManager.
+        for laneresult in self.manager.iterlaneresults(*args, **kwargs):
+            yield laneresult
+
+    async def itermapperresults(self, *args, **kwargs):
+        for mapperresult in self.manager.itermapperresults(*args, **kwargs):
+            yield mapperresult
@@ -0,0 +1,164 @@
+import bisect
+import re
+import threading
+import time
+
+from scgpm_lims.components.atomicfile import atomicwrite
+
+# Upper bounds of the latency buckets in seconds, from 1 ms to 2 minutes in steps of about x1.5, so that
+# percentiles estimated from the buckets are within about 25% of the true value.
+LATENCY_BUCKETS = tuple(round(0.001 * 1.5 ** i, 6) for i in range(30))
+
+# Upper bounds of the response size buckets in bytes, from 256 bytes to 256 MB in steps of x2.
+SIZE_BUCKETS = tuple(256 * 2 ** i for i in range(21))
+
+_ID = re.compile(r'^\d+$')
+
+
+class Histogram:
+
+    # Counts observations in fixed buckets, like a Prometheus histogram. Percentiles are estimated by
+    # interpolating within the bucket that holds them, and clamped to the smallest and largest values seen.
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.bounds[i - 1] if i > 0 else 0
+                high = self.bounds[i] if i < len(self.bounds) else self.max
+                value = low + (high - low) * (rank - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            }
+
+
+class Metrics:
+
+    # Latency, response size and retry counts of the calls to the LIMS, per endpoint, HTTP method and status.
+    # The transport records one observation per call (after any retries). Endpoints are the url path after
+    # /api/<version>/, with numeric ids replaced by :id, so e.g. every solexa_runs/<id> call is one series.
+    # Calls that raised instead of returning a response have the exception's class name as their status.
+    #
+    # snapshot() returns the data as dicts, and prometheus() as Prometheus text exposition format, which
+    # writeprometheus(path) writes to a file for e.g. the node_exporter textfile collector.
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def record(self, url, method, status, latency, size=None, retries=0):
+        """
+        Args : url - the url called.
+               status - the HTTP status of the response, or the exception raised.
+               latency - seconds from sending the first attempt to receiving the response.
+               size - bytes in the response body, if known.
+               retries - number of retries made.
+        """
+        key = (self.endpoint(url), method.upper(), status if isinstance(status, int) else type(status).__name__)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'latency': Histogram(LATENCY_BUCKETS), 'size': Histogram(SIZE_BUCKETS), 'retries': 0}
+            series['latency'].observe(latency)
+            if size is not None:
+                series['size'].observe(size)
+            series['retries'] += retries
+
+    def endpoint(self, url):
+        path = url.split('?', 1)[0].split('://', 1)[-1]
+        parts = path.split('/')[1:]
+        if 'api' in parts and len(parts) > parts.index('api') + 2:
+            parts = parts[parts.index('api') + 2:]
+        return '/'.join(':id' if _ID.match(part) else part for part in parts if part)
+
+    def snapshot(self):
+        """
+        Returns : list of dicts, one per endpoint, method and status, with the number of calls, their rate per second
+                  since the metrics were created, the number of retries, and latency (seconds) and size (bytes)
+                  summaries with p50, p95, p99, mean and max.
+        """
+        elapsed = max(self.clock() - self.started, 1e-9)
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda item: tuple(str(part) for part in item[0]))
+            return [{
+                'endpoint': endpoint,
+                'method': method,
+                'status': status,
+                'count': data['latency'].count,
+                'per_second': data['latency'].count / elapsed,
+                'retries': data['retries'],
+                'latency': data['latency'].summary(),
+                'size': dict(data['size'].summary(), total=data['size'].sum),
+                } for (endpoint, method, status), data in series]
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            series = sorted(self._series.items(), key=lambda item: tuple(str(part) for part in item[0]))
+            for name, field, description in (
+                    ('scgpm_lims_request_duration_seconds', 'latency', 'Latency of calls to the LIMS API, including retries.'),
+                    ('scgpm_lims_response_size_bytes', 'size', 'Size of LIMS API response bodies.')):
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s histogram' % name)
+                for key, data in series:
+                    histogram = data[field]
+                    labels = self._labels(key)
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds, histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, repr(float(bound)), cumulative))
+                    lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.count))
+                    lines.append('%s_sum{%s} %s' % (name, labels, repr(float(histogram.sum))))
+                    lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+            lines.append('# HELP scgpm_lims_retries_total Retries of calls to the LIMS API.')
+            lines.append('# TYPE scgpm_lims_retries_total counter')
+            for key, data in series:
+                lines.append('scgpm_lims_retries_total{%s} %d' % (self._labels(key), data['retries']))
+        return '\n'.join(lines) + '\n'
+
+    def writeprometheus(self, path):
+        # Written atomically, so a collector never reads a partial file.
+        atomicwrite(path, self.prometheus())
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+            self.started = self.clock()
+
+    def _labels(self, key):
+        endpoint, method, status = key
+        return 'endpoint="%s",method="%s",status="%s"' % (self._escape(endpoint), self._escape(method), self._escape(str(status)))
+
+    def _escape(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -1,10 +1,133 @@
+from array import array
 import re
 
 # These are convenience classes. You can work directly with the Connection class
 # and the data objects that it returns, but any methods for working with those
 # data objects live here.
 
-class SolexaRun:
+class Record:
+
+    # Base class of the compact record types, which hold a LIMS object in far less memory than its dict. Pass
+    # records=True to the Connection index methods to get them instead of dicts.
+    #
+    # FIELDS are kept in __slots__. COUNTERS, the integer metrics that make up most of a mapper result, are
+    # packed into an array of 64 bit ints, with a bitmask of which are set, so null counters take no space at
+    # all. Anything else, such as keys the LIMS adds later or a counter that isn't an int, goes in a dict.
+    # from_dict and to_dict convert losslessly, including which keys were absent from the dict.
+    #
+    # Values are read as attributes (record.pf_aligned_read_count) or, like the dicts, with record['key'] and
+    # record.get('key'). Records are read-only; use to_dict to get something to modify.
+
+    __slots__ = ('_present', '_counters', '_extra', '_absent')
+
+    FIELDS = ()
+    COUNTERS = ()
+
+    # Sets of absent keys are shared between records, since nearly all records have the same one (usually none).
+    _absentsets = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._counterindex = dict((name, i) for i, name in enumerate(cls.COUNTERS))
+        cls._fieldset = frozenset(cls.FIELDS)
+
+    @classmethod
+    def from_dict(cls, d):
+        record = cls.__new__(cls)
+        setslot = object.__setattr__
+        extra = {}
+        absent = []
+        for name in cls.FIELDS:
+            if name in d:
+                setslot(record, name, d[name])
+            else:
+                absent.append(name)
+        present = 0
+        counters = array('q')
+        for i, name in enumerate(cls.COUNTERS):
+            if name not in d:
+                absent.append(name)
+                continue
+            value = d[name]
+            if value is None:
+                continue
+            if type(value) is int and -2**63 <= value < 2**63:
+                present |= 1 << i
+                counters.append(value)
+            else:
+                extra[name] = value
+        for name, value in d.items():
+            if name not in cls._fieldset and name not in cls._counterindex:
+                extra[name] = value
+        absent = frozenset(absent)
+        setslot(record, '_present', present)
+        setslot(record, '_counters', counters)
+        setslot(record, '_extra', extra or None)
+        setslot(record, '_absent', cls._absentsets.setdefault(absent, absent))
+        return record
+
+    def to_dict(self):
+        d = {}
+        for name in self.FIELDS:
+            if name not in self._absent:
+                d[name] = getattr(self, name)
+        for name in self.COUNTERS:
+            if name not in self._absent:
+                d[name] = self._counter(name)
+        if self._extra:
+            d.update(self._extra)
+        return d
+
+    def _counter(self, name):
+        if self._extra and name in self._extra:
+            return self._extra[name]
+        bit = 1 << self._counterindex[name]
+        if not self._present & bit:
+            return None
+        # The array only holds the set counters, so the position is the number of set bits below this one.
+        return self._counters[bin(self._present & (bit - 1)).count('1')]
+
+    def __getattr__(self, name):
+        # Only called for counters, absent fields and extra keys; fields that are set are found in their slots.
+        if name in self._counterindex:
+            return self._counter(name)
+        if name in self._fieldset:
+            return None
+        if self._extra and name in self._extra:
+            return self._extra[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s records are read-only' % type(self).__name__)
+
+    def __getitem__(self, key):
+        if key in self._fieldset or key in self._counterindex or (self._extra and key in self._extra):
+            if key in self._absent:
+                raise KeyError(key)
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return type(self) is type(other) and self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # For copy and pickle, which can't set the slots of a read-only record themselves.
+        return (type(self).from_dict, (self.to_dict(),))
+
+    def __repr__(self):
+        return '%s(id=%r)' % (type(self).__name__, self.get('id'))
+
+class SolexaRun(Record):
 
     STATUS_SEQUENCING = 'sequencing'
     STATUS_SEQUENCING_DONE = 'sequencing_done'
@@ -12,6 +135,45 @@ class SolexaRun:
     STATUS_SEQUENCING_EXCEPTION = 'sequencing_exception'
     STATUS_PREPROCESSING = 'preprocessing'
 
+    FIELDS = ('id', 'name', 'solexa_flow_cell_id', 'sequencing_instrument_id', 'technician_id', 'sequencing_run_status',
+              'sequencing_kit_version', 'solexa_sequencer_software', 'data_volume', 'start_date', 'paired_end',
+              'index_read', 'read1_cycles', 'read2_cycles', 'index1_cycles', 'index2_cycles', 'sequencer_done',
+              'analysis_done', 'dna_nexus_done', 'notification_done', 'archiving_done', 'analysis_run_dir',
+              'local_run_dir', 'backup_run_dir', 'comments', 'created_at', 'updated_at')
+    __slots__ = FIELDS
+
+class PipelineRun(Record):
+
+    FIELDS = ('id', 'solexa_run_id', 'active', 'started', 'finished', 'start_time', 'pipeline_version',
+              'analysis_starting_data_type', 'run_dir', 'archive_dir', 'base_calls_dir', 'intensities_dir',
+              'gerald_dir', 'control_lane', 'reverse_lanes', 'matrix_cycle', 'read2_matrix_cycle', 'rank',
+              'created_at', 'updated_at')
+    COUNTERS = ('pass_read_count',)
+    __slots__ = FIELDS
+
+class SolexaLaneResult(Record):
+
+    FIELDS = ('id', 'solexa_lane_id', 'solexa_pipeline_run_id', 'read_number', 'codepoint', 'active', 'rank',
+              'comments', 'created_at', 'updated_at')
+    COUNTERS = ('pass_read_count', 'total_read_count')
+    __slots__ = FIELDS
+
+class MapperResult(Record):
+
+    FIELDS = ('id', 'dataset_id', 'dataset_type', 'reference_sequence_id', 'mapping_program', 'active', 'rank',
+              'command', 'comments', 'created_at', 'updated_at')
+    COUNTERS = tuple(prefix + name for prefix in ('', 'pf_') for name in (
+        'aligned_read_count', 'uniquely_aligned_read_count', 'non_uniquely_aligned_read_count',
+        'repetitively_aligned_read_count', 'non_matching_read_count', 'contam_filtered_read_count',
+        'quality_filtered_read_count', 'sequence_filtered_read_count',
+        'unique_0mm_read_count', 'unique_1mm_read_count', 'unique_2mm_read_count', 'unique_3mm_read_count',
+        'unique_indel_read_count', 'non_unique_0mm_read_count', 'non_unique_1mm_read_count',
+        'non_unique_2mm_read_count', 'non_unique_3mm_read_count', 'non_unique_indel_read_count',
+        'repetitive_0mm_read_count', 'repetitive_1mm_read_count', 'repetitive_2mm_read_count')) + (
+        'consistent_unique_pairs', 'total_consistent_pairs', 'insert_size', 'max_hits', 'max_mismatches',
+        'num_mapped_bases', 'num_skipped_bases')
+    __slots__ = FIELDS
+
 class SolexaFlowCell:
 
     STATUS_INCOMPLETE = 'incomplete'
@@ -23,6 +185,27 @@ class SolexaFlowCell:
     STATUS_DONE = 'done'
     STATUS_CANCELLED = 'cancelled'
 
+class RunBundle:
+
+    # Every LIMS object belonging to one sequencing run, as returned by Connection.getallrunobjects.
+    # lanesamplesheets is keyed by lane number (str), and the index results are keyed by object id,
+    # as returned by the Connection index methods.
+
+    def __init__(self, run, runinfo=None, solexarun=None, solexaflowcell=None, samplesheet=None, lanesamplesheets=None,
+                 pipelineruns=None, laneresults=None, mapperresults=None):
+        self.run = run
+        self.runinfo = runinfo
+        self.solexarun = solexarun
+        self.solexaflowcell = solexaflowcell
+        self.samplesheet = samplesheet
+        self.lanesamplesheets = lanesamplesheets or {}
+        self.pipelineruns = pipelineruns or {}
+        self.laneresults = laneresults or {}
+        self.mapperresults = mapperresults or {}
+
+    def get_lanes(self):
+        return sorted(self.runinfo['run_info']['lanes'].keys(), key=int)
+
 class RunInfo:
 
     def __init__(self, conn, run):
@@ -0,0 +1,133 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from scgpm_lims.components.tracing import submit
+
+
+def _repeated(iterator, results):
+    # Whether a non-empty page only has results an earlier page of the iterator already had.
+    if iterator.ids is None or not results:
+        return False
+    ids = set(iterator.ids(results))
+    if ids <= iterator._seen:
+        return True
+    iterator._seen.update(ids)
+    return False
+
+
+class PageIterator:
+
+    # Lazily iterates over a paginated collection, one page per step. getpage(page, page_size) fetches one
+    # page, numbered from 1, and returns its results; a page shorter than page_size is the last one.
+    #
+    # With prefetch=True the next page is requested in a background thread as soon as a page is handed out,
+    # so the request overlaps with the caller's processing of the current page.
+    #
+    # If fetching a page raises, the exception is passed to the caller and the iterator stays on that page,
+    # so calling next() again retries it without refetching the pages already returned.
+    #
+    # ids, if given, is a function returning the ids of the results of a page, e.g. dict.keys. A page with no
+    # id that an earlier page didn't have also ends the iteration, and isn't returned, so that a server that
+    # ignores the paging parameters and returns the same full page every time isn't read forever.
+
+    def __init__(self, getpage, page_size, prefetch=True, ids=None):
+        if not page_size or page_size < 1:
+            raise Exception('page_size must be a positive integer, got %s' % page_size)
+        self.getpage = getpage
+        self.page_size = page_size
+        self.ids = ids
+        self.page = 1
+        self.done = False
+        self._seen = set()
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        self._prefetched = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        if self._prefetched is not None:
+            future, self._prefetched = self._prefetched, None
+            results = future.result()
+        else:
+            results = self.getpage(self.page, self.page_size)
+        self.page += 1
+        if _repeated(self, results):
+            self.close()
+            raise StopIteration
+        if len(results) < self.page_size:
+            self.close()
+        elif self._executor is not None:
+            self._prefetched = submit(self._executor, self.getpage, self.page, self.page_size)
+        if not results:
+            raise StopIteration
+        return results
+
+    def close(self):
+        # Stops iterating and releases the prefetch thread. A prefetch already in flight is left to finish.
+        self.done = True
+        self._prefetched = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncPageIterator:
+
+    # Asyncio counterpart of PageIterator, for use with "async for". getpage is a coroutine function, and the
+    # next page is prefetched as a task on the running event loop.
+
+    def __init__(self, getpage, page_size, prefetch=True, ids=None):
+        if not page_size or page_size < 1:
+            raise Exception('page_size must be a positive integer, got %s' % page_size)
+        self.getpage = getpage
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.ids = ids
+        self.page = 1
+        self.done = False
+        self._seen = set()
+        self._prefetched = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.done:
+            raise StopAsyncIteration
+        if self._prefetched is not None:
+            task, self._prefetched = self._prefetched, None
+            results = await task
+        else:
+            results = await self.getpage(self.page, self.page_size)
+        self.page += 1
+        if _repeated(self, results):
+            self.close()
+            raise StopAsyncIteration
+        if len(results) < self.page_size:
+            self.close()
+        elif self.prefetch:
+            self._prefetched = asyncio.ensure_future(self.getpage(self.page, self.page_size))
+        if not results:
+            raise StopAsyncIteration
+        return results
+
+    def close(self):
+        self.done = True
+        if self._prefetched is not None:
+            self._prefetched.cancel()
+            self._prefetched = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,5 +1,4 @@
 import json
-import requests
 import warnings
 import os
 import sys
@@ -8,11 +7,25 @@ warnings.filterwarnings('ignore', 'Unverified HTTPS request is being made. Addin
 import urllib3
 urllib3.disable_warnings()
 
+from scgpm_lims.components.jsonstream import iterjsonarray
+from scgpm_lims.components.transport import HttpTransport
+
 class RemoteDataManager:
 
     localorremote = 'remote'
 
-    def __init__(self, apiversion=None, lims_url=None, lims_token=None, verify=False):
+    # Size of the pieces a streamed response body is read and parsed in by the iter* methods.
+    stream_chunk_size = 64 * 1024
+
+    # LIMS index endpoint of each kind of object that getpage can fetch.
+    INDEXENDPOINTS = {
+        'solexaruns': 'solexa_runs',
+        'pipelineruns': 'solexa_pipeline_runs',
+        'laneresults': 'solexa_lane_results',
+        'mapperresults': 'mapper_results',
+        }
+
+    def __init__(self, apiversion=None, lims_url=None, lims_token=None, verify=False, transport=None):
         if not apiversion:
             raise Exception('apiversion is required')
         self.apiversion = apiversion
@@ -23,6 +36,10 @@ class RemoteDataManager:
         self.urlprefix = self._geturlprefix(rooturl=lims_url,apiversion=apiversion)
         self.verify = verify
 
+        # All requests share one transport so that connections to the LIMS are pooled and kept alive.
+        if transport is None:
+            transport = HttpTransport()
+        self.transport = transport
 
     def get_runname_from_flowcell_id(self,flowcell_id):
         params = {
@@ -30,7 +47,7 @@ class RemoteDataManager:
             'name' : flowcell_id
         }
        
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'solexa_flow_cells/get_run_name', #runs_to_analyze_controller.rb
             params=params,
             verify=self.verify,
@@ -50,7 +67,7 @@ class RemoteDataManager:
         params = {
             'token': self.token,
             }
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'runs_to_analyze', #runs_to_analyze_controller.rb
             params=params,
             verify=self.verify,
@@ -75,7 +92,7 @@ class RemoteDataManager:
         if lane is not None:
             params['lane'] = str(lane)
 
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'samplesheets',  #calls solexa_run.samplesheets in app/models in UHTS
             params=params,
             verify=self.verify,
@@ -84,7 +101,7 @@ class RemoteDataManager:
         return response.text
 
     def getruninfo(self, run):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'run_info',
             params = {
                 'token': self.token,
@@ -97,7 +114,7 @@ class RemoteDataManager:
 
     def get_dna_library_info(self, dna_library_id):
         url = self.urlprefix + 'dna_libraries' + '/' + str(dna_library_id)
-        response = requests.get(
+        response = self.transport.get(
             url,
             params = {
                 'token': self.token
@@ -108,7 +125,7 @@ class RemoteDataManager:
         return response.json()
     
     def get_library(self,run,lane):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'run_info/get_library',
             params = {
                 'token': self.token,
@@ -129,7 +146,7 @@ class RemoteDataManager:
         """
  
         url = self.urlprefix + "run_info_by_library_name" #run_info_by_library_name route defined in config/routes.rb in RAILS app
-        response = requests.get(
+        response = self.transport.get(
             url,
             params = {
                 'token': self.token,
@@ -142,7 +159,7 @@ class RemoteDataManager:
 
     def get_person_attributes_by_email(self,email):
         url = self.urlprefix + "get_person_by_email" #get_person_by_email route defined in config/routes.rb in RAILS app
-        response = requests.get(
+        response = self.transport.get(
             url,
             params = {
                 'token': self.token,
@@ -164,7 +181,7 @@ class RemoteDataManager:
         params = {"token": self.token}
         params.update(attributeDict)
         print(params)
-        response = requests.patch(
+        response = self.transport.patch(
             url,
             params = params,
             verify = self.verify
@@ -174,7 +191,7 @@ class RemoteDataManager:
            
 
     def getrunid(self, run):
-        runinfo = requests.getruninfo(run)
+        runinfo = self.getruninfo(run)
         try:
             id = runinfo.get('id')
         except:
@@ -182,7 +199,7 @@ class RemoteDataManager:
         return id
 
     def getlaneid(self, run, lane):
-        runinfo = requests.getruninfo(run)
+        runinfo = self.getruninfo(run)
         try:
             id = runinfo.get('run_info').get('lanes').get(str(lane)).get('id')
         except:
@@ -190,7 +207,7 @@ class RemoteDataManager:
         return id
 
     def showsolexarun(self, id):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'solexa_runs/%s' % id,
             params = {
                 'token': self.token
@@ -201,7 +218,7 @@ class RemoteDataManager:
         return response.json()
 
     def showsolexaflowcell(self, id):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'solexa_flow_cells/%s' % id,
             params = {
                 'token': self.token
@@ -212,7 +229,7 @@ class RemoteDataManager:
         return response.json()
 
     def showpipelinerun(self, id):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'solexa_pipeline_runs/%s' % id,
             params = {
                 'token': self.token
@@ -222,8 +239,8 @@ class RemoteDataManager:
         self._checkstatus(response)
         return response.json()
 
-    def showlaneresult(id):
-        response = requests.get(
+    def showlaneresult(self, id):
+        response = self.transport.get(
             self.urlprefix+'solexa_lane_results/%s' % id,
             params = {
                 'token': self.token
@@ -234,7 +251,7 @@ class RemoteDataManager:
         return response.json()
 
     def showmapperresult(self, id):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'mapper_results/%s' % id,
             params = {
                 'token': self.token
@@ -245,7 +262,7 @@ class RemoteDataManager:
         return response.json()
 
     def indexsolexaruns(self, run):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'solexa_runs',
             params = {
                 'token': self.token,
@@ -258,7 +275,7 @@ class RemoteDataManager:
         return self._listtodict(response.json())
 
     def indexpipelineruns(self, run):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'solexa_pipeline_runs',
             params = {
                 'token': self.token,
@@ -270,25 +287,25 @@ class RemoteDataManager:
         return self._listtodict(response.json())
 
     def indexlaneresults(self, run, lane=None, barcode=None, readnumber=None):
-        params = {'run': run,
-                  'token': self.token}
-        if lane is not None:
-            params.update({'lane': lane})
-            if barcode is not None:
-                params.update({'barcode': barcode})
-                if readnumber is not None:
-                    params.update({'read_number': readnumber})
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'solexa_lane_results',
-            params = params,
+            params = self._laneresultparams(run, lane, barcode, readnumber),
             verify=self.verify,
             )
 
         self._checkstatus(response)
         return self._listtodict(response.json())
 
+    def iterlaneresults(self, run, lane=None, barcode=None, readnumber=None, filter=None):
+        """
+        Function : Like indexlaneresults, but parses the response as it arrives and yields the lane results one at
+                   a time, so memory use doesn't grow with the size of the run.
+        Args     : filter - optional function of a lane result dict; only lane results it returns True for are yielded.
+        """
+        return self._iterresults('solexa_lane_results', self._laneresultparams(run, lane, barcode, readnumber), filter)
+
     def indexmapperresults(self, run):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'mapper_results',
             params = {
                 'token': self.token,
@@ -300,13 +317,40 @@ class RemoteDataManager:
 
         return self._listtodict(response.json())
 
+    def itermapperresults(self, run, filter=None):
+        """
+        Function : Like indexmapperresults, but yields the mapper results one at a time as the response is parsed.
+        Args     : filter - optional function of a mapper result dict; only mapper results it returns True for are yielded.
+        """
+        return self._iterresults('mapper_results', {'token': self.token, 'run': run}, filter)
+
+    def getpage(self, kind, page, page_size, run, **filters):
+        """
+        Function : Fetches one page of the solexaruns, pipelineruns, laneresults or mapperresults (the kind) of a run,
+                   using the page and per_page parameters of the LIMS index endpoints. Pages are numbered from 1.
+        Args     : filters - lane, barcode and readnumber, for laneresults.
+        Returns  : list of the objects on the page. A page shorter than page_size is the last one.
+        """
+        if kind == 'laneresults':
+            params = self._laneresultparams(run, filters.get('lane'), filters.get('barcode'), filters.get('readnumber'))
+        else:
+            params = {'run': run, 'token': self.token}
+        params.update({'page': page, 'per_page': page_size})
+        response = self.transport.get(
+            self.urlprefix+self.INDEXENDPOINTS[kind],
+            params = params,
+            verify=self.verify,
+            )
+        self._checkstatus(response)
+        return response.json()
+
     def createpipelinerun(self, run, paramdict = None):
         if paramdict:
             data = json.dumps(paramdict)
         else:
             data = None
 
-        response = requests.post(
+        response = self.transport.post(
             self.urlprefix+'solexa_pipeline_runs',
             params = {
                 'run': run,
@@ -325,7 +369,7 @@ class RemoteDataManager:
             params.update({'run': run})
             if lane is not None:
                 params.update({'lane': lane})
-        response = requests.post(
+        response = self.transport.post(
             self.urlprefix+'solexa_lane_results',
             params = params,
             data = json.dumps(paramdict),
@@ -336,7 +380,7 @@ class RemoteDataManager:
         return response.json()
 
     def createmapperresult(self, paramdict):
-        response = requests.post(
+        response = self.transport.post(
             self.urlprefix+'mapper_results',
             params = {'token': self.token},
             data = json.dumps(paramdict),
@@ -347,7 +391,7 @@ class RemoteDataManager:
         return response.json()
 
     def updatesolexarun(self, id, paramdict):
-        response = requests.patch(
+        response = self.transport.patch(
             self.urlprefix+'solexa_runs/%s' % id,
             params = {
                 'token': self.token
@@ -360,7 +404,7 @@ class RemoteDataManager:
         return response.json()
 
     def updatesolexaflowcell(self, id, paramdict):
-        response = requests.patch(
+        response = self.transport.patch(
             self.urlprefix+'solexa_flow_cells/%s' % id,
             params = {
                 'token': self.token
@@ -373,7 +417,7 @@ class RemoteDataManager:
         return response.json()
 
     def updatepipelinerun(self, id, paramdict):
-        response = requests.patch(
+        response = self.transport.patch(
             self.urlprefix+'solexa_pipeline_runs/%s' % id,
             params = {
                 'token': self.token
@@ -386,7 +430,7 @@ class RemoteDataManager:
         return response.json()
 
     def updatelaneresult(self, id, paramdict):
-        response = requests.patch(
+        response = self.transport.patch(
             self.urlprefix+'solexa_lane_results/%s' % id,
             params = {
                 'token': self.token
@@ -399,7 +443,7 @@ class RemoteDataManager:
         return response.json()
 
     def updatemapperresult(self, id, paramdict):
-        response = requests.patch(
+        response = self.transport.patch(
             self.urlprefix+'mapper_results/%s' % id,
             params = {
                 'token': self.token
@@ -412,7 +456,7 @@ class RemoteDataManager:
         return response.json()
 
     def deletelaneresults(self, run, lane):
-        response = requests.post(
+        response = self.transport.post(
             self.urlprefix+'delete_lane_results',
             params = {
                 'run': run,
@@ -424,7 +468,7 @@ class RemoteDataManager:
         self._checkstatus(response)
 
     def testconnection(self):
-        response = requests.get(
+        response = self.transport.get(
             self.urlprefix+'ok',
             params = {
                 'token': self.token
@@ -434,6 +478,40 @@ class RemoteDataManager:
         self._checkstatus(response)
         return
 
+    def close(self):
+        self.transport.close()
+
+    def stats(self):
+        return self.transport.stats()
+
+    def _laneresultparams(self, run, lane, barcode, readnumber):
+        params = {'run': run,
+                  'token': self.token}
+        if lane is not None:
+            params.update({'lane': lane})
+            if barcode is not None:
+                params.update({'barcode': barcode})
+                if readnumber is not None:
+                    params.update({'read_number': readnumber})
+        return params
+
+    def _iterresults(self, path, params, filter):
+        # The request is only sent once iteration starts. The response is closed when the generator is exhausted
+        # or closed, so stopping early releases the connection back to the pool.
+        response = self.transport.get(
+            self.urlprefix+path,
+            params = params,
+            verify=self.verify,
+            stream=True,
+            )
+        try:
+            self._checkstatus(response)
+            for result in iterjsonarray(response.iter_content(chunk_size=self.stream_chunk_size)):
+                if filter is None or filter(result):
+                    yield result
+        finally:
+            response.close()
+
     def _listtodict(self, resultslist):
         resultsdict = {}
         for result in resultslist:
@@ -0,0 +1,126 @@
+import random
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+
+    # Raised instead of sending a request while the circuit breaker is open, i.e. the LIMS has failed
+    # repeatedly and isn't being retried yet.
+    pass
+
+
+class CircuitBreaker:
+
+    # Fails requests fast while the LIMS is down, so that workers don't pile up waiting on timeouts.
+    #
+    # After threshold consecutive failures (connection errors, timeouts or 5xx responses) the breaker opens and
+    # every request raises CircuitOpenError for reset_time seconds. Then it lets one trial request through: if
+    # that succeeds the breaker closes again, otherwise it stays open for another reset_time.
+    #
+    # threshold=None disables the breaker.
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_time=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_time = reset_time
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.openedat = None
+        self.opens = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Raises : CircuitOpenError if a request shouldn't be sent now.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            if self.state == self.OPEN and self.clock() - self.openedat >= self.reset_time:
+                # Let this request through as the trial; others keep failing fast until it finishes.
+                self.state = self.HALF_OPEN
+                return
+            self.rejected += 1
+            raise CircuitOpenError('The LIMS circuit breaker is open after %s consecutive failures. Not retrying for %.0f more seconds.'
+                                   % (self.failures, max(0, self.reset_time - (self.clock() - self.openedat))))
+
+    def success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold is None:
+                return
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                self.state = self.OPEN
+                self.openedat = self.clock()
+                self.opens += 1
+
+
+class RetryPolicy:
+
+    # Which requests are retried, and how long to wait in between.
+    #
+    # Idempotent requests (GET, HEAD, OPTIONS) are retried up to retries times after a connection error, a
+    # timeout, or a response with one of the statuses. Writes (POST, PATCH) are only retried with
+    # retry_writes=True, since a write that timed out may have been applied by the LIMS anyway.
+    #
+    # The wait before retry n is drawn uniformly from [0, backoff * 2**(n-1)], capped at max_backoff ("full
+    # jitter"), so that many clients retrying at once don't hit the LIMS in lockstep. A Retry-After header on a
+    # 429 or 503 response is honored instead, up to max_backoff.
+
+    IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, retry_writes=False, statuses=(429, 500, 502, 503, 504)):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_writes = retry_writes
+        self.statuses = frozenset(statuses)
+
+    def attempts(self, method):
+        if method.upper() in self.IDEMPOTENT or self.retry_writes:
+            return 1 + self.retries
+        return 1
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Args : attempt - the number of the retry about to be made, from 1.
+               retry_after - the Retry-After header of the failed response, if any.
+        Returns : seconds to wait.
+        """
+        if retry_after is not None:
+            try:
+                return min(self.max_backoff, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+class RemoteCounters:
+
+    # Thread-safe counters of what the resilience layer did, for monitoring: requests sent, retries, timeouts,
+    # connection errors, and requests that failed after all attempts.
+
+    NAMES = ('requests', 'retries', 'timeouts', 'connection_errors', 'failures')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict((name, 0) for name in self.NAMES)
+
+    def increment(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
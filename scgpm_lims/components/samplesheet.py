@@ -0,0 +1,146 @@
+import csv
+import io
+
+# Columns of the bcl2fastq 1.8 samplesheet, in the order the LIMS writes them.
+V1COLUMNS = ('FCID', 'Lane', 'SampleID', 'SampleRef', 'Index', 'Description', 'Control', 'Recipe', 'Operator', 'Project')
+
+# Columns of the [Data] section of the bcl2fastq2 samplesheet.
+V2COLUMNS = ('Lane', 'Sample_ID', 'Sample_Name', 'index', 'index2', 'Sample_Project')
+
+# The two indexes of a dual-indexed barcode are stored in one codepoint, as 'I7 - I5'.
+DUALSEPARATOR = ' - '
+
+_COMPLEMENT = str.maketrans('ACGTNacgtn', 'TGCANtgcan')
+
+
+def reversecomplement(sequence):
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def rendersamplesheet(runinfo, bcl2fastq_version, lane=None):
+    """
+    Function : Builds the samplesheet that the LIMS samplesheets endpoint returns from a run's runinfo, so that it
+               can be made without another request, e.g. for every lane of a run or offline from testdata.
+               Version 1 output is the same, byte for byte, as the LIMS output stored in testdata/samplesheets.json.
+               For version 2, the second index (I5) is reverse-complemented with respect to what's stored in UHTS.
+    Args     : runinfo - dict as returned by Connection.getruninfo.
+               bcl2fastq_version - 1 or 2.
+               lane - limits the samplesheet to this lane. By default every lane of the run is included.
+    Returns  : The samplesheet as a str.
+    """
+    run_info = runinfo['run_info']
+    lanes = run_info['lanes']
+    if lane is None:
+        numbers = sorted(lanes, key=int)
+    elif str(lane) in lanes:
+        numbers = [str(lane)]
+    else:
+        raise Exception('Lane %s is not in run %s' % (lane, run_info.get('run_name')))
+
+    out = io.StringIO()
+    if int(bcl2fastq_version) == 1:
+        out.write(','.join(V1COLUMNS) + '\n')
+        for number in numbers:
+            _writev1lane(out, run_info, lanes[number])
+    elif int(bcl2fastq_version) == 2:
+        out.write('[Data]\n')
+        out.write(','.join(V2COLUMNS) + '\n')
+        for number in numbers:
+            _writev2lane(out, run_info, lanes[number])
+    else:
+        raise ValueError("Invalid bcl2fastq_version '%s'. Must be one of [1, 2]." % bcl2fastq_version)
+    return out.getvalue()
+
+
+def _writev1lane(out, run_info, lane):
+    flowcell = run_info['flow_cell']
+    number = lane['lane_number']
+    control = 'Y' if number == run_info.get('control_lane') else 'N'
+    prefix = '%s,%s,lane%s,' % (flowcell, number, number)
+    suffix = ',%s,na,na,%s\n' % (control, flowcell)
+    barcodes = lane.get('barcodes') or []
+    if not barcodes:
+        out.write('%slane%s_ref,,na%s' % (prefix, number, suffix))
+        return
+    for barcode in barcodes:
+        codepoint = barcode['codepoint']
+        out.write('%slane%s_%s_ref,%s,na%s' % (prefix, number, codepoint, codepoint, suffix))
+    out.write('%sunknown,Undetermined,Unmatched barcodes for lane %s%s' % (prefix, number, suffix))
+
+
+def _writev2lane(out, run_info, lane):
+    # bcl2fastq2 reports undetermined reads by itself, so there is no Undetermined row as in version 1.
+    flowcell = run_info['flow_cell']
+    number = lane['lane_number']
+    barcodes = lane.get('barcodes') or []
+    if not barcodes:
+        out.write('%s,lane%s,lane%s,,,%s\n' % (number, number, number, flowcell))
+        return
+    for barcode in barcodes:
+        index, index2 = barcode['codepoint'], ''
+        if DUALSEPARATOR in index:
+            index, index2 = index.split(DUALSEPARATOR, 1)
+            sample = 'lane%s_%s-%s' % (number, index, index2)
+            index2 = reversecomplement(index2)
+        else:
+            sample = 'lane%s_%s' % (number, index)
+        out.write('%s,%s,%s,%s,%s,%s\n' % (number, sample, sample, index, index2, flowcell))
+
+
+class SampleSheetSplitter:
+
+    # Splits an all-lanes samplesheet of either version into one samplesheet per lane as it's read, a chunk at
+    # a time. Each lane's samplesheet is the lines up to and including the column header row (for version 2,
+    # everything before and including the [Data] section's header), followed by that lane's rows, with the lines
+    # kept byte for byte. That is what the LIMS returns when asked for a single lane.
+    #
+    # feed(chunk) takes the next piece of text and close() returns the dict of lane number to samplesheet. Lane
+    # numbers are str, as they are in the runinfo lanes and wherever else this package keys by lane.
+
+    def __init__(self):
+        self._partial = ''
+        self._preamble = []
+        self._laneindex = None
+        self._lanes = {}
+
+    def feed(self, chunk):
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line + '\n')
+
+    def close(self):
+        if self._partial:
+            self._line(self._partial)
+            self._partial = ''
+        if self._laneindex is None:
+            raise Exception('The samplesheet has no header row with a Lane column')
+        preamble = ''.join(self._preamble)
+        return dict((lane, preamble + ''.join(rows)) for lane, rows in self._lanes.items())
+
+    def _line(self, line):
+        if not line.strip():
+            if self._laneindex is None:
+                self._preamble.append(line)
+            return
+        fields = next(csv.reader((line,)))
+        if self._laneindex is None:
+            self._preamble.append(line)
+            if 'Lane' in fields:
+                self._laneindex = fields.index('Lane')
+            return
+        self._lanes.setdefault(str(int(fields[self._laneindex])), []).append(line)
+
+
+def splitsamplesheet(samplesheet):
+    """
+    Function : Splits an all-lanes samplesheet into per-lane samplesheets; see SampleSheetSplitter.
+    Args     : samplesheet - the samplesheet as a str, or an iterable of str chunks of it.
+    Returns  : dict of lane number (str) to samplesheet, in the order the lanes appear.
+    """
+    splitter = SampleSheetSplitter()
+    if isinstance(samplesheet, str):
+        samplesheet = (samplesheet,)
+    for chunk in samplesheet:
+        splitter.feed(chunk)
+    return splitter.close()
@@ -0,0 +1,246 @@
+import array
+from collections.abc import Mapping, MutableMapping
+import json
+import mmap
+import struct
+import sys
+
+from scgpm_lims.components.atomicfile import atomicopen
+
+# Snapshot files hold all the testdata collections in one memory-mapped file, so that LocalDataManager can open
+# the store without parsing records it never reads.
+#
+# Layout: MAGIC, then the offset and length of the table of contents as little-endian uint64s. The table of
+# contents is JSON mapping each collection's data file name to the (offset, length) of its table, a small JSON
+# object pointing to the collection's blobs:
+#   ids        newline-separated record ids
+#   offsets    uint64 (offset, length) pairs locating each record, in the order of ids
+#   keys       newline-separated values of the indexed field, if the collection has a secondary index
+#   starts     uint64 start of each key's run in positions, plus the end of the last one
+#   positions  uint64 positions in ids of the records matching each key, grouped by key
+# Records are stored as compact JSON. The arrays are little-endian and read without parsing, so opening a
+# collection only costs splitting its ids, and a record is only parsed when it is read.
+
+MAGIC = b'SCGPMSN1'
+_length = struct.Struct('<Q')
+
+
+def _packarray(values):
+    values = array.array('Q', values)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _unpackarray(blob):
+    values = array.array('Q')
+    values.frombytes(blob)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def writesnapshot(path, collections):
+    """
+    Writes a snapshot file, atomically replacing any existing one.
+
+    Args : path - The snapshot file to write.
+           collections - A list of (datafile, records, field) tuples, where records is a mapping of id to record
+                         and field is the record field to index on, or None.
+    """
+    with atomicopen(path, binary=True) as fp:
+        def writeblob(blob):
+            offset = fp.tell()
+            fp.write(blob)
+            return [offset, len(blob)]
+
+        # The header pointing to the table of contents is reserved now and filled in at the end.
+        fp.write(MAGIC + _length.pack(0) + _length.pack(0))
+        contents = {}
+        for datafile, records, field in collections:
+            ids = []
+            offsets = []
+            index = {}
+            for id, record in records.items():
+                blob = json.dumps(record, separators=(',', ':')).encode()
+                offsets.extend(writeblob(blob))
+                if field is not None:
+                    index.setdefault(str(record.get(field)), []).append(len(ids))
+                ids.append(str(id))
+            table = {
+                'field': field,
+                'ids': writeblob('\n'.join(ids).encode()),
+                'offsets': writeblob(_packarray(offsets)),
+                }
+            if field is not None:
+                keys = list(index)
+                starts = [0]
+                for key in keys:
+                    starts.append(starts[-1] + len(index[key]))
+                table['keys'] = writeblob('\n'.join(keys).encode())
+                table['starts'] = writeblob(_packarray(starts))
+                table['positions'] = writeblob(_packarray(position for key in keys for position in index[key]))
+            contents[datafile] = writeblob(json.dumps(table).encode())
+        tocoffset, toclength = writeblob(json.dumps(contents).encode())
+        fp.seek(len(MAGIC))
+        fp.write(_length.pack(tocoffset) + _length.pack(toclength))
+
+
+class SnapshotReader:
+
+    # An open snapshot file. The file is memory-mapped, so unread records cost no memory beyond the page cache.
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            if fp.read(len(MAGIC)) != MAGIC:
+                raise Exception('%s is not a testdata snapshot.' % path)
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        tocoffset = _length.unpack_from(self._map, len(MAGIC))[0]
+        toclength = _length.unpack_from(self._map, len(MAGIC) + _length.size)[0]
+        self._contents = json.loads(self._read(tocoffset, toclength))
+        self._collections = {}
+
+    def __contains__(self, datafile):
+        return datafile in self._contents
+
+    def records(self, datafile):
+        return self._collection(datafile)
+
+    def index(self, datafile):
+        collection = self._collection(datafile)
+        if collection.field is None:
+            return None
+        return SnapshotIndex(collection)
+
+    def _collection(self, datafile):
+        collection = self._collections.get(datafile)
+        if collection is None:
+            table = None
+            if datafile in self._contents:
+                table = json.loads(self._read(*self._contents[datafile]))
+            collection = SnapshotCollection(self, table)
+            self._collections[datafile] = collection
+        return collection
+
+    def _read(self, offset, length):
+        return self._map[offset:offset + length]
+
+    def _readlist(self, location):
+        blob = self._read(*location)
+        return blob.decode().split('\n') if blob else []
+
+
+class SnapshotCollection(Mapping):
+
+    # Read-only mapping of id to record for one collection. Records are parsed on first access and then kept,
+    # so every reader of the same snapshot gets the same record object, as with the shared JSON collections.
+
+    def __init__(self, reader, table):
+        self.reader = reader
+        self.table = table or {'field': None}
+        self.field = self.table['field']
+        if table is None:
+            self.ids = []
+            self._offsets = array.array('Q')
+        else:
+            self.ids = reader._readlist(table['ids'])
+            self._offsets = _unpackarray(reader._read(*table['offsets']))
+        self._positions = dict(zip(self.ids, range(len(self.ids))))
+        self._parsed = {}
+
+    def __getitem__(self, id):
+        return self.record(self._positions[id])
+
+    def record(self, position):
+        record = self._parsed.get(position)
+        if record is None:
+            record = json.loads(self.reader._read(self._offsets[2 * position], self._offsets[2 * position + 1]))
+            self._parsed[position] = record
+        return record
+
+    def __contains__(self, id):
+        return id in self._positions
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class SnapshotIndex(Mapping):
+
+    # Read-only secondary index of a SnapshotCollection, mapping a key to a new dict of the matching records.
+
+    def __init__(self, collection):
+        self.collection = collection
+        table = collection.table
+        reader = collection.reader
+        self._keys = dict((key, k) for k, key in enumerate(reader._readlist(table['keys'])))
+        self._starts = _unpackarray(reader._read(*table['starts']))
+        self._matches = _unpackarray(reader._read(*table['positions']))
+
+    def __getitem__(self, key):
+        k = self._keys[key]
+        ids = self.collection.ids
+        return dict((ids[position], self.collection.record(position))
+                    for position in self._matches[self._starts[k]:self._starts[k + 1]])
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class Overlay(MutableMapping):
+
+    # A per-instance writable view of a shared read-only mapping. Writes and deletes are kept in the overlay,
+    # so they are never seen by other instances reading the same snapshot.
+    #
+    # With materialize=True, a value read from the base mapping is stored in the overlay, so that changes made
+    # to it in place (like LocalDataManager does to its secondary indexes) are kept.
+
+    def __init__(self, base, materialize=False):
+        self.base = base
+        self.materialize = materialize
+        self._overlay = {}
+        self._deleted = set()
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        value = self.base[key]
+        if self.materialize:
+            self._overlay[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._overlay[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._overlay.pop(key, None)
+        if key in self.base:
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self._overlay or (key not in self._deleted and key in self.base)
+
+    def __iter__(self):
+        for key in self.base:
+            if key not in self._deleted and key not in self._overlay:
+                yield key
+        for key in self._overlay:
+            yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
@@ -0,0 +1,248 @@
+import json
+import sqlite3
+import threading
+
+from scgpm_lims.components.local import BaseLocalDataManager
+
+
+class SqliteDataManager(BaseLocalDataManager):
+
+    # SQLite storage engine for the local store, with the same interface as LocalDataManager. Use it for large
+    # offline mirrors of the LIMS, where holding every collection in memory doesn't scale.
+    #
+    # Every object is stored whole as JSON in a data column, next to indexed columns for the fields that lookups
+    # and index* queries filter on: run name, solexa_run_id, solexa_lane_id and dataset_id. Lanes of each run
+    # get their own table, so lane results can be found without parsing runinfo. Each add*, create* and update*
+    # is written and committed immediately; there is nothing to write to disk afterwards.
+    #
+    # It shares only the storage-independent methods with LocalDataManager, through BaseLocalDataManager, so
+    # nothing here ever reads or writes the JSON testdata.
+    #
+    # Create a database from the JSON testdata with:  python -m scgpm_lims.testdatatosqlite <dbfile>
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS runinfo (run TEXT PRIMARY KEY, solexa_run_id TEXT, flow_cell TEXT, data TEXT);
+        CREATE INDEX IF NOT EXISTS runinfo_solexa_run_id ON runinfo (solexa_run_id);
+        CREATE INDEX IF NOT EXISTS runinfo_flow_cell ON runinfo (flow_cell);
+        CREATE TABLE IF NOT EXISTS lanes (solexa_lane_id TEXT PRIMARY KEY, run TEXT, lane TEXT);
+        CREATE INDEX IF NOT EXISTS lanes_run ON lanes (run, lane);
+        CREATE TABLE IF NOT EXISTS samplesheets (run TEXT, lane TEXT, samplesheet TEXT, PRIMARY KEY (run, lane));
+        CREATE TABLE IF NOT EXISTS solexaruns (id TEXT PRIMARY KEY, name TEXT, data TEXT);
+        CREATE INDEX IF NOT EXISTS solexaruns_name ON solexaruns (name);
+        CREATE TABLE IF NOT EXISTS solexaflowcells (id TEXT PRIMARY KEY, data TEXT);
+        CREATE TABLE IF NOT EXISTS pipelineruns (id TEXT PRIMARY KEY, solexa_run_id TEXT, data TEXT);
+        CREATE INDEX IF NOT EXISTS pipelineruns_solexa_run_id ON pipelineruns (solexa_run_id);
+        CREATE TABLE IF NOT EXISTS laneresults (id TEXT PRIMARY KEY, solexa_lane_id TEXT, codepoint TEXT, read_number TEXT, data TEXT);
+        CREATE INDEX IF NOT EXISTS laneresults_solexa_lane_id ON laneresults (solexa_lane_id, codepoint, read_number);
+        CREATE TABLE IF NOT EXISTS mapperresults (id TEXT PRIMARY KEY, dataset_id TEXT, data TEXT);
+        CREATE INDEX IF NOT EXISTS mapperresults_dataset_id ON mapperresults (dataset_id);
+        """
+
+    # The all-lanes samplesheet is stored under lane '' since NULL can't be part of a primary key.
+    _alllanes = ''
+
+    def __init__(self, dbfile):
+        BaseLocalDataManager.__init__(self)
+        self.dbfile = dbfile
+        # Connection's *_many methods call in from worker threads, so one sqlite connection is shared under a lock.
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(dbfile, check_same_thread=False)
+        self._db.executescript(self._schema)
+        self._autocommit = True
+
+    def get_runname_from_flowcell_id(self, flowcell_id):
+        row = self._one("SELECT run FROM runinfo WHERE flow_cell = ?", (flowcell_id,))
+        return row and row[0]
+
+    def getruninfo(self, run=None):
+        return self._data("SELECT data FROM runinfo WHERE run = ?", (run,))
+
+    def getsamplesheet(self, run=None, lane=None, bcl2fastq_version=None):
+        lane = str(lane) if lane else self._alllanes
+        row = self._one("SELECT samplesheet FROM samplesheets WHERE run = ? AND lane = ?", (run, lane))
+        return row and row[0]
+
+    def showsolexarun(self, id=None):
+        return self._data("SELECT data FROM solexaruns WHERE id = ?", (str(id),))
+
+    def showsolexaflowcell(self, id=None):
+        return self._data("SELECT data FROM solexaflowcells WHERE id = ?", (str(id),))
+
+    def showpipelinerun(self, id=None):
+        return self._data("SELECT data FROM pipelineruns WHERE id = ?", (str(id),))
+
+    def showlaneresult(self, id=None):
+        return self._data("SELECT data FROM laneresults WHERE id = ?", (str(id),))
+
+    def showmapperresult(self, id=None):
+        return self._data("SELECT data FROM mapperresults WHERE id = ?", (str(id),))
+
+    def indexsolexaruns(self, run=None):
+        return self._datadict("SELECT s.id, s.data FROM solexaruns s JOIN runinfo r ON s.id = r.solexa_run_id WHERE r.run = ?", (run,))
+
+    def indexpipelineruns(self, run=None):
+        return self._datadict("SELECT p.id, p.data FROM pipelineruns p JOIN runinfo r ON p.solexa_run_id = r.solexa_run_id WHERE r.run = ?", (run,))
+
+    def indexlaneresults(self, run, lane=None, barcode=None, readnumber=None):
+        # Filters nest like they do in the LIMS: barcode only applies with a lane, read number only with a barcode.
+        query = "SELECT l.id, l.data FROM laneresults l JOIN lanes n ON l.solexa_lane_id = n.solexa_lane_id WHERE n.run = ?"
+        args = [run]
+        if lane is not None:
+            query += " AND n.lane = ?"
+            args.append(str(lane))
+            if barcode is not None:
+                query += " AND l.codepoint = ?"
+                args.append(barcode)
+                if readnumber is not None:
+                    query += " AND l.read_number = ?"
+                    args.append(str(readnumber))
+        return self._datadict(query, args)
+
+    def indexmapperresults(self, run=None):
+        return self._datadict("SELECT m.id, m.data FROM mapperresults m JOIN laneresults l ON m.dataset_id = l.id "
+                              "JOIN lanes n ON l.solexa_lane_id = n.solexa_lane_id WHERE n.run = ?", (run,))
+
+    def updatesolexarun(self, id, paramdict):
+        return self._update(self.showsolexarun, self.addsolexarun, id, paramdict)
+
+    def updatesolexaflowcell(self, id, paramdict):
+        return self._update(self.showsolexaflowcell, self.addsolexaflowcell, id, paramdict)
+
+    def updatepipelinerun(self, id, paramdict):
+        return self._update(self.showpipelinerun, self.addpipelinerun, id, paramdict)
+
+    def updatelaneresult(self, id, paramdict):
+        return self._update(self.showlaneresult, self.addlaneresult, id, paramdict)
+
+    def updatemapperresult(self, id, paramdict):
+        return self._update(self.showmapperresult, self.addmapperresult, id, paramdict)
+
+    def deletelaneresults(self, run, lane):
+        # Like the LIMS, this also deletes the mapper results of the lane results.
+        ids = [(id,) for id in self.indexlaneresults(run, lane=lane)]
+        with self._lock:
+            self._db.executemany("DELETE FROM mapperresults WHERE dataset_id = ?", ids)
+            self._db.executemany("DELETE FROM laneresults WHERE id = ?", ids)
+            self._commit()
+
+    def addruninfo(self, run, runinfo):
+        lanes = runinfo.get('run_info', {}).get('lanes', {})
+        with self._lock:
+            self._db.execute("DELETE FROM lanes WHERE run = ?", (run,))
+            self._db.executemany("INSERT OR REPLACE INTO lanes VALUES (?, ?, ?)",
+                                 [(str(lane.get('id')), run, str(number)) for number, lane in lanes.items()])
+            self._write("INSERT OR REPLACE INTO runinfo VALUES (?, ?, ?, ?)",
+                        (run, str(runinfo.get('id')), runinfo.get('run_info', {}).get('flow_cell'), json.dumps(runinfo)))
+
+    def addsamplesheet(self, run, samplesheet, lane=None):
+        lane = str(lane) if lane else self._alllanes
+        self._write("INSERT OR REPLACE INTO samplesheets VALUES (?, ?, ?)", (run, lane, samplesheet))
+
+    def addsolexarun(self, id, solexarun):
+        self._write("INSERT OR REPLACE INTO solexaruns VALUES (?, ?, ?)", (str(id), solexarun.get('name'), json.dumps(solexarun)))
+
+    def addsolexaflowcell(self, id, solexaflowcell):
+        self._write("INSERT OR REPLACE INTO solexaflowcells VALUES (?, ?)", (str(id), json.dumps(solexaflowcell)))
+
+    def addpipelinerun(self, id, pipelinerun):
+        self._write("INSERT OR REPLACE INTO pipelineruns VALUES (?, ?, ?)",
+                    (str(id), str(pipelinerun.get('solexa_run_id')), json.dumps(pipelinerun)))
+
+    def addlaneresult(self, id, laneresult):
+        readnumber = laneresult.get('read_number')
+        self._write("INSERT OR REPLACE INTO laneresults VALUES (?, ?, ?, ?, ?)",
+                    (str(id), str(laneresult.get('solexa_lane_id')), laneresult.get('codepoint'),
+                     None if readnumber is None else str(readnumber), json.dumps(laneresult)))
+
+    def addmapperresult(self, id, mapperresult):
+        self._write("INSERT OR REPLACE INTO mapperresults VALUES (?, ?, ?)",
+                    (str(id), str(mapperresult.get('dataset_id')), json.dumps(mapperresult)))
+
+    def getlaneid(self, run, lane):
+        row = self._one("SELECT solexa_lane_id FROM lanes WHERE run = ? AND lane = ?", (run, str(lane)))
+        return row and int(row[0])
+
+    def importjson(self, local):
+        """
+        Copies every object in a JSON-backed LocalDataManager into this database, in a single transaction.
+        """
+        with self._lock:
+            self._autocommit = False
+            try:
+                for run, runinfo in local._runinfo.items():
+                    self.addruninfo(run, runinfo)
+                for run, samplesheets in local._samplesheets.items():
+                    for lane, samplesheet in samplesheets.items():
+                        self.addsamplesheet(run, samplesheet, lane=None if lane in (None, 'null') else lane)
+                self.addsolexaruns(local._solexaruns)
+                self.addsolexaflowcells(local._solexaflowcells)
+                self.addpipelineruns(local._pipelineruns)
+                self.addlaneresults(local._laneresults)
+                self.addmapperresults(local._mapperresults)
+                self._db.commit()
+            except:
+                self._db.rollback()
+                raise
+            finally:
+                self._autocommit = True
+
+    # Writes are committed as they happen, so there's nothing left to write to disk.
+
+    def writeruninfotodisk(self):
+        pass
+
+    def writesamplesheetstodisk(self):
+        pass
+
+    def writesolexarunstodisk(self):
+        pass
+
+    def writesolexaflowcellstodisk(self):
+        pass
+
+    def writepipelinerunstodisk(self):
+        pass
+
+    def writelaneresultstodisk(self):
+        pass
+
+    def writemapperresultstodisk(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _update(self, show, add, id, paramdict):
+        with self._lock:
+            record = show(id)
+            if record is None:
+                return None
+            record.update(paramdict)
+            add(id, record)
+            return record
+
+    def _one(self, query, args):
+        with self._lock:
+            return self._db.execute(query, args).fetchone()
+
+    def _data(self, query, args):
+        row = self._one(query, args)
+        return row and json.loads(row[0])
+
+    def _datadict(self, query, args):
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return dict((id, json.loads(data)) for id, data in rows)
+
+    def _write(self, query, args):
+        with self._lock:
+            self._db.execute(query, args)
+            self._commit()
+
+    def _commit(self):
+        if self._autocommit:
+            self._db.commit()
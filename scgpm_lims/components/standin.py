@@ -0,0 +1,248 @@
+import contextlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.samplesheet import rendersamplesheet
+
+
+class _ReadWriteLock:
+
+    # Lets any number of readers hold it at once, or one writer. A waiting writer keeps new readers out, so
+    # writes aren't starved by a steady stream of reads.
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waitingwriters = 0
+
+    @contextlib.contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._waitingwriters:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def writing(self):
+        with self._condition:
+            self._waitingwriters += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waitingwriters -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class StandInLims:
+
+    # A local HTTP server that answers the /api/<version>/... routes RemoteDataManager uses from a
+    # LocalDataManager (the testdata by default), so that the real Connection can be driven over HTTP without
+    # the production LIMS, e.g. to measure client throughput. Writes change only the in-memory data.
+    #
+    # latency adds a fixed delay in seconds to every response, plus a uniformly random extra of up to jitter
+    # seconds. error_rate is the fraction of requests answered with error_status instead, chosen at random
+    # (seeded with seed, for reproducible runs). index endpoints honor page and per_page like getpage.
+    # Version 2 samplesheets are rendered from the runinfo, since the testdata only holds version 1.
+    #
+    # Use it as "with StandInLims() as lims:" and connect to lims.url, or call start() and stop().
+
+    def __init__(self, manager=None, host='127.0.0.1', port=0, token=None, latency=0, jitter=0, error_rate=0, error_status=503, seed=None):
+        self.manager = manager if manager is not None else LocalDataManager()
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        # The server answers each connection on its own thread. Reads of the data manager run concurrently, and
+        # writes one at a time with no reads in between, since the data managers aren't safe to modify while
+        # they're read. lock guards the counters and random.
+        self.datalock = _ReadWriteLock()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handlerclass())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def handle(self, method, path, query, body):
+        """
+        Answers one request.
+
+        Args : method - 'GET', 'POST' or 'PATCH'.
+               path - the url path after /api/<version>/, as a list of segments.
+               query - dict of query parameter to value.
+               body - the decoded JSON request body, or None.
+        Returns : (status, body), where body is a str for samplesheets and otherwise a JSON-serializable object.
+        """
+        with self.lock:
+            self.requests += 1
+            fail = self.error_rate and self.random.random() < self.error_rate
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self.lock:
+                self.errors += 1
+            return self.error_status, {'error': 'injected error'}
+        if self.token is not None and query.get('token') != self.token:
+            return 401, {'error': 'invalid token'}
+        with self.datalock.reading() if method == 'GET' else self.datalock.writing():
+            return self._route(method, path, query, body)
+
+    def _route(self, method, path, query, body):
+        manager = self.manager
+        name = path[0] if path else ''
+        id = path[1] if len(path) > 1 else None
+        run = query.get('run')
+        kinds = {
+            'solexa_runs': ('solexaruns', manager.showsolexarun, manager.updatesolexarun),
+            'solexa_flow_cells': (None, manager.showsolexaflowcell, manager.updatesolexaflowcell),
+            'solexa_pipeline_runs': ('pipelineruns', manager.showpipelinerun, manager.updatepipelinerun),
+            'solexa_lane_results': ('laneresults', manager.showlaneresult, manager.updatelaneresult),
+            'mapper_results': ('mapperresults', manager.showmapperresult, manager.updatemapperresult),
+            }
+
+        if method == 'GET':
+            if name == 'ok':
+                return 200, {}
+            if name == 'run_info' and id is None:
+                return self._found(manager.getruninfo(run))
+            if name == 'samplesheets':
+                return self._samplesheet(run, query.get('lane'), query.get('bcl2fastq_version'))
+            if name == 'runs_to_analyze':
+                return 200, []
+            if name == 'solexa_flow_cells' and id == 'get_run_name':
+                runname = manager.get_runname_from_flowcell_id(query.get('name'))
+                return self._found(runname and {'run_name': runname})
+            if name in kinds and id is not None:
+                return self._found(kinds[name][1](id))
+            if name in kinds and kinds[name][0] is not None:
+                filters = {}
+                if name == 'solexa_lane_results':
+                    filters = {'lane': query.get('lane'), 'barcode': query.get('barcode'), 'readnumber': query.get('read_number')}
+                    if filters['lane'] is None:
+                        filters = {}
+                if 'page' in query and 'per_page' in query:
+                    return 200, manager.getpage(kinds[name][0], int(query['page']), int(query['per_page']), run, **filters)
+                index = getattr(manager, 'index' + kinds[name][0])
+                return 200, list(index(run, **filters).values())
+        elif method == 'POST':
+            if name == 'solexa_pipeline_runs':
+                return 200, manager.createpipelinerun(run, body)
+            if name == 'solexa_lane_results':
+                return 200, manager.createlaneresult(body or {}, run=run, lane=query.get('lane'))
+            if name == 'mapper_results':
+                return 200, manager.createmapperresult(body or {})
+            if name == 'delete_lane_results':
+                manager.deletelaneresults(run, query.get('lane'))
+                return 200, {}
+        elif method == 'PATCH':
+            if name in kinds and id is not None:
+                return self._found(kinds[name][2](id, body or {}))
+        return 404, {'error': 'no route for %s /%s' % (method, '/'.join(path))}
+
+    def _samplesheet(self, run, lane, bcl2fastq_version):
+        if bcl2fastq_version in (None, '1'):
+            return self._found(self.manager.getsamplesheet(run=run, lane=lane))
+        if bcl2fastq_version != '2':
+            return 404, {'error': 'no samplesheet for bcl2fastq version %s' % bcl2fastq_version}
+        runinfo = self.manager.getruninfo(run)
+        if runinfo is None or (lane is not None and lane not in runinfo['run_info']['lanes']):
+            return 404, {'error': 'not found'}
+        return 200, rendersamplesheet(runinfo, 2, lane=lane)
+
+    def _found(self, result):
+        if result is None:
+            return 404, {'error': 'not found'}
+        return 200, result
+
+    def _handlerclass(self):
+        lims = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def do_PATCH(self):
+                self._respond('PATCH')
+
+            def _respond(self, method):
+                url = urlsplit(self.path)
+                query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else None
+                path = [segment for segment in url.path.split('/') if segment]
+                # Drop everything up to and including /api/<version>/.
+                if 'api' in path:
+                    path = path[path.index('api') + 2:]
+                try:
+                    status, result = lims.handle(method, path, query, json.loads(body) if body else None)
+                except Exception as e:
+                    status, result = 500, {'error': repr(e)}
+                if isinstance(result, str):
+                    payload, contenttype = result.encode('utf-8'), 'text/plain; charset=utf-8'
+                else:
+                    payload, contenttype = json.dumps(result).encode('utf-8'), 'application/json'
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', contenttype)
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up, e.g. after its read timeout.
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
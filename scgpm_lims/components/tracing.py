@@ -0,0 +1,191 @@
+import contextvars
+import functools
+import inspect
+import json
+import random
+import re
+import threading
+import time
+
+# The span that calls made in the current thread or asyncio task are nested under.
+_current = contextvars.ContextVar('scgpm_lims_span', default=None)
+
+# Errors from requests quote the full url, query string and token included.
+_TOKEN = re.compile(r'token=[^&\s\'"]*')
+
+
+class Span:
+
+    # One timed operation, e.g. a Connection method or an HTTP request to the LIMS. Spans opened while another
+    # is current (in the same thread or asyncio task, or in work started with submit()) are its children and
+    # share its trace_id. attributes are kept as the raw values they were given; nothing is formatted until
+    # todict() is called by a sink.
+
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'start', 'duration', 'attributes', 'error', '_started', '_token')
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = '%016x' % random.getrandbits(64)
+        if parent is None:
+            self.trace_id = '%032x' % random.getrandbits(128)
+            self.parent_id = None
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        self.attributes = attributes
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def todict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error,
+            }
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self._started
+        if exc_value is not None:
+            self.error = _TOKEN.sub('token=...', repr(exc_value))
+        _current.reset(self._token)
+        self.tracer._end(self)
+        return False
+
+
+class _NoSpan:
+
+    # Returned by Tracer.span() when no sink is attached, so disabled tracing costs one check per call.
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NOSPAN = _NoSpan()
+
+
+class Tracer:
+
+    # Hands finished spans to its sinks. A sink is any callable taking a Span, e.g. a JsonLinesSink or
+    # list.append. With no sinks attached, span() returns NOSPAN and no span is created.
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def addsink(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def removesink(self, sink):
+        self.sinks.remove(sink)
+
+    def span(self, name, **attributes):
+        if not self.sinks:
+            return NOSPAN
+        return Span(self, name, _current.get(), attributes)
+
+    def _end(self, span):
+        for sink in list(self.sinks):
+            sink(span)
+
+
+class JsonLinesSink:
+
+    # Writes each finished span as one line of JSON to path (appended to) or to an open text file. Attribute
+    # values that aren't JSON types are written as their str().
+
+    def __init__(self, path=None, file=None):
+        if (path is None) == (file is None):
+            raise Exception('JsonLinesSink needs exactly one of path or file')
+        self._owned = file is None
+        self.file = open(path, 'a') if file is None else file
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.todict(), default=str) + '\n'
+        with self._lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        if self._owned:
+            self.file.close()
+
+
+def currentspan():
+    # The innermost open span, or None.
+    return _current.get()
+
+
+def submit(pool, fn, *args, **kwargs):
+    # Like pool.submit, but fn runs in a copy of the current context, so spans it opens are nested under the
+    # current span instead of starting new traces.
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def traced(*attributes):
+    """
+    Function : Decorator for methods of objects with a tracer attribute. Each call is a span named after the method,
+               with the named arguments (defaults included, None left out) as attributes, and result_size set to len() of what
+               it returns: the number of objects from index methods, the length of a samplesheet. Works on
+               coroutine functions too. When the tracer has no sinks the method is called directly.
+    Args     : attributes - names of the arguments to record.
+    """
+    def decorate(fn):
+        signature = inspect.signature(fn)
+        name = fn.__qualname__
+
+        def start(self, args, kwargs):
+            bound = signature.bind_partial(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+            return self.tracer.span(name, **dict((key, arguments[key]) for key in attributes if arguments.get(key) is not None))
+
+        def finish(span, result):
+            if hasattr(result, '__len__'):
+                span.set(result_size=len(result))
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(self, *args, **kwargs):
+                if not self.tracer.sinks:
+                    return await fn(self, *args, **kwargs)
+                with start(self, args, kwargs) as span:
+                    result = await fn(self, *args, **kwargs)
+                    finish(span, result)
+                    return result
+        else:
+            @functools.wraps(fn)
+            def wrapper(self, *args, **kwargs):
+                if not self.tracer.sinks:
+                    return fn(self, *args, **kwargs)
+                with start(self, args, kwargs) as span:
+                    result = fn(self, *args, **kwargs)
+                    finish(span, result)
+                    return result
+        return wrapper
+    return decorate
@@ -0,0 +1,168 @@
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scgpm_lims.components.resilience import CircuitBreaker, RemoteCounters, RetryPolicy
+
+
+class HttpTransport:
+
+    # The HttpTransport class holds the one requests.Session that a RemoteDataManager sends all of its
+    # requests through. The session keeps TCP/TLS connections to the LIMS alive between calls and pools them,
+    # so only the first request to the LIMS pays for the handshake.
+    #
+    # pool_connections is the number of per-host connection pools that are cached.
+    # pool_maxsize is the maximum number of connections kept open to any single host. Raise it when many
+    # threads share one transport, otherwise extra connections are opened and thrown away after each call.
+    # pool_block=True makes callers wait for a free connection instead of opening one past pool_maxsize.
+    #
+    # cache is an optional DiskResponseCache. When given, GET responses are served from and stored in it.
+    #
+    # timeout is the (connect, read) timeout in seconds of every request that doesn't pass its own. retry is a
+    # RetryPolicy and breaker a CircuitBreaker (see resilience.py); requests that fail with a connection error,
+    # a timeout or a retryable status are retried per the policy, and fail fast while the breaker is open.
+    # counters counts requests, retries, timeouts, connection errors and failures, for monitoring.
+    #
+    # metrics is an optional metrics.Metrics that every call's endpoint, status, latency, response size and
+    # retries are recorded in. Without it no timing is done at all.
+    #
+    # tracer is an optional tracing.Tracer. While it has sinks, every call is an 'http' span with the method,
+    # url path (never the query, which holds the token), status, request and response bytes and retries.
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, cache=None, timeout=(10, 120), retry=None, breaker=None,
+                 metrics=None, tracer=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.cache = cache
+        self.timeout = timeout
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.counters = RemoteCounters()
+        self.metrics = metrics
+        self.tracer = tracer
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.cache is not None and method == 'GET' and not kwargs.get('stream'):
+            return self._cachedget(url, **kwargs)
+        return self._call(method, url, **kwargs)
+
+    def stats(self):
+        # Counters, plus the state of the circuit breaker.
+        stats = self.counters.snapshot()
+        stats.update({'breaker_state': self.breaker.state, 'breaker_opens': self.breaker.opens, 'breaker_rejected': self.breaker.rejected})
+        return stats
+
+    def _call(self, method, url, **kwargs):
+        if self.metrics is None and (self.tracer is None or not self.tracer.sinks):
+            return self._send(method, url, **kwargs)
+        if self.tracer is None or not self.tracer.sinks:
+            return self._measuredsend(method, url, **kwargs)
+        data = kwargs.get('data')
+        with self.tracer.span('http', method=method, path=urlsplit(url).path, request_bytes=len(data) if data else 0) as span:
+            return self._measuredsend(method, url, span=span, **kwargs)
+
+    def _measuredsend(self, method, url, span=None, **kwargs):
+        # Streamed responses are measured up to their headers, and their size is taken from Content-Length.
+        start = time.perf_counter()
+        retries = []
+        try:
+            response = self._send(method, url, retries=retries, **kwargs)
+        except Exception as e:
+            if self.metrics is not None:
+                self.metrics.record(url, method, e, time.perf_counter() - start, retries=len(retries))
+            if span is not None:
+                span.set(retries=len(retries))
+            raise
+        if kwargs.get('stream'):
+            size = response.headers.get('Content-Length')
+            size = int(size) if size is not None and size.isdigit() else None
+        else:
+            size = len(response.content)
+        if self.metrics is not None:
+            self.metrics.record(url, method, response.status_code, time.perf_counter() - start, size=size, retries=len(retries))
+        if span is not None:
+            span.set(status=response.status_code, response_bytes=size, retries=len(retries))
+        return response
+
+    def _send(self, method, url, retries=None, **kwargs):
+        # Sends the request, retrying per self.retry. After the last attempt, a connection error or timeout is
+        # raised, and a response with an error status is returned for the caller to check as usual. If retries
+        # is a list, the number of each retry made is appended to it.
+        attempts = self.retry.attempts(method)
+        attempt = 1
+        while True:
+            self.breaker.check()
+            self.counters.increment('requests')
+            retry_after = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.breaker.failure()
+                self.counters.increment('timeouts' if isinstance(e, requests.exceptions.Timeout) else 'connection_errors')
+                if attempt >= attempts:
+                    self.counters.increment('failures')
+                    raise
+            except Exception:
+                # Anything else, e.g. a broken chunked body or an SSL error, isn't retried. It still counts as a
+                # failure, so that a half-open breaker whose trial request fails this way opens again.
+                self.breaker.failure()
+                self.counters.increment('failures')
+                raise
+            else:
+                if response.status_code >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                if response.status_code not in self.retry.statuses:
+                    return response
+                if attempt >= attempts:
+                    self.counters.increment('failures')
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+            self.counters.increment('retries')
+            if retries is not None:
+                retries.append(attempt)
+            time.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+    def _cachedget(self, url, **kwargs):
+        key = self.cache.key('GET', url, kwargs.get('params'))
+        cached = self.cache.load(key)
+        if cached is not None:
+            meta, body = cached
+            if self.cache.isfresh(meta):
+                self.cache.touch(key)
+                return self.cache.toresponse(meta, body)
+            headers = dict(kwargs.pop('headers', None) or {})
+            headers.update(self.cache.validators(meta))
+            kwargs['headers'] = headers
+
+        response = self._call('GET', url, **kwargs)
+        if cached is not None and response.status_code == 304:
+            self.cache.refresh(key, meta, response)
+            return self.cache.toresponse(meta, body, request=response.request)
+        if response.ok:
+            self.cache.store(key, response)
+        return response
+
+    def close(self):
+        self.session.close()
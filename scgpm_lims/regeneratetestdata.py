@@ -20,6 +20,6 @@ jsonfiles = glob.glob(os.path.join(os.path.dirname(__file__), 'testdata', '*.jso
 for jsonfile in jsonfiles:
     os.remove(jsonfile)
 
-conn = Connection(lims_url=args.lims_url, lims_token=args.lims_token, testdata_update_mode=True, verbose=True)
-for run in RUNS:
-    conn.getallrunobjects(run=run)
+with Connection(lims_url=args.lims_url, lims_token=args.lims_token, testdata_update_mode=True, verbose=True) as conn:
+    for run in RUNS:
+        conn.getallrunobjects(run=run)
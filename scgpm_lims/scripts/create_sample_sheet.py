@@ -10,6 +10,7 @@
 import sys
 import os
 from scgpm_lims import Connection
+from scgpm_lims.components.httpcache import DEFAULT_HTTP_CACHE_DIR
 import json
 import argparse
 
@@ -45,9 +46,24 @@ else:
 	parser.add_argument('-u', '--lims_url', help='LIMS url', required=True)
 parser.add_argument('-b','--bcl2fastq-version',required=True,type=int,help="int. The major version number of the bcl2fastq demultiplexer that was used to demultiplex the run.")
 parser.add_argument('-l','--lane',type=int,help="The number of the lane sequenced on the flowcell.")
+parser.add_argument('-e','--each-lane',action='store_true',help="Write a sample sheet for each lane of the run, all split from one all-lanes sample sheet, instead of a single sample sheet.")
+parser.add_argument('--cache-dir',nargs='?',const=DEFAULT_HTTP_CACHE_DIR,help="Keep an on-disk cache of LIMS responses in this directory (%(const)s if none is given), shared between\ninvocations. Cached sample sheets may be up to 10 minutes old. Off by default, so that every sample sheet is fetched fresh.")
+parser.add_argument('--render',action='store_true',help="Build the sample sheet from the run info instead of requesting it from the samplesheets endpoint.")
 
 args = parser.parse_args()
-conn = Connection(lims_url=args.lims_url, lims_token=args.lims_token, verbose=False)
+if args.each_lane and args.lane:
+	parser.error("--each-lane and --lane can't be used together.")
+conn = Connection(lims_url=args.lims_url, lims_token=args.lims_token, verbose=False, http_cache_dir=args.cache_dir, render_samplesheets=args.render)
+
+if args.each_lane:
+	lanesamplesheets = conn.getlanesamplesheets(run=args.run_name,bcl2fastq_version=args.bcl2fastq_version)
+	for lane in sorted(lanesamplesheets, key=int):
+		samplesheet = lanesamplesheets[lane]
+		fn = args.run_name + "_L" + lane + '_samplesheet.csv'
+		with open(fn, 'w') as f:
+			f.write(samplesheet)
+		print(fn)
+	sys.exit(0)
 
 fn = args.run_name
 if args.lane:
@@ -9,14 +9,21 @@
 ###
 
 import os
+import re
 import argparse
 
 from scgpm_lims import Connection
+from scgpm_lims.components.httpcache import DEFAULT_HTTP_CACHE_DIR
 
 description = "Given a file containing rows of flow cell IDs, retrieves the corresponding run names."
 parser = argparse.ArgumentParser(description=description,formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument("-i","--infile",required=True,help="The input file containing a single column with the flowcell ID, one per row. For example, if the run name is 170802_COOPER_0128_AHK23YBBXX, you'd enter AHK23YBBXX as the flowcell ID, or just the part that UHTS specifically tracks, which is HK23Y (the first five characters that follow the first character).")
 parser.add_argument("-o","--outfile",required=True,help="The output file, which is the same as the input file but with an extra column being the associated UHTS run name (tab-delimited).")
+parser.add_argument("--cache-dir",nargs="?",const=DEFAULT_HTTP_CACHE_DIR,help="Keep an on-disk cache of LIMS responses in this directory (%(const)s if none is given), shared between\ninvocations. Cached responses may be up to 10 minutes old. Off by default.")
+parser.add_argument("-b","--batch",action="store_true",help="""Batch mode for large input files. Duplicate flow cell IDs are looked up once, lookups run
+concurrently, and rows are written in input order as they're resolved. A lookup failure
+doesn't stop the run; instead its message is written to a third column (empty on success).""")
+parser.add_argument("-w","--workers",type=int,default=8,help="Number of concurrent lookups in batch mode (default %(default)s).")
 
 args = parser.parse_args()
 
@@ -25,18 +32,30 @@ if not os.path.exists(infile):
 	parser.error("Input file '{}' does not exist.".format(infile))
 outfile = args.outfile
 
-uhts = Connection()
+uhts = Connection(http_cache_dir=args.cache_dir, pool_maxsize=max(10, args.workers))
+
+def flowcell_ids(fh):
+	for line in fh:
+		line = line.strip()
+		if not line:
+			continue
+		if len(line) > 5: #if == 5, already the shortened version that the SolexaFlowCell.flowcell_id attribute stores.
+			line = line[1:6]
+		yield line
 
 fh = open(infile)
 fout = open(outfile,'w')
-for line in fh:
-	line = line.strip()
-	if not line:
-		continue
-	if len(line) > 5: #if == 5, already the shortened version that the SolexaFlowCell.flowcell_id attribute stores.
-		line = line[1:6]
-	run_name = uhts.get_runname_from_flowcell_id(line)	
-	fout.write(line + "\t" + run_name + "\n")
+if args.batch:
+	for flowcell_id, run_name, error in uhts.iter_runnames_from_flowcell_ids(flowcell_ids(fh), max_workers=args.workers):
+		if error is None:
+			fout.write(flowcell_id + "\t" + run_name + "\t\n")
+		else:
+			message = re.sub(r"token=[^&\s]*", "token=***", " ".join(str(error).split())) #urls in the error include the token
+			fout.write(flowcell_id + "\t\t" + message + "\n")
+		fout.flush()
+else:
+	for flowcell_id in flowcell_ids(fh):
+		run_name = uhts.get_runname_from_flowcell_id(flowcell_id)
+		fout.write(flowcell_id + "\t" + run_name + "\n")
 fh.close()
 fout.close()
-
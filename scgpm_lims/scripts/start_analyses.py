@@ -7,15 +7,14 @@
 # nathankw@stanford.edu                                                                                 
 ###
 
-import time
 import sys 
 import os
 import json
 import argparse
-from datetime import datetime
-import subprocess
+import signal
 
 from scgpm_lims import Connection
+from scgpm_lims.components.launcher import AnalysisLauncher
 from gbsc_utils.SequencingRuns import runPaths
 
 try:
@@ -33,42 +32,28 @@ description = """
             1) sequencing_run_status = sequencing_done
             2) analysis_done = false 
             4) The sequencing instrument isn't a HiSeq 4000 (since those aren't supported yet in the pipeline).
+
+        By default it makes one pass and exits, for running from cron. With --daemon it keeps running, polling
+        UHTS every --poll-interval seconds, with at most --max-running analyses running at once, until it gets
+        SIGTERM or SIGINT. Analyses still running then are left running.
 """
 parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter,description=description)
-parser.parse_args()
+parser.add_argument('--daemon',action='store_true',help="Keep running and poll UHTS every --poll-interval seconds.")
+parser.add_argument('--poll-interval',type=float,default=30,help="Seconds between polls of UHTS in daemon mode (default %(default)s).")
+parser.add_argument('--max-running',type=int,default=4,help="Maximum number of analyses running at once in daemon mode; more are queued (default %(default)s).")
+parser.add_argument('--check-workers',type=int,default=8,help="Number of runs checked concurrently (default %(default)s).")
+args = parser.parse_args()
 
 homedir = os.path.expanduser("~")
 fout = open(os.path.join(homedir,"uhts_automated_analyses.txt"),"a")
 conn = Connection()
-runs = conn.getrunstoanalyze()
-now = datetime.now()
-for r in runs:
-	if not runPaths.isCopyComplete(r):
-		continue
-	runinfo = conn.getruninfo(r)['run_info']
-	pipeline_runs = runinfo['pipeline_runs']
-	pipeline_run_ids = sorted(runinfo['pipeline_runs'],reverse=True)
-	most_recent_run = ""
-	most_recent_run_id = ""
-	if pipeline_run_ids:
-		most_recent_run_id = pipeline_run_ids[0]
-		most_recent_run = pipeline_runs[most_recent_run_id]
-		analysis_started = most_recent_run['started']
-		if analysis_started:
-			continue
-
-	if not pipeline_runs:
-		#create a pipeline run in UHTS
-		conn.createpipelinerun(run=r)
-		time.sleep(5) #there seems to be a delay in here, strangly, in getting the new pipeline run object to show
-	#start the analysis pipeline
-	cmd = "run_analysis.rb start_illumina_run --run {run} --force --verbose".format(run=r)
-	if most_recent_run:
-		cmd += " --rerun --pipeline-run-id {}".format(most_recent_run_id)
-	if r.find("SPENSER") >= 0 or r.find("HOLMES") >= 0 or r.find("M04199") >= 0: #MiSeqs
-		cmd += " --lanes 1"
-	fout.write(str(now) + "  " + cmd + "\n")
-	fout.flush()
-	print(cmd)
-	subprocess.Popen(cmd,shell=True,stderr=fout,stdout=fout)
+launcher = AnalysisLauncher(conn, runPaths.isCopyComplete, fout, max_running=args.max_running if args.daemon else None,
+                            check_workers=args.check_workers)
 
+if args.daemon:
+	signal.signal(signal.SIGTERM, lambda signum, frame: launcher.stop())
+	signal.signal(signal.SIGINT, lambda signum, frame: launcher.stop())
+	launcher.serve(poll_interval=args.poll_interval)
+else:
+	launcher.tick()
+	launcher.drain()
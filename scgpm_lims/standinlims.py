@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.sqlitelocal import SqliteDataManager
+from scgpm_lims.components.standin import StandInLims
+
+parser = ArgumentParser('Serve the local testdata over the LIMS HTTP API, for testing and benchmarking clients without the production LIMS')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=3000)
+parser.add_argument('--token', help='Only accept requests with this token. By default any token is accepted.')
+parser.add_argument('--latency', type=float, default=0, help='Seconds added to every response.')
+parser.add_argument('--jitter', type=float, default=0, help='Up to this many random extra seconds added to every response.')
+parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with --error-status instead.')
+parser.add_argument('--error-status', type=int, default=503)
+parser.add_argument('--seed', type=int)
+parser.add_argument('--local-db', help='Serve this SQLite local database instead of the JSON testdata.')
+parser.add_argument('--snapshot', help='Serve this testdata snapshot instead of the JSON testdata.')
+args = parser.parse_args()
+
+if args.local_db:
+    manager = SqliteDataManager(args.local_db)
+else:
+    manager = LocalDataManager(snapshotfile=args.snapshot)
+lims = StandInLims(manager, host=args.host, port=args.port, token=args.token, latency=args.latency, jitter=args.jitter,
+                   error_rate=args.error_rate, error_status=args.error_status, seed=args.seed)
+print('Serving the LIMS API at %s/api/v1/' % lims.url)
+try:
+    lims.serve_forever()
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import importlib.util
+import unittest
+from scgpm_lims.components.connection import Connection
+
+
+@unittest.skipIf(importlib.util.find_spec('numpy') is None, 'numpy is not installed')
+class TestQCTable(unittest.TestCase):
+
+    runs = ['141117_MONK_0387_AC4JCDACXX', '141126_PINKERTON_0343_BC4J1PACXX']
+
+    def setUp(self):
+        from scgpm_lims.components.analytics import QCTable
+        self.conn = Connection(local_only=True)
+        self.table = QCTable.fromconnection(self.conn, self.runs)
+
+    def _lanes(self, run):
+        return dict((str(lane['id']), int(number)) for number, lane in self.conn.getruninfo(run)['run_info']['lanes'].items())
+
+    def testLaneYieldMatchesLoop(self):
+        expected = {}
+        for run in self.runs:
+            lanes = self._lanes(run)
+            for laneresult in self.conn.indexlaneresults(run).values():
+                if laneresult['codepoint'] is None and laneresult['read_number'] == 1:
+                    expected[(run, lanes[str(laneresult['solexa_lane_id'])])] = laneresult['pass_read_count']
+        lane_yield = self.table.lane_yield()
+        self.assertEqual(dict(zip(zip(lane_yield['run'], lane_yield['lane']), lane_yield['pass_read_count'])), expected)
+
+    def testBarcodeFractionsSumToOnePerLane(self):
+        representation = self.table.barcode_representation()
+        totals = {}
+        for run, lane, fraction in zip(representation['run'], representation['lane'], representation['fraction']):
+            totals[(run, lane)] = totals.get((run, lane), 0) + fraction
+        for total in totals.values():
+            self.assertAlmostEqual(total, 1.0)
+
+    def testMappingRateMatchesLoop(self):
+        run = self.runs[0]
+        laneresults = self.conn.indexlaneresults(run)
+        lanes = self._lanes(run)
+        aligned = {}
+        passed = {}
+        for mapperresult in self.conn.indexmapperresults(run).values():
+            laneresult = laneresults[str(mapperresult['dataset_id'])]
+            if mapperresult['rank'] == 1 and laneresult['read_number'] == 1:
+                key = (lanes[str(laneresult['solexa_lane_id'])], laneresult['codepoint'])
+                aligned[key] = aligned.get(key, 0) + mapperresult['aligned_read_count']
+                passed[key] = passed.get(key, 0) + laneresult['pass_read_count']
+        rates = self.table.mapping_rates()
+        found = dict(((lane, barcode), rate) for r, lane, barcode, rate in
+                     zip(rates['run'], rates['lane'], rates['barcode'], rates['mapping_rate']) if r == run)
+        self.assertEqual(set(found), set(aligned))
+        for key in aligned:
+            self.assertAlmostEqual(found[key], aligned[key] / passed[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
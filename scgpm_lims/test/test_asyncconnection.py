@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+from scgpm_lims.components.asyncconnection import AsyncConnection
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.models import SolexaRun
+from scgpm_lims.components.sqlitelocal import SqliteDataManager
+from scgpm_lims.components.standin import StandInLims
+
+
+class TestAsyncConnection(unittest.TestCase):
+
+    run_name = '141117_MONK_0387_AC4JCDACXX'
+
+    def testGetRunInfoLocalOnly(self):
+        async def getruninfo():
+            async with AsyncConnection(local_only=True) as conn:
+                return await conn.getruninfo(run=self.run_name)
+        runinfo = asyncio.run(getruninfo())
+        self.assertEqual(runinfo['run_info']['sequencing_run_status'], SolexaRun.STATUS_SEQUENCING_DONE)
+
+    def testConcurrentCallsLocalOnly(self):
+        async def getmany():
+            conn = AsyncConnection(local_only=True, override_owner='test@example.edu')
+            results = await asyncio.gather(*[conn.getruninfo(run=self.run_name) for i in range(10)])
+            await conn.close()
+            return results
+        results = asyncio.run(getmany())
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0]['run_info']['lanes']['1']['submitter_email'], 'test@example.edu')
+
+    def testGetAllRunObjectsLocalOnly(self):
+        async def getall():
+            async with AsyncConnection(local_only=True) as conn:
+                return await conn.getallrunobjects(self.run_name)
+        bundle = asyncio.run(getall())
+        self.assertEqual(bundle.solexaflowcell['id'], 2102)
+        self.assertEqual(sorted(bundle.lanesamplesheets, key=int), [str(lane) for lane in range(1, 9)])
+
+    def testManyLocalOnly(self):
+        async def getmany():
+            async with AsyncConnection(local_only=True) as conn:
+                return (await conn.getruninfo_many([self.run_name, 'NO_SUCH_RUN', self.run_name], max_workers=2),
+                        await conn.indexlaneresults_many([self.run_name], lane=1))
+        runinfos, laneresults = asyncio.run(getmany())
+        self.assertEqual(list(runinfos), [self.run_name])
+        self.assertEqual(runinfos[self.run_name]['run_info']['run_name'], self.run_name)
+        self.assertEqual(list(runinfos.errors), ['NO_SUCH_RUN'])
+        self.assertTrue(laneresults[self.run_name])
+
+    def testRunnamesFromFlowcellIdsLocalOnly(self):
+        flowcells = ['C4JCD', 'XXXXX', 'C4J1P', 'C4JCD']
+        async def lookup():
+            async with AsyncConnection(local_only=True) as conn:
+                streamed = [result async for result in conn.iter_runnames_from_flowcell_ids(iter(flowcells), max_workers=1)]
+                return streamed, await conn.get_runnames_from_flowcell_ids(flowcells)
+        streamed, batch = asyncio.run(lookup())
+        self.assertEqual([result[0] for result in streamed], flowcells)
+        self.assertEqual(streamed[0][1], self.run_name)
+        self.assertEqual(streamed[2][1], '141126_PINKERTON_0343_BC4J1PACXX')
+        self.assertIsNone(streamed[1][1])
+        self.assertIn('could not be found', str(streamed[1][2]))
+        self.assertEqual(dict(batch), {'C4JCD': self.run_name, 'C4J1P': '141126_PINKERTON_0343_BC4J1PACXX'})
+        self.assertEqual(list(batch.errors), ['XXXXX'])
+
+    def testTestdataUpdateModeFlushesOffTheEventLoop(self):
+        tmpdir = tempfile.mkdtemp()
+        dbfile = os.path.join(tmpdir, 'lims.sqlite')
+        threads = []
+        async def record(url):
+            conn = AsyncConnection(lims_url=url, lims_token='x', testdata_update_mode=True, local_db=dbfile)
+            self.assertNotIsInstance(conn, Connection)
+            flush = conn.flush
+            conn.flush = lambda: (threads.append(threading.current_thread()), flush())
+            await conn.getruninfo(run=self.run_name)
+            await conn.indexlaneresults(self.run_name, lane=1)
+            await conn.close()
+        try:
+            with StandInLims() as lims:
+                asyncio.run(record(lims.url))
+            self.assertEqual(len(threads), 1)
+            self.assertIsNot(threads[0], threading.main_thread())
+            db = SqliteDataManager(dbfile)
+            self.assertEqual(db.getruninfo(self.run_name)['run_info']['run_name'], self.run_name)
+            self.assertTrue(db.indexlaneresults(self.run_name, lane=1))
+            db.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shutil
+import stat
+import tempfile
+import unittest
+from scgpm_lims.components.atomicfile import atomicopen, atomicwrite
+
+
+class TestAtomicFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'data.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def mode(self):
+        return stat.S_IMODE(os.stat(self.path).st_mode)
+
+    def testKeepsModeOfReplacedFile(self):
+        atomicwrite(self.path, 'one')
+        self.assertEqual(self.mode(), 0o644)
+        os.chmod(self.path, 0o640)
+        atomicwrite(self.path, b'two')
+        self.assertEqual(self.mode(), 0o640)
+        atomicwrite(self.path, 'three', mode=0o600)
+        self.assertEqual(self.mode(), 0o600)
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), 'three')
+
+    def testFailedWriteLeavesFileAndNoTempFile(self):
+        atomicwrite(self.path, 'before')
+        with self.assertRaises(ValueError):
+            with atomicopen(self.path) as fp:
+                fp.write('partial')
+                raise ValueError('interrupted')
+        self.assertEqual(os.listdir(self.dir), ['data.json'])
+        with open(self.path) as fp:
+            self.assertEqual(fp.read(), 'before')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import itertools
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scgpm_lims.components.connection import Connection
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    # Creates lane and mapper results with fresh ids, slowly, and rejects any with codepoint FAIL.
+    protocol_version = 'HTTP/1.1'
+    ids = itertools.count(1)
+    lock = threading.Lock()
+    active = 0
+    maxactive = 0
+    created = []
+
+    def do_POST(self):
+        with Handler.lock:
+            Handler.active += 1
+            Handler.maxactive = max(Handler.maxactive, Handler.active)
+        time.sleep(0.02)
+        paramdict = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with Handler.lock:
+            Handler.active -= 1
+            if paramdict.get('codepoint') == 'FAIL':
+                status, body = 422, {'error': 'invalid'}
+            else:
+                status, body = 200, dict(paramdict, id=next(Handler.ids))
+                Handler.created.append((self.path.split('?')[0], body))
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestBulkCreate(unittest.TestCase):
+
+    def setUp(self):
+        Handler.maxactive = 0
+        Handler.created = []
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.conn = Connection(lims_url='http://127.0.0.1:%s' % self.httpd.server_port, lims_token='token')
+        self.stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+        self.conn.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def testPartialFailureAndLinking(self):
+        laneresults = dict(((lane, codepoint), (RUN, lane, {'codepoint': codepoint, 'read_number': 1}))
+                           for lane in range(1, 5) for codepoint in ('AAAAAA', 'CCCCCC', 'FAIL'))
+        created = self.conn.createlaneresults_bulk(laneresults, max_workers=4)
+        self.assertFalse(created.ok())
+        self.assertEqual(sorted(created.errors), [(lane, 'FAIL') for lane in range(1, 5)])
+        self.assertEqual(len(created), 8)
+        self.assertLessEqual(Handler.maxactive, 4)
+        self.assertGreater(Handler.maxactive, 1)
+
+        mapperresults = [(key, {'rank': 1, 'aligned_read_count': 10}) for key in laneresults]
+        linked = self.conn.createmapperresults_bulk(mapperresults, laneresults=created)
+        self.assertEqual(len(linked), 8)
+        self.assertEqual(len(linked.errors), 4)
+        for position, mapperresult in linked.items():
+            self.assertEqual(mapperresult['dataset_id'], created[mapperresults[position][0]]['id'])
+        self.assertEqual(len([path for path, body in Handler.created if path.endswith('mapper_results')]), 8)
+
+    def testLocalOnly(self):
+        conn = Connection(local_only=True)
+        created = conn.createlaneresults_bulk([(RUN, 1, {'codepoint': 'AAAAAA', 'read_number': 1})])
+        linked = conn.createmapperresults_bulk([{'dataset_id': created[0]['id'], 'rank': 1}])
+        self.assertTrue(created.ok() and linked.ok())
+        self.assertIn(str(linked[0]['id']), conn.indexmapperresults(RUN))
+
+
+if __name__ == '__main__':
+    unittest.main()
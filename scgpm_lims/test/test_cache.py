@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import time
+import unittest
+from scgpm_lims.components.cache import ObjectCache
+
+
+class TestObjectCache(unittest.TestCase):
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        cache = ObjectCache(maxsize=2)
+        cache.set('runinfo', ('a',), 1)
+        cache.set('runinfo', ('b',), 2)
+        cache.get('runinfo', ('a',))
+        cache.set('runinfo', ('c',), 3)
+        self.assertEqual(cache.get('runinfo', ('b',)), (False, None))
+        self.assertEqual(cache.get('runinfo', ('a',)), (True, 1))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def testTtlPerKind(self):
+        cache = ObjectCache(ttl=60, ttls={'laneresults': 0.01, 'runinfo': None})
+        cache.set('laneresults', ('run',), {})
+        cache.set('runinfo', ('run',), {'id': 1})
+        time.sleep(0.02)
+        self.assertFalse(cache.get('laneresults', ('run',))[0])
+        self.assertTrue(cache.get('runinfo', ('run',))[0])
+
+    def testInvalidateByPrefix(self):
+        cache = ObjectCache()
+        cache.set('laneresults', ('run1', 1, None, None), {})
+        cache.set('laneresults', ('run1', None, None, None), {})
+        cache.set('laneresults', ('run2', None, None, None), {})
+        cache.invalidate('laneresults', 'run1')
+        self.assertEqual(cache.stats()['size'], 1)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shutil
+import tempfile
+import unittest
+
+import requests
+from scgpm_lims.components.cassette import Cassette
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.standin import StandInLims
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'lims.cassette')
+        self.stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        sys.stderr.close()
+        sys.stderr = self.stderr
+
+    def testRecordThenReplayWithoutServer(self):
+        with StandInLims(token='secret') as lims, Connection(lims_url=lims.url, lims_token='secret', cassette=self.path, cassette_mode='record') as conn:
+            runinfo = conn.getruninfo(RUN)
+            samplesheet = conn.getsamplesheet(RUN, 2, lane=1, filename=None)
+            laneresults = conn.indexlaneresults(RUN)
+            streamed = list(conn.iterlaneresults(RUN))
+            before = conn.showpipelinerun(conn.createpipelinerun(RUN, {'finished': False})['id'])
+            conn.updatepipelinerun(before['id'], {'finished': True})
+            after = conn.showpipelinerun(before['id'])
+            self.assertRaises(requests.exceptions.HTTPError, conn.showsolexarun, 1)
+            requestcount = lims.requests
+
+        with Connection(cassette=self.path) as conn:
+            self.assertEqual(conn.getruninfo(RUN), runinfo)
+            self.assertEqual(conn.getsamplesheet(RUN, 2, lane=1, filename=None), samplesheet)
+            self.assertEqual(conn.indexlaneresults(RUN), laneresults)
+            self.assertEqual(list(conn.iterlaneresults(RUN)), streamed)
+            self.assertEqual(conn.createpipelinerun(RUN, {'finished': False})['id'], before['id'])
+            # The same request made twice is answered with its recorded responses in order.
+            self.assertFalse(conn.showpipelinerun(before['id'])['finished'])
+            conn.updatepipelinerun(before['id'], {'finished': True})
+            self.assertEqual(conn.showpipelinerun(before['id']), after)
+            self.assertRaises(requests.exceptions.HTTPError, conn.showsolexarun, 1)
+            self.assertRaises(Exception, conn.getruninfo, 'not_recorded')
+            self.assertEqual(conn.remotestats(), {'replayed': requestcount, 'missing': 1})
+
+    def testFingerprintIgnoresTokenHostAndKeyOrder(self):
+        cassette = Cassette(self.path)
+        self.assertEqual(cassette.fingerprint('get', 'http://a/api/v1/run_info', {'run': RUN, 'token': 'x'}),
+                         cassette.fingerprint('GET', 'https://b:3000/api/v1/run_info', {'run': RUN, 'token': 'y'}))
+        self.assertEqual(cassette.fingerprint('POST', 'http://a/api/v1/mapper_results', data='{"a": 1, "b": 2}'),
+                         cassette.fingerprint('POST', 'http://a/api/v1/mapper_results', data='{"b": 2, "a": 1}'))
+        self.assertNotEqual(cassette.fingerprint('GET', 'http://a/api/v1/run_info', {'run': RUN}),
+                            cassette.fingerprint('GET', 'http://a/api/v1/run_info', {'run': 'other'}))
+
+    def testTruncatedEntryIsIgnored(self):
+        with StandInLims() as lims, Connection(lims_url=lims.url, lims_token='x', cassette=self.path, cassette_mode='record') as conn:
+            conn.getruninfo(RUN)
+            conn.indexpipelineruns(RUN)
+        with open(self.path, 'rb+') as fp:
+            fp.truncate(os.path.getsize(self.path) - 10)
+        cassette = Cassette(self.path)
+        self.assertEqual(len(cassette), 1)
+        self.assertNotIn(b'token', open(self.path, 'rb').read())
+        cassette.close()
+
+        # Recording more cuts off the broken entry first, so the new ones can be read back.
+        with StandInLims() as lims, Connection(lims_url=lims.url, lims_token='x', cassette=self.path, cassette_mode='record') as conn:
+            pipelineruns = conn.indexpipelineruns(RUN)
+        with Connection(cassette=self.path) as conn:
+            self.assertEqual(conn.indexpipelineruns(RUN), pipelineruns)
+            self.assertEqual(conn.remotestats()['missing'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
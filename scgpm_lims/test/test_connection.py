@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import unittest
+from scgpm_lims.components.connection import Connection
+
+
+class TestConnection(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = Connection(local_only=True, override_owner='test@example.edu')
+
+    def testGetRunInfoMany(self):
+        runs = ['141117_MONK_0387_AC4JCDACXX', 'NO_SUCH_RUN', '141126_PINKERTON_0343_BC4J1PACXX', '141117_MONK_0387_AC4JCDACXX']
+        results = self.conn.getruninfo_many(runs, max_workers=4)
+        self.assertEqual(list(results.keys()), ['141117_MONK_0387_AC4JCDACXX', '141126_PINKERTON_0343_BC4J1PACXX'])
+        self.assertEqual(list(results.errors.keys()), ['NO_SUCH_RUN'])
+        self.assertFalse(results.ok())
+        self.assertEqual(results['141117_MONK_0387_AC4JCDACXX']['run_info']['lanes']['1']['submitter_email'], 'test@example.edu')
+
+    def testReadCache(self):
+        conn = Connection(local_only=True, cache=True)
+        run = '141117_MONK_0387_AC4JCDACXX'
+        runinfo = conn.getruninfo(run)
+        runinfo['run_info']['sequencing_run_status'] = 'modified by caller'
+        self.assertEqual(conn.getruninfo(run)['run_info']['sequencing_run_status'], 'sequencing_done')
+        self.assertEqual(conn.cachestats()['hits'], 1)
+        self.assertEqual(conn.cachestats()['misses'], 1)
+
+    def testWriteInvalidatesCache(self):
+        conn = Connection(local_only=True, cache=True)
+        conn.showsolexarun('2290')
+        conn.updatesolexarun('2290', {'comments': 'updated'})
+        self.assertEqual(conn.showsolexarun('2290')['comments'], 'updated')
+        self.assertEqual(conn.cachestats()['hits'], 0)
+
+    def testGetAllRunObjects(self):
+        bundle = self.conn.getallrunobjects('141117_MONK_0387_AC4JCDACXX')
+        self.assertEqual(bundle.solexarun['id'], 2290)
+        self.assertEqual(bundle.solexaflowcell['id'], 2102)
+        self.assertEqual(bundle.get_lanes(), ['1', '2', '3', '4', '5', '6', '7', '8'])
+        self.assertTrue(bundle.lanesamplesheets['1'].startswith('FCID,Lane'))
+        self.assertEqual(len(bundle.pipelineruns), 1)
+        self.assertEqual(len(bundle.mapperresults), 50)
+
+    def testIterRunnamesFromFlowcellIds(self):
+        flowcells = ['C4JCD', 'XXXXX', 'C4J1P', 'C4JCD']
+        results = list(self.conn.iter_runnames_from_flowcell_ids(iter(flowcells), max_workers=2))
+        self.assertEqual([r[0] for r in results], flowcells)
+        self.assertEqual(results[0][1], '141117_MONK_0387_AC4JCDACXX')
+        self.assertEqual(results[2][1], '141126_PINKERTON_0343_BC4J1PACXX')
+        self.assertIsNone(results[1][1])
+        self.assertIsNotNone(results[1][2])
+
+    def testIterRunnamesFromFlowcellIdsDropsYieldedLookups(self):
+        looked = []
+        lookup = self.conn.server.get_runname_from_flowcell_id
+        self.conn.server.get_runname_from_flowcell_id = lambda flowcell_id: looked.append(flowcell_id) or lookup(flowcell_id)
+        flowcells = ['C4JCD', 'C4JCD'] + ['X%s' % i for i in range(20)] + ['C4JCD']
+        results = self.conn.iter_runnames_from_flowcell_ids(iter(flowcells), max_workers=1)
+        sizes = []
+        for result in results:
+            sizes.append(len(results.gi_frame.f_locals['futures']))
+        self.assertEqual(looked.count('C4JCD'), 2)
+        self.assertLessEqual(max(sizes), 5)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.httpcache import DiskResponseCache
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        Handler.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = b'{"id": 2290, "run_info": {"lanes": {}}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDiskResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        Handler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cachedir)
+
+    def testRevalidatesAcrossConnections(self):
+        with Connection(lims_url=self.url, lims_token='secret1', http_cache_dir=self.cachedir) as conn:
+            self.assertEqual(conn.getruninfo('run')['id'], 2290)
+        with Connection(lims_url=self.url, lims_token='secret2', http_cache_dir=self.cachedir) as conn:
+            self.assertEqual(conn.getruninfo('run')['id'], 2290)
+        self.assertEqual([etag for path, etag in Handler.requests], [None, '"v1"'])
+        for name in os.listdir(self.cachedir):
+            with open(os.path.join(self.cachedir, name), 'rb') as fp:
+                self.assertNotIn(b'secret', fp.read())
+
+    def testNoCache(self):
+        with Connection(lims_url=self.url, lims_token='secret', http_cache_dir=None) as conn:
+            conn.getruninfo('run')
+            conn.getruninfo('run')
+        self.assertEqual([etag for path, etag in Handler.requests], [None, None])
+        self.assertEqual(os.listdir(self.cachedir), [])
+
+    def testFailedWriteLeavesNoTempFile(self):
+        cache = DiskResponseCache(self.cachedir)
+        self.assertRaises(TypeError, cache._write, 'key', {'bad': object()}, b'body')
+        self.assertRaises(TypeError, cache._write, 'key', {}, 'not bytes')
+        self.assertEqual(os.listdir(self.cachedir), [])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import importlib.util
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.jsonstream import iterjsonarray
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    # Serves the testdata lane results of RUN with chunked transfer encoding, in small pieces.
+    protocol_version = 'HTTP/1.1'
+    body = b'[]'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i in range(0, len(self.body), 1000):
+            chunk = self.body[i:i + 1000]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def testAnyChunkBoundaries(self):
+        data = [{'id': i, 'codepoint': 'é' * i, 'count': 10 ** i, 'lanes': [1, None, {'x': 1.5}]} for i in range(20)] + [12345, 'x', []]
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        for size in (1, 3, 64, len(body)):
+            self.assertEqual(list(iterjsonarray(body[i:i + size] for i in range(0, len(body), size))), data)
+        self.assertEqual(list(iterjsonarray([b' [ ', b'] '])), [])
+
+    def testMalformed(self):
+        for body in (b'{"id": 1}', b'[1 2]', b'[1,]', b'[{"id": 1}'):
+            self.assertRaises(ValueError, list, iterjsonarray([body]))
+
+
+class TestStreamingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.local = Connection(local_only=True)
+        self.laneresults = self.local.indexlaneresults(RUN)
+        Handler.body = json.dumps(list(self.laneresults.values())).encode()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.conn = Connection(lims_url='http://127.0.0.1:%s' % self.httpd.server_port, lims_token='token')
+        self.conn.server.stream_chunk_size = 512
+
+    def tearDown(self):
+        self.conn.close()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def testIterLaneResultsMatchesIndex(self):
+        self.assertEqual(dict((str(r['id']), r) for r in self.conn.iterlaneresults(RUN)), self.conn.indexlaneresults(RUN))
+        self.assertEqual(list(self.conn.iterlaneresults(RUN)), list(self.local.iterlaneresults(RUN)))
+
+    def testFilterAndRecords(self):
+        def unbarcoded(laneresult):
+            return laneresult['codepoint'] is None
+        expected = [r['id'] for r in self.laneresults.values() if r['codepoint'] is None]
+        self.assertTrue(expected)
+        self.assertEqual([r.id for r in self.conn.iterlaneresults(RUN, filter=unbarcoded, records=True)], expected)
+        self.assertEqual([r['id'] for r in self.local.iterlaneresults(RUN, filter=unbarcoded)], expected)
+
+    @unittest.skipIf(importlib.util.find_spec('aiohttp') is None, 'aiohttp is not installed')
+    def testAsyncIterLaneResults(self):
+        from scgpm_lims.components.asyncconnection import AsyncConnection
+        async def collect():
+            async with AsyncConnection(lims_url='http://127.0.0.1:%s' % self.httpd.server_port, lims_token='token') as conn:
+                conn.server.stream_chunk_size = 512
+                return [r async for r in conn.iterlaneresults(RUN, filter=lambda r: r['read_number'] == 1)]
+        self.assertEqual(asyncio.run(collect()), [r for r in self.laneresults.values() if r['read_number'] == 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
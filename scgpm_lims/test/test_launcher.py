@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import io
+import threading
+import unittest
+
+from scgpm_lims.components.connection import BatchResults
+from scgpm_lims.components.launcher import AnalysisLauncher
+
+
+class FakeConnection:
+
+    # Runs to analyze, with their pipeline runs. New pipeline runs only show up in the runinfo after a few reads,
+    # like the delay seen in UHTS.
+
+    def __init__(self, pipelineruns, delay=2):
+        self.pipelineruns = pipelineruns
+        self.delay = delay
+        self.created = []
+        self.pending = {}
+
+    def getrunstoanalyze(self):
+        return list(self.pipelineruns)
+
+    def getruninfo(self, run):
+        for id, (created, reads) in list(self.pending.items()):
+            if created != run:
+                continue
+            if reads == 0:
+                self.pipelineruns[run][id] = {'started': False}
+                del self.pending[id]
+            else:
+                self.pending[id] = (run, reads - 1)
+        return {'run_info': {'pipeline_runs': dict(self.pipelineruns[run])}}
+
+    def getruninfo_many(self, runs, max_workers=None):
+        results = BatchResults()
+        for run in runs:
+            results[run] = self.getruninfo(run)
+        return results
+
+    def createpipelinerun(self, run):
+        id = str(9000 + len(self.created))
+        self.created.append(run)
+        self.pending[id] = (run, self.delay)
+        return {'id': int(id)}
+
+
+class FakeProcess:
+
+    def __init__(self):
+        self.status = None
+
+    def poll(self):
+        return self.status
+
+
+class TestAnalysisLauncher(unittest.TestCase):
+
+    def setUp(self):
+        self.processes = {}
+        self.log = io.StringIO()
+
+    def popen(self, cmd, **kwargs):
+        process = FakeProcess()
+        self.processes[cmd.split('--run ')[1].split()[0]] = process
+        return process
+
+    def launcher(self, conn, **kwargs):
+        return AnalysisLauncher(conn, lambda run: not run.startswith('COPYING'), self.log, popen=self.popen, backoff=0.001, **kwargs)
+
+    def testCommands(self):
+        conn = FakeConnection({
+            'NEW_RUN': {},
+            'RERUN': {'999': {'started': True}, '1000': {'started': False}},
+            'STARTED': {'1000': {'started': True}},
+            'COPYING': {},
+            '151204_SPENSER_0001': {},
+            })
+        launcher = self.launcher(conn, max_running=None)
+        # New pipeline runs only show up after a few reads, so those runs wait rather than holding up RERUN.
+        self.assertEqual(launcher.tick(), ['RERUN'])
+        self.assertEqual(sorted(launcher.waiting), ['151204_SPENSER_0001', 'NEW_RUN'])
+        self.assertEqual(sorted(conn.created), ['151204_SPENSER_0001', 'NEW_RUN'])
+        launcher.drain()
+        self.assertEqual(launcher.waiting, {})
+        self.assertEqual(sorted(launcher.children), ['151204_SPENSER_0001', 'NEW_RUN', 'RERUN'])
+        log = self.log.getvalue()
+        self.assertIn('--run NEW_RUN --force --verbose\n', log)
+        self.assertIn('--run RERUN --force --verbose --rerun --pipeline-run-id 1000\n', log)
+        self.assertIn('--run 151204_SPENSER_0001 --force --verbose --lanes 1\n', log)
+        self.assertNotIn("isn't in its run info", log)
+
+    def testMaxRunningAndReaping(self):
+        conn = FakeConnection(dict(('RUN%s' % i, {}) for i in range(5)))
+        launcher = self.launcher(conn, max_running=2)
+        launcher.tick()
+        launcher.drain()
+        self.assertEqual(len(launcher.children), 2)
+        self.assertEqual(len(launcher.queue), 3)
+        # Queued and running runs aren't prepared again by the next pass.
+        launcher.tick()
+        self.assertEqual(len(conn.created), 5)
+        finished = sorted(launcher.children)[0]
+        self.processes[finished].status = 0
+        launcher.reap()
+        launcher.launch()
+        self.assertNotIn(finished, launcher.children)
+        self.assertEqual(len(launcher.children), 2)
+        self.assertEqual(len(launcher.queue), 2)
+        self.assertIn('Analysis process for %s exited with status 0' % finished, self.log.getvalue())
+
+    def testWaitingRunTimesOut(self):
+        conn = FakeConnection({'RUN': {}}, delay=1000)
+        launcher = self.launcher(conn, pipelinerun_timeout=0.05)
+        self.assertEqual(launcher.tick(), [])
+        launcher.drain()
+        self.assertIn('RUN', launcher.children)
+        self.assertIn("Pipeline run 9000 of RUN isn't in its run info after 0.05s; starting anyway", self.log.getvalue())
+
+    def testServeStops(self):
+        conn = FakeConnection({'RUN': {}})
+        launcher = self.launcher(conn)
+        thread = threading.Thread(target=launcher.serve, kwargs={'poll_interval': 60, 'reap_interval': 0.01})
+        thread.start()
+        while 'RUN' not in self.processes:
+            thread.join(0.01)
+        self.processes['RUN'].status = 1
+        launcher.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(launcher.children, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
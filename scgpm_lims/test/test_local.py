@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import shutil
+import tempfile
+import time
+import unittest
+from scgpm_lims.components.local import LocalDataManager
+
+
+class TestLocalDataManager(unittest.TestCase):
+
+    run_name = '141117_MONK_0387_AC4JCDACXX'
+
+    def setUp(self):
+        self.local = LocalDataManager()
+
+    def testIndexLaneResultsMatchesFullScan(self):
+        laneids = set(str(lane['id']) for lane in self.local.getruninfo(self.run_name)['run_info']['lanes'].values())
+        expected = set(id for id, laneresult in self.local._laneresults.items() if str(laneresult['solexa_lane_id']) in laneids)
+        self.assertEqual(set(self.local.indexlaneresults(self.run_name)), expected)
+
+    def testIndexLaneResultsFilters(self):
+        laneresults = self.local.indexlaneresults(self.run_name, lane=1, barcode='ATCACG', readnumber=1)
+        self.assertTrue(laneresults)
+        for laneresult in laneresults.values():
+            self.assertEqual(laneresult['codepoint'], 'ATCACG')
+            self.assertEqual(laneresult['read_number'], 1)
+
+    def testIndexMapperResults(self):
+        laneresultids = set(self.local.indexlaneresults(self.run_name))
+        mapperresults = self.local.indexmapperresults(self.run_name)
+        self.assertEqual(len(mapperresults), 50)
+        for mapperresult in mapperresults.values():
+            self.assertIn(str(mapperresult['dataset_id']), laneresultids)
+
+    def testWritesKeepIndexesCurrent(self):
+        pipelinerun = self.local.createpipelinerun(self.run_name)
+        self.assertIn(str(pipelinerun['id']), self.local.indexpipelineruns(self.run_name))
+
+        laneresult = self.local.createlaneresult({'codepoint': 'NNNNNN', 'read_number': 1}, run=self.run_name, lane=1)
+        mapperresult = self.local.createmapperresult({'dataset_id': laneresult['id']})
+        self.assertIn(str(mapperresult['id']), self.local.indexmapperresults(self.run_name))
+
+        self.local.updatemapperresult(mapperresult['id'], {'dataset_id': 0})
+        self.assertNotIn(str(mapperresult['id']), self.local.indexmapperresults(self.run_name))
+
+        self.local.deletelaneresults(self.run_name, 1)
+        self.assertEqual(self.local.indexlaneresults(self.run_name, lane=1), {})
+        self.assertTrue(self.local.indexlaneresults(self.run_name, lane=2))
+
+    def testCollectionsLoadOnFirstAccess(self):
+        local = LocalDataManager()
+        local.getruninfo(self.run_name)
+        self.assertIn('_runinfo', local.__dict__)
+        self.assertNotIn('_laneresults', local.__dict__)
+        self.assertNotIn('_laneresultsbylane', local.__dict__)
+        local.indexlaneresults(self.run_name)
+        self.assertIn('_laneresultsbylane', local.__dict__)
+
+    def testInstancesShareRecordsButNotWrites(self):
+        other = LocalDataManager()
+        id = list(self.local._laneresults)[0]
+        self.assertIs(self.local._laneresults[id], other._laneresults[id])
+        self.local.updatelaneresult(id, {'comments': 'updated'})
+        self.assertEqual(self.local.showlaneresult(id)['comments'], 'updated')
+        self.assertIsNone(other.showlaneresult(id)['comments'])
+
+    def testReloadsWhenFileChanges(self):
+        testdatadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, testdatadir)
+        class TempDataManager(LocalDataManager):
+            _testdatadir = testdatadir
+        with open(os.path.join(testdatadir, 'runinfo.json'), 'w') as fp:
+            json.dump({'run1': {'id': 1}}, fp)
+        self.assertEqual(TempDataManager().getruninfo('run1')['id'], 1)
+        time.sleep(0.01)
+        with open(os.path.join(testdatadir, 'runinfo.json'), 'w') as fp:
+            json.dump({'run1': {'id': 22}}, fp)
+        self.assertEqual(TempDataManager().getruninfo('run1')['id'], 22)
+
+    def _tempdatamanager(self, **kwargs):
+        testdatadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, testdatadir)
+        class TempDataManager(LocalDataManager):
+            _testdatadir = testdatadir
+        for datafile in ('runinfo.json', 'samplesheets.json', 'solexaruns.json', 'solexaflowcells.json',
+                         'pipelineruns.json', 'laneresults.json', 'mapperresults.json'):
+            with open(os.path.join(testdatadir, datafile), 'w') as fp:
+                fp.write('{}')
+        return TempDataManager(**kwargs), testdatadir
+
+    def _mtimes(self, testdatadir):
+        return dict((name, os.stat(os.path.join(testdatadir, name)).st_mtime_ns) for name in os.listdir(testdatadir))
+
+    def testFlushWritesOnlyChangedCollections(self):
+        local, testdatadir = self._tempdatamanager()
+        before = self._mtimes(testdatadir)
+        time.sleep(0.01)
+        local.addlaneresult(1, {'id': 1, 'solexa_lane_id': 5})
+        local.flush()
+        after = self._mtimes(testdatadir)
+        self.assertEqual([name for name in after if after[name] != before[name]], ['laneresults.json'])
+        mtime = after['laneresults.json']
+
+        # Recording the same object again doesn't mark the collection dirty.
+        local.addlaneresult(1, {'id': 1, 'solexa_lane_id': 5})
+        self.assertEqual(local._dirty, set())
+        local.flush()
+        self.assertEqual(os.stat(os.path.join(testdatadir, 'laneresults.json')).st_mtime_ns, mtime)
+
+    def testFlushEvery(self):
+        local, testdatadir = self._tempdatamanager(flush_every=2)
+        local.addsolexarun(1, {'id': 1})
+        with open(os.path.join(testdatadir, 'solexaruns.json')) as fp:
+            self.assertEqual(json.load(fp), {})
+        local.addsolexarun(2, {'id': 2})
+        with open(os.path.join(testdatadir, 'solexaruns.json')) as fp:
+            self.assertEqual(set(json.load(fp)), set(['1', '2']))
+
+    def testSamplesheetsFlushWithAnyLaneType(self):
+        # Recording code passes the lane as None, int or str; all of them have to land on the same keys.
+        local, testdatadir = self._tempdatamanager()
+        local.addsamplesheet('run1', 'all lanes')
+        local.addsamplesheet('run1', 'lane 1', lane=1)
+        local.addsamplesheet('run1', 'lane 2', lane='2')
+        local.addsolexarun(1, {'id': 1})
+        local.flush()
+        with open(os.path.join(testdatadir, 'samplesheets.json')) as fp:
+            self.assertEqual(json.load(fp), {'run1': {'null': 'all lanes', '1': 'lane 1', '2': 'lane 2'}})
+        with open(os.path.join(testdatadir, 'solexaruns.json')) as fp:
+            self.assertEqual(set(json.load(fp)), set(['1']))
+        self.assertEqual(local.getsamplesheet('run1'), 'all lanes')
+        self.assertEqual(local.getsamplesheet('run1', lane='1'), 'lane 1')
+        self.assertEqual(local.getsamplesheet('run1', lane=2), 'lane 2')
+
+    def testFailedWriteKeepsPreviousFile(self):
+        local, testdatadir = self._tempdatamanager()
+        local.addsolexarun(1, {'id': 1})
+        local.flush()
+        local.addsolexarun(2, {'id': 2, 'bad': object()})
+        self.assertRaises(TypeError, local.flush)
+        self.assertFalse([name for name in os.listdir(testdatadir) if name.endswith('.tmp')])
+        with open(os.path.join(testdatadir, 'solexaruns.json')) as fp:
+            self.assertEqual(set(json.load(fp)), set(['1']))
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.metrics import LATENCY_BUCKETS, Histogram, Metrics
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/api/v1/solexa_runs/404'):
+            status, body = 404, b'{"error": "not found"}'
+        else:
+            status, body = 200, b'{"id": 1, "name": "run"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestMetrics(unittest.TestCase):
+
+    def testPercentilesFromBuckets(self):
+        histogram = Histogram(LATENCY_BUCKETS)
+        values = [random.uniform(0.01, 2.0) for i in range(10000)]
+        for value in values:
+            histogram.observe(value)
+        values.sort()
+        for fraction in (0.5, 0.95, 0.99):
+            exact = values[int(fraction * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(fraction) / exact, 1, delta=0.25)
+        self.assertEqual(histogram.summary()['max'], values[-1])
+
+    def testEndpointNames(self):
+        metrics = Metrics()
+        self.assertEqual(metrics.endpoint('https://lims.example.edu/api/v1/solexa_runs/2290'), 'solexa_runs/:id')
+        self.assertEqual(metrics.endpoint('http://127.0.0.1:3000/uhts/api/v1/run_info'), 'run_info')
+        self.assertEqual(metrics.endpoint('http://127.0.0.1:3000/api/v1/'), '')
+
+
+class TestConnectionMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%s' % self.httpd.server_port
+        self.tmpdir = tempfile.mkdtemp()
+        self.stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def testRecordsCallsAndWritesPrometheus(self):
+        with Connection(lims_url=self.url, lims_token='token', metrics=True) as conn:
+            for id in (1, 2, 3):
+                conn.showsolexarun(id)
+            self.assertRaises(Exception, conn.showsolexarun, 404)
+            snapshot = dict(((s['endpoint'], s['status']), s) for s in conn.metrics())
+            self.assertEqual(snapshot[('solexa_runs/:id', 200)]['count'], 3)
+            self.assertEqual(snapshot[('solexa_runs/:id', 404)]['count'], 1)
+            self.assertEqual(snapshot[('solexa_runs/:id', 200)]['size']['total'], 3 * 24)
+            self.assertGreater(snapshot[('solexa_runs/:id', 200)]['latency']['p99'], 0)
+
+            path = os.path.join(self.tmpdir, 'lims.prom')
+            conn.writemetrics(path)
+            with open(path) as f:
+                text = f.read()
+        self.assertIn('# TYPE scgpm_lims_request_duration_seconds histogram', text)
+        self.assertIn('scgpm_lims_request_duration_seconds_count{endpoint="solexa_runs/:id",method="GET",status="200"} 3', text)
+        self.assertIn('scgpm_lims_request_duration_seconds_bucket{endpoint="solexa_runs/:id",method="GET",status="404",le="+Inf"} 1', text)
+        self.assertIn('scgpm_lims_retries_total{endpoint="solexa_runs/:id",method="GET",status="200"} 0', text)
+
+    def testDisabledByDefault(self):
+        with Connection(lims_url=self.url, lims_token='token') as conn:
+            conn.showsolexarun(1)
+            self.assertIsNone(conn.metrics())
+            self.assertIsNone(conn.server.transport.metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
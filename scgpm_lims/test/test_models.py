@@ -5,7 +5,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import unittest
 from scgpm_lims.components.connection import Connection
-from scgpm_lims.components.models import RunInfo, SolexaRun
+from scgpm_lims.components.models import MapperResult, RunInfo, SolexaLaneResult, SolexaRun
 
 
 class TestRunInfo(unittest.TestCase):
@@ -18,5 +18,37 @@ class TestRunInfo(unittest.TestCase):
     def testGetSolexaRunStatus(self):
         self.assertEqual(self.runinfo.get_solexa_run_status(), SolexaRun.STATUS_SEQUENCING_DONE)
 
+class TestRecords(unittest.TestCase):
+
+    run_name = '141117_MONK_0387_AC4JCDACXX'
+
+    def setUp(self):
+        self.conn = Connection(local_only=True)
+
+    def testRoundTripsApiDicts(self):
+        for mapperresult in self.conn.indexmapperresults(self.run_name).values():
+            self.assertEqual(MapperResult.from_dict(mapperresult).to_dict(), mapperresult)
+        for laneresult in self.conn.indexlaneresults(self.run_name).values():
+            self.assertEqual(SolexaLaneResult.from_dict(laneresult).to_dict(), laneresult)
+
+    def testSparseCountersAndExtraKeys(self):
+        record = MapperResult.from_dict({'id': 1, 'pf_aligned_read_count': 5, 'aligned_read_count': None,
+                                         'max_hits': 'many', 'new_metric': 3})
+        self.assertEqual(len(record._counters), 1)
+        self.assertEqual(record.pf_aligned_read_count, 5)
+        self.assertIsNone(record.aligned_read_count)
+        self.assertEqual(record['max_hits'], 'many')
+        self.assertEqual(record.new_metric, 3)
+        self.assertIsNone(record.dataset_id)
+        self.assertRaises(KeyError, lambda: record['dataset_id'])
+        self.assertEqual(record.to_dict(), {'id': 1, 'pf_aligned_read_count': 5, 'aligned_read_count': None,
+                                            'max_hits': 'many', 'new_metric': 3})
+
+    def testIndexMethodsReturnRecords(self):
+        mapperresults = self.conn.indexmapperresults(self.run_name, records=True)
+        self.assertEqual(dict((id, record.to_dict()) for id, record in mapperresults.items()),
+                         self.conn.indexmapperresults(self.run_name))
+        self.assertIsInstance(self.conn.indexsolexaruns(self.run_name, records=True).popitem()[1], SolexaRun)
+
 if __name__=='__main__':
     unittest.main()
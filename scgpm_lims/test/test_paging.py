@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import threading
+import unittest
+from unittest import mock
+from scgpm_lims.components.asyncconnection import AsyncConnection
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.paging import PageIterator
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+class TestPageIterator(unittest.TestCase):
+
+    def setUp(self):
+        self.items = list(range(10))
+        self.requested = []
+        self.failpage = None
+
+    def getpage(self, page, page_size):
+        self.requested.append(page)
+        if page == self.failpage:
+            self.failpage = None
+            raise Exception('page %s failed' % page)
+        return self.items[(page - 1) * page_size:page * page_size]
+
+    def testPagesAndLastPage(self):
+        self.assertEqual(list(PageIterator(self.getpage, 4)), [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(self.requested, [1, 2, 3])
+        # When the last page is full, one more request finds the end.
+        self.requested = []
+        self.assertEqual(len(list(PageIterator(self.getpage, 5, prefetch=False))), 2)
+        self.assertEqual(self.requested, [1, 2, 3])
+
+    def testPrefetchesNextPage(self):
+        fetched = threading.Event()
+        def getpage(page, page_size):
+            if page == 2:
+                fetched.set()
+            return self.getpage(page, page_size)
+        pages = PageIterator(getpage, 4)
+        next(pages)
+        self.assertTrue(fetched.wait(5))
+
+    def testFailedPageIsRetried(self):
+        self.failpage = 2
+        pages = PageIterator(self.getpage, 4)
+        self.assertEqual(next(pages), [0, 1, 2, 3])
+        self.assertRaises(Exception, next, pages)
+        self.assertEqual(list(pages), [[4, 5, 6, 7], [8, 9]])
+        self.assertEqual(self.requested.count(1), 1)
+
+    def testStopsWhenPagesRepeat(self):
+        # A server that ignores the paging parameters returns everything on every page.
+        def getpage(page, page_size):
+            self.requested.append(page)
+            return dict((str(item), item) for item in self.items)
+        self.assertEqual(list(PageIterator(getpage, 4, ids=dict.keys)), [dict((str(item), item) for item in self.items)])
+        self.assertEqual(self.requested, [1, 2])
+
+
+class TestConnectionPaging(unittest.TestCase):
+
+    def testPagedIndexMatchesIndex(self):
+        conn = Connection(local_only=True)
+        paged = Connection(local_only=True, page_size=7)
+        for method in ('indexsolexaruns', 'indexpipelineruns', 'indexlaneresults', 'indexmapperresults'):
+            self.assertEqual(getattr(paged, method)(RUN), getattr(conn, method)(RUN))
+        self.assertEqual(paged.indexlaneresults(RUN, lane=1, barcode='ATCACG', readnumber=1), conn.indexlaneresults(RUN, lane=1, barcode='ATCACG', readnumber=1))
+        pages = list(conn.iterpages('mapperresults', RUN, page_size=20))
+        self.assertEqual([len(page) for page in pages], [20, 20, 10])
+
+    def testLocalPagesIndexOnce(self):
+        conn = Connection(local_only=True, page_size=5)
+        indexed = []
+        index = conn.server.indexmapperresults
+        conn.server.indexmapperresults = lambda *args, **kwargs: indexed.append(args) or index(*args, **kwargs)
+        self.assertEqual(len(conn.indexmapperresults(RUN)), 50)
+        self.assertEqual(len(indexed), 1)
+
+    def testFailedPagedIndexClosesIterator(self):
+        conn = Connection(local_only=True, page_size=5)
+        getpage = conn.server.getpage
+        def failing(kind, page, page_size, run, **filters):
+            if page == 2:
+                raise Exception('page 2 failed')
+            return getpage(kind, page, page_size, run, **filters)
+        conn.server.getpage = failing
+        iterators = []
+        class RecordingPageIterator(PageIterator):
+            def __init__(self, *args, **kwargs):
+                PageIterator.__init__(self, *args, **kwargs)
+                iterators.append(self)
+        with mock.patch('scgpm_lims.components.connection.PageIterator', RecordingPageIterator):
+            self.assertRaises(Exception, conn.indexmapperresults, RUN)
+        self.assertTrue(iterators[0].done)
+        self.assertIsNone(iterators[0]._executor)
+
+    def testAsyncPagedIndex(self):
+        async def index():
+            async with AsyncConnection(local_only=True) as conn:
+                pages = [page async for page in conn.iterpages('laneresults', RUN, page_size=100)]
+                return pages, await conn.indexlaneresults(RUN, page_size=100), await conn.indexlaneresults(RUN)
+        pages, paged, laneresults = asyncio.run(index())
+        self.assertEqual(paged, laneresults)
+        self.assertEqual(sum(len(page) for page in pages), len(laneresults))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import importlib.util
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from scgpm_lims.components.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from scgpm_lims.components.transport import HttpTransport
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    # Fails the first `failures` requests with 503 (or by stalling past the client's timeout if `stall` is
+    # set), then answers 200.
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+    stall = 0
+    count = 0
+
+    def respond(self):
+        Handler.count += 1
+        if Handler.count <= Handler.failures:
+            if Handler.stall:
+                time.sleep(Handler.stall)
+            status = 503
+        else:
+            status = 200
+        body = b'{"ok": true}'
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up.
+            pass
+
+    do_GET = respond
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def testOpensAndRecovers(self):
+        now = [0]
+        breaker = CircuitBreaker(threshold=3, reset_time=10, clock=lambda: now[0])
+        for i in range(3):
+            breaker.check()
+            breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpenError, breaker.check)
+        now[0] = 10
+        breaker.check()
+        self.assertRaises(CircuitOpenError, breaker.check)
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        now[0] = 20
+        breaker.check()
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.check()
+        self.assertEqual((breaker.opens, breaker.rejected), (2, 2))
+
+    def testRetryPolicy(self):
+        policy = RetryPolicy(retries=4, backoff=1, max_backoff=5)
+        self.assertEqual((policy.attempts('GET'), policy.attempts('POST')), (5, 1))
+        self.assertEqual(RetryPolicy(retries=4, retry_writes=True).attempts('PATCH'), 5)
+        for attempt in range(1, 6):
+            self.assertTrue(0 <= policy.delay(attempt) <= min(5, 2 ** (attempt - 1)))
+        self.assertEqual(policy.delay(1, retry_after='2'), 2)
+
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        Handler.count = 0
+        Handler.failures = 0
+        Handler.stall = 0
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%s/api/v1/ok' % self.httpd.server_port
+
+    def tearDown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def transport(self, **kwargs):
+        return HttpTransport(retry=RetryPolicy(retries=3, backoff=0), **kwargs)
+
+    def testRetriesReadsNotWrites(self):
+        Handler.failures = 2
+        transport = self.transport()
+        self.assertEqual(transport.get(self.url).status_code, 200)
+        stats = transport.stats()
+        self.assertEqual((stats['requests'], stats['retries'], stats['failures']), (3, 2, 0))
+        Handler.count = 0
+        self.assertEqual(transport.post(self.url, data='{}').status_code, 503)
+        self.assertEqual(Handler.count, 1)
+
+    def testTimeoutsAndBreaker(self):
+        Handler.failures = 100
+        Handler.stall = 0.5
+        transport = self.transport(timeout=(1, 0.1), breaker=CircuitBreaker(threshold=4, reset_time=60))
+        self.assertRaises(requests.exceptions.Timeout, transport.get, self.url)
+        self.assertRaises(CircuitOpenError, transport.get, self.url)
+        stats = transport.stats()
+        self.assertEqual((stats['timeouts'], stats['failures'], stats['breaker_state'], stats['breaker_rejected']), (4, 1, 'open', 1))
+
+    def testFailedTrialOfAnyKindReopensBreaker(self):
+        now = [0]
+        breaker = CircuitBreaker(threshold=1, reset_time=10, clock=lambda: now[0])
+        transport = self.transport(breaker=breaker)
+        breaker.failure()
+        now[0] = 10
+        def broken(method, url, **kwargs):
+            raise requests.exceptions.ChunkedEncodingError('Connection broken: IncompleteRead')
+        transport.session.request = broken
+        self.assertRaises(requests.exceptions.ChunkedEncodingError, transport.get, self.url)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpenError, transport.get, self.url)
+        del transport.session.request
+        now[0] = 20
+        self.assertEqual(transport.get(self.url).status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @unittest.skipIf(importlib.util.find_spec('aiohttp') is None, 'aiohttp is not installed')
+    def testAsyncRetries(self):
+        from scgpm_lims.components.asyncremote import AsyncRemoteDataManager
+        Handler.failures = 2
+        async def call():
+            server = AsyncRemoteDataManager(apiversion='v1', lims_url='http://127.0.0.1:%s' % self.httpd.server_port,
+                                            lims_token='token', retry=RetryPolicy(retries=3, backoff=0))
+            try:
+                return await server._request('GET', 'ok'), server.stats()
+            finally:
+                await server.close()
+        result, stats = asyncio.run(call())
+        self.assertEqual(result, {'ok': True})
+        self.assertEqual((stats['requests'], stats['retries']), (3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import json
+import shutil
+import tempfile
+import unittest
+
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.samplesheet import rendersamplesheet, reversecomplement, splitsamplesheet
+from scgpm_lims.components.standin import StandInLims
+
+TESTDATA = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'testdata'))
+RUN = '141117_MONK_0387_AC4JCDACXX'
+DUALRUN = '141126_PINKERTON_0343_BC4J1PACXX'
+
+
+class TestSampleSheet(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(TESTDATA, 'runinfo.json')) as f:
+            self.runinfo = json.load(f)
+        with open(os.path.join(TESTDATA, 'samplesheets.json')) as f:
+            self.samplesheets = json.load(f)
+
+    def testVersion1MatchesLims(self):
+        for run, samplesheets in self.samplesheets.items():
+            for lane, samplesheet in samplesheets.items():
+                lane = None if lane == 'null' else lane
+                self.assertEqual(rendersamplesheet(self.runinfo[run], 1, lane=lane), samplesheet, (run, lane))
+
+    def testVersion2ReverseComplementsI5(self):
+        self.assertEqual(reversecomplement('TAGATCGC'), 'GCGATCTA')
+        self.assertEqual(reversecomplement('acgtN'), 'Nacgt')
+        lines = rendersamplesheet(self.runinfo[DUALRUN], 2, lane=7).splitlines()
+        self.assertEqual(lines[:2], ['[Data]', 'Lane,Sample_ID,Sample_Name,index,index2,Sample_Project'])
+        self.assertEqual(lines[2], '7,lane7_TAAGGCGA-TAGATCGC,lane7_TAAGGCGA-TAGATCGC,TAAGGCGA,GCGATCTA,C4J1P')
+        self.assertEqual(len(lines), 2 + 96)
+        self.assertEqual(rendersamplesheet(self.runinfo[DUALRUN], 2, lane=3).splitlines()[2], '3,lane3,lane3,,,C4J1P')
+        self.assertRaises(Exception, rendersamplesheet, self.runinfo[DUALRUN], 2, lane=9)
+
+    def testConnectionRendersWithoutSamplesheetRequests(self):
+        with StandInLims() as lims, Connection(lims_url=lims.url, lims_token='x', render_samplesheets=True, metrics=True) as conn:
+            bundle = conn.getallrunobjects(RUN)
+            endpoints = set(series['endpoint'] for series in conn.metrics())
+        self.assertNotIn('samplesheets', endpoints)
+        self.assertEqual(bundle.samplesheet, self.samplesheets[RUN]['null'])
+        self.assertEqual(bundle.lanesamplesheets, dict((lane, samplesheet) for lane, samplesheet in self.samplesheets[RUN].items() if lane != 'null'))
+
+    def testSplitMatchesLanes(self):
+        for run, samplesheets in self.samplesheets.items():
+            whole = samplesheets['null']
+            expected = dict((lane, samplesheet) for lane, samplesheet in samplesheets.items() if lane != 'null')
+            self.assertEqual(splitsamplesheet(whole), expected)
+            # Fed in small chunks, as read from a stream.
+            self.assertEqual(splitsamplesheet(whole[i:i + 7] for i in range(0, len(whole), 7)), expected)
+        whole = rendersamplesheet(self.runinfo[DUALRUN], 2)
+        self.assertEqual(splitsamplesheet(whole), dict((lane, rendersamplesheet(self.runinfo[DUALRUN], 2, lane=lane)) for lane in self.runinfo[DUALRUN]['run_info']['lanes']))
+        self.assertRaises(Exception, splitsamplesheet, 'no,header\n')
+
+    def testOneSamplesheetRequestPerRun(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with StandInLims() as lims, Connection(lims_url=lims.url, lims_token='x', testdata_update_mode=True, local_db=os.path.join(directory, 'lims.sqlite'), metrics=True) as conn:
+                self.assertEqual(conn.getlanesamplesheets(RUN, 1)['3'], self.samplesheets[RUN]['3'])
+                bundle = conn.getallrunobjects(RUN)
+                requests = sum(series['count'] for series in conn.metrics() if series['endpoint'] == 'samplesheets')
+                self.assertEqual(conn.autosaveserver.getsamplesheet(RUN, lane=8), self.samplesheets[RUN]['8'])
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(requests, 2)
+        self.assertEqual(bundle.lanesamplesheets['8'], self.samplesheets[RUN]['8'])
+
+    def testRecordsSamplesheetsToJsonTestdata(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        class TempDataManager(LocalDataManager):
+            _testdatadir = directory
+        for datafile in ('runinfo.json', 'samplesheets.json', 'solexaruns.json', 'solexaflowcells.json',
+                         'pipelineruns.json', 'laneresults.json', 'mapperresults.json'):
+            with open(os.path.join(directory, datafile), 'w') as fp:
+                fp.write('{}')
+        with StandInLims() as lims, Connection(lims_url=lims.url, lims_token='x', testdata_update_mode=True) as conn:
+            conn.autosaveserver = TempDataManager()
+            conn.getallrunobjects(RUN)
+            conn.getsamplesheet(RUN, 1, lane=2, filename=None)
+        with open(os.path.join(directory, 'samplesheets.json')) as fp:
+            self.assertEqual(json.load(fp), {RUN: self.samplesheets[RUN]})
+        # The collections flushed after the samplesheets are written too.
+        with open(os.path.join(directory, 'mapperresults.json')) as fp:
+            self.assertTrue(json.load(fp))
+
+
+if __name__ == '__main__':
+    unittest.main()
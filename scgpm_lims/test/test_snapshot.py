@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shutil
+import tempfile
+import unittest
+from scgpm_lims.components.local import LocalDataManager
+
+
+class TestSnapshot(unittest.TestCase):
+
+    run_name = '141117_MONK_0387_AC4JCDACXX'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.snapshotfile = os.path.join(self.tmpdir, 'testdata.snapshot')
+        self.json = LocalDataManager()
+        self.json.writesnapshot(self.snapshotfile)
+        self.local = LocalDataManager(snapshotfile=self.snapshotfile)
+
+    def testReadsMatchJson(self):
+        for method in ('getruninfo', 'getsamplesheet', 'indexsolexaruns', 'indexpipelineruns', 'indexlaneresults', 'indexmapperresults'):
+            self.assertEqual(getattr(self.local, method)(self.run_name), getattr(self.json, method)(self.run_name), method)
+        self.assertEqual(self.local.getsamplesheet(self.run_name, lane=1), self.json.getsamplesheet(self.run_name, lane=1))
+        self.assertEqual(self.local.indexlaneresults(self.run_name, lane=1, barcode='ATCACG', readnumber=1),
+                         self.json.indexlaneresults(self.run_name, lane=1, barcode='ATCACG', readnumber=1))
+
+    def testOnlyReadRecordsAreParsed(self):
+        id = list(self.json._laneresults)[0]
+        self.local.showlaneresult(id)
+        self.assertEqual(len(self.local._laneresults.base._parsed), 1)
+
+    def testWritesStayInInstanceUntilFlushed(self):
+        laneresult = self.local.createlaneresult({'codepoint': 'NNNNNN', 'read_number': 1}, run=self.run_name, lane=1)
+        self.local.deletelaneresults(self.run_name, 2)
+        self.assertIn(str(laneresult['id']), self.local.indexlaneresults(self.run_name, lane=1))
+        self.assertEqual(self.local.indexlaneresults(self.run_name, lane=2), {})
+        self.assertTrue(LocalDataManager(snapshotfile=self.snapshotfile).indexlaneresults(self.run_name, lane=2))
+
+        self.local.flush()
+        reopened = LocalDataManager(snapshotfile=self.snapshotfile)
+        self.assertIn(str(laneresult['id']), reopened.indexlaneresults(self.run_name, lane=1))
+        self.assertEqual(reopened.indexlaneresults(self.run_name, lane=2), {})
+        self.assertFalse([name for name in os.listdir(self.tmpdir) if name.endswith('.tmp')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import shutil
+import tempfile
+import unittest
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.sqlitelocal import SqliteDataManager
+
+
+class TestSqliteDataManager(unittest.TestCase):
+
+    run_name = '141117_MONK_0387_AC4JCDACXX'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpdir, 'lims.sqlite')
+        self.json = LocalDataManager()
+        self.db = SqliteDataManager(self.dbfile)
+        self.db.importjson(self.json)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def testReadsMatchJsonStore(self):
+        flowcell = self.json.getruninfo(self.run_name)['run_info']['flow_cell']
+        self.assertEqual(self.db.get_runname_from_flowcell_id(flowcell), self.run_name)
+        self.assertEqual(self.db.getruninfo(self.run_name), self.json.getruninfo(self.run_name))
+        self.assertEqual(self.db.getsamplesheet(self.run_name), self.json.getsamplesheet(self.run_name))
+        self.assertEqual(self.db.getsamplesheet(self.run_name, lane=1), self.json.getsamplesheet(self.run_name, lane=1))
+        self.assertEqual(self.db.indexsolexaruns(self.run_name), self.json.indexsolexaruns(self.run_name))
+        self.assertEqual(self.db.indexpipelineruns(self.run_name), self.json.indexpipelineruns(self.run_name))
+        self.assertEqual(self.db.indexlaneresults(self.run_name), self.json.indexlaneresults(self.run_name))
+        self.assertEqual(self.db.indexlaneresults(self.run_name, lane=1, barcode='ATCACG', readnumber=1),
+                         self.json.indexlaneresults(self.run_name, lane=1, barcode='ATCACG', readnumber=1))
+        self.assertEqual(self.db.indexmapperresults(self.run_name), self.json.indexmapperresults(self.run_name))
+        self.assertEqual(self.db.getlaneid(self.run_name, 1), self.json.getlaneid(self.run_name, 1))
+
+    def testWritesPersist(self):
+        pipelinerun = self.db.createpipelinerun(self.run_name)
+        laneresult = self.db.createlaneresult({'codepoint': 'NNNNNN', 'read_number': 1}, run=self.run_name, lane=1)
+        mapperresult = self.db.createmapperresult({'dataset_id': laneresult['id']})
+        self.db.updatelaneresult(laneresult['id'], {'active': False})
+
+        reopened = SqliteDataManager(self.dbfile)
+        self.assertIn(str(pipelinerun['id']), reopened.indexpipelineruns(self.run_name))
+        self.assertFalse(reopened.indexlaneresults(self.run_name, lane=1, barcode='NNNNNN')[str(laneresult['id'])]['active'])
+        self.assertIn(str(mapperresult['id']), reopened.indexmapperresults(self.run_name))
+
+        reopened.deletelaneresults(self.run_name, 1)
+        self.assertEqual(self.db.indexlaneresults(self.run_name, lane=1), {})
+        self.assertNotIn(str(mapperresult['id']), self.db.indexmapperresults(self.run_name))
+        reopened.close()
+
+    def testEmptyDatabaseHasNoTestdata(self):
+        empty = SqliteDataManager(os.path.join(self.tmpdir, 'empty.sqlite'))
+        self.assertNotIsInstance(empty, LocalDataManager)
+        self.assertFalse(hasattr(empty, 'writesnapshot'))
+        self.assertIsNone(empty.getruninfo(self.run_name))
+        self.assertIsNone(empty.getrunid(self.run_name))
+        self.assertEqual(empty.getpage('laneresults', 1, 10, self.run_name), [])
+        self.assertEqual(list(empty.iterlaneresults(self.run_name)), [])
+        empty.close()
+
+    def testConnectionLocalDb(self):
+        with Connection(local_only=True, local_db=self.dbfile) as conn:
+            bundle = conn.getallrunobjects(self.run_name)
+            self.assertEqual(bundle.laneresults, self.json.indexlaneresults(self.run_name))
+
+
+if __name__ == '__main__':
+    unittest.main()
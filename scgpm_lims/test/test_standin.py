@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import threading
+import unittest
+
+import requests
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.samplesheet import rendersamplesheet
+from scgpm_lims.components.standin import StandInLims
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+class TestStandInLims(unittest.TestCase):
+
+    def setUp(self):
+        self.local = Connection(local_only=True)
+        self.stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+
+    def testServesSameDataAsLocal(self):
+        with StandInLims(token='secret') as lims, Connection(lims_url=lims.url, lims_token='secret') as conn:
+            self.assertEqual(vars(conn.getallrunobjects(RUN, bcl2fastq_version=1)), vars(self.local.getallrunobjects(RUN, bcl2fastq_version=1)))
+            laneresults = self.local.indexlaneresults(RUN)
+            self.assertEqual(conn.indexlaneresults(RUN, page_size=100), laneresults)
+            self.assertEqual(conn.indexlaneresults(RUN, lane=1), self.local.indexlaneresults(RUN, lane=1))
+            id = next(iter(laneresults))
+            self.assertEqual(conn.showlaneresult(id), laneresults[id])
+
+            pipelinerun = conn.createpipelinerun(RUN, {'finished': False})
+            conn.updatepipelinerun(pipelinerun['id'], {'finished': True})
+            self.assertTrue(conn.showpipelinerun(pipelinerun['id'])['finished'])
+            self.assertRaises(requests.exceptions.HTTPError, conn.showsolexarun, 1)
+
+        with StandInLims(token='secret') as lims, Connection(lims_url=lims.url, lims_token='wrong') as conn:
+            self.assertRaises(requests.exceptions.HTTPError, conn.testconnection)
+
+    def testRendersVersion2Samplesheets(self):
+        runinfo = self.local.getruninfo(RUN)
+        with StandInLims() as lims, Connection(lims_url=lims.url, lims_token='x') as conn:
+            self.assertEqual(conn.getsamplesheet(RUN, 2, filename=None), rendersamplesheet(runinfo, 2))
+            self.assertEqual(conn.getsamplesheet(RUN, 2, lane=1, filename=None), rendersamplesheet(runinfo, 2, lane=1))
+        lims = StandInLims()
+        try:
+            self.assertEqual(lims.handle('GET', ['samplesheets'], {'run': RUN, 'lane': '9', 'bcl2fastq_version': '2'}, None)[0], 404)
+            self.assertEqual(lims.handle('GET', ['samplesheets'], {'run': RUN, 'bcl2fastq_version': '3'}, None)[0], 404)
+        finally:
+            lims.server.server_close()
+
+    def testReadsDontWaitForEachOther(self):
+        lims = StandInLims()
+        try:
+            with lims.datalock.reading():
+                done = threading.Event()
+                thread = threading.Thread(target=lambda: (lims.handle('GET', ['ok'], {}, None), done.set()))
+                thread.start()
+                self.assertTrue(done.wait(5))
+                thread.join()
+        finally:
+            lims.server.server_close()
+
+    def testInjectedErrorsAreRetried(self):
+        with StandInLims(error_rate=0.5, seed=1) as lims, Connection(lims_url=lims.url, lims_token='x', retries=10) as conn:
+            conn.server.transport.retry.backoff = 0
+            for i in range(10):
+                self.assertTrue(conn.getruninfo(RUN))
+            self.assertGreater(lims.errors, 0)
+            self.assertEqual(conn.remotestats()['retries'], lims.errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import asyncio
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import unittest
+
+import requests
+from scgpm_lims.components.asyncconnection import AsyncConnection
+from scgpm_lims.components.connection import Connection
+from scgpm_lims.components.standin import StandInLims
+from scgpm_lims.components.tracing import NOSPAN, Tracer
+
+RUN = '141117_MONK_0387_AC4JCDACXX'
+
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.stderr, sys.stderr = sys.stderr, open(os.devnull, 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        sys.stderr.close()
+        sys.stderr = self.stderr
+
+    def testDisabledByDefault(self):
+        conn = Connection(local_only=True)
+        self.assertIs(conn.tracer.span('getruninfo', run=RUN), NOSPAN)
+        self.assertTrue(conn.getruninfo(RUN))
+
+    def testLogFormatsOnlyWhenVerbose(self):
+        class Unprintable:
+            def __str__(self):
+                raise AssertionError('formatted while not verbose')
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            Connection(local_only=True).logf('value %s', Unprintable())
+            conn = Connection(local_only=True, verbose=True)
+            conn.log({'b': 1}, True)
+            conn.logf('run %s lane %s', RUN, 1)
+        self.assertTrue(out.getvalue().endswith("{ 'b': 1}\nrun %s lane 1\n" % RUN))
+
+    def testCompositeCallsAreNested(self):
+        spans = []
+        conn = Connection(local_only=True, tracer=Tracer([spans.append]))
+        conn.getallrunobjects(RUN)
+        byname = dict((span.name, span) for span in spans)
+        root = byname['Connection.getallrunobjects']
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(root.attributes, {'run': RUN, 'bcl2fastq_version': 1})
+        # The calls made from worker threads are still children of getallrunobjects.
+        for name in ('Connection.getruninfo', 'Connection.indexlaneresults', 'Connection.showsolexaflowcell'):
+            self.assertEqual(byname[name].parent_id, root.span_id)
+            self.assertEqual(byname[name].trace_id, root.trace_id)
+        self.assertEqual(byname['Connection.indexlaneresults'].attributes['result_size'], len(conn.indexlaneresults(RUN)))
+
+    def testHttpSpansWrittenAsJsonLines(self):
+        path = os.path.join(self.dir, 'trace.jsonl')
+        with StandInLims() as lims, Connection(lims_url=lims.url, lims_token='secret', trace_file=path) as conn:
+            conn.createlaneresult({'cluster_count': 1}, RUN, 1)
+            self.assertRaises(requests.exceptions.HTTPError, conn.showsolexarun, 1)
+        self.assertNotIn('secret', open(path).read())
+        spans = [json.loads(line) for line in open(path)]
+        self.assertEqual([span['name'] for span in spans], ['http', 'Connection.createlaneresult', 'http', 'Connection.showsolexarun'])
+        http, create, failedhttp, failed = spans
+        self.assertEqual(http['parent_id'], create['span_id'])
+        self.assertEqual(http['attributes']['method'], 'POST')
+        self.assertEqual(http['attributes']['path'], '/api/v1/solexa_lane_results')
+        self.assertEqual(http['attributes']['status'], 200)
+        self.assertGreater(http['attributes']['request_bytes'], 0)
+        self.assertGreater(http['attributes']['response_bytes'], 0)
+        self.assertEqual(create['attributes']['lane'], 1)
+        self.assertGreaterEqual(create['duration'], http['duration'])
+        self.assertEqual(failedhttp['attributes']['status'], 404)
+        self.assertIn('HTTPError', failed['error'])
+        # The sink made for trace_file is removed on close.
+        self.assertEqual(conn.tracer.sinks, [])
+
+    def testAsyncCallsAreNested(self):
+        spans = []
+
+        async def run():
+            with StandInLims() as lims:
+                async with AsyncConnection(lims_url=lims.url, lims_token='x', tracer=Tracer([spans.append])) as conn:
+                    await asyncio.gather(conn.getruninfo(RUN), conn.indexpipelineruns(RUN))
+
+        asyncio.run(run())
+        byid = dict((span.span_id, span) for span in spans)
+        parents = sorted(byid[span.parent_id].name for span in spans if span.name == 'http')
+        self.assertEqual(parents, ['AsyncConnection.getruninfo', 'AsyncConnection.indexpipelineruns'])
+
+
+if __name__ == '__main__':
+    unittest.main()
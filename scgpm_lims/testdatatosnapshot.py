@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+from scgpm_lims.components.local import LocalDataManager
+
+parser = ArgumentParser('Convert the JSON testdata into a snapshot file, for use with Connection(local_snapshot=...)')
+parser.add_argument('snapshotfile')
+args = parser.parse_args()
+
+LocalDataManager().writesnapshot(args.snapshotfile)
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+
+from argparse import ArgumentParser
+from scgpm_lims.components.local import LocalDataManager
+from scgpm_lims.components.sqlitelocal import SqliteDataManager
+
+parser = ArgumentParser('Import the JSON testdata into an SQLite local database, for use with Connection(local_db=...)')
+parser.add_argument('dbfile')
+args = parser.parse_args()
+
+db = SqliteDataManager(args.dbfile)
+db.importjson(LocalDataManager())
+db.close()
@@ -21,5 +21,9 @@ setup(
     "requests",
     "urllib3"
   ],
+  extras_require = {
+    "async": ["aiohttp"],
+    "analytics": ["numpy"]
+  },
   scripts = glob.glob("scgpm_lims/scripts/*.py")
 )